@@ -0,0 +1,61 @@
+"""add_generation_checkpoints_table
+
+Revision ID: 2d7c5e9a4b16
+Revises: 4f8d2a6b1c93
+Create Date: 2026-10-17 18:32:14.518630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2d7c5e9a4b16'
+down_revision: Union[str, None] = '4f8d2a6b1c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('generation_checkpoints',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('task_id', sa.String(length=64), nullable=False),
+    sa.Column('task_type', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('stage', sa.String(length=30), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=True),
+    sa.Column('module_id', sa.Integer(), nullable=False),
+    sa.Column('requirement_file_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('agent_ids', sa.JSON(), nullable=False),
+    sa.Column('params', sa.JSON(), nullable=True),
+    sa.Column('context_hash', sa.String(length=64), nullable=True),
+    sa.Column('produced', sa.JSON(), nullable=True),
+    sa.Column('completed', sa.JSON(), nullable=True),
+    sa.Column('progress', sa.Integer(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('resumed_by_task_id', sa.String(length=64), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['module_id'], ['modules.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['requirement_file_id'], ['requirement_files.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_generation_checkpoints_id'), 'generation_checkpoints', ['id'], unique=False)
+    op.create_index(op.f('ix_generation_checkpoints_task_id'), 'generation_checkpoints', ['task_id'], unique=True)
+    op.create_index(op.f('ix_generation_checkpoints_status'), 'generation_checkpoints', ['status'], unique=False)
+    op.create_index(op.f('ix_generation_checkpoints_project_id'), 'generation_checkpoints', ['project_id'], unique=False)
+    op.create_index(op.f('ix_generation_checkpoints_requirement_file_id'), 'generation_checkpoints', ['requirement_file_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_generation_checkpoints_requirement_file_id'), table_name='generation_checkpoints')
+    op.drop_index(op.f('ix_generation_checkpoints_project_id'), table_name='generation_checkpoints')
+    op.drop_index(op.f('ix_generation_checkpoints_status'), table_name='generation_checkpoints')
+    op.drop_index(op.f('ix_generation_checkpoints_task_id'), table_name='generation_checkpoints')
+    op.drop_index(op.f('ix_generation_checkpoints_id'), table_name='generation_checkpoints')
+    op.drop_table('generation_checkpoints')
@@ -0,0 +1,36 @@
+"""add_incremental_generation_fingerprints
+
+Revision ID: 4f8d2a6b1c93
+Revises: 9b3e7f1c5a28
+Create Date: 2026-10-17 17:48:36.902157
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f8d2a6b1c93'
+down_revision: Union[str, None] = '9b3e7f1c5a28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('requirement_files', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('generation_fingerprint', sa.JSON(), nullable=True))
+
+    with op.batch_alter_table('requirement_points', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('source_segment_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_requirement_points_source_segment_hash'), ['source_segment_hash'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('requirement_points', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_requirement_points_source_segment_hash'))
+        batch_op.drop_column('source_segment_hash')
+
+    with op.batch_alter_table('requirement_files', schema=None) as batch_op:
+        batch_op.drop_column('generation_fingerprint')
@@ -0,0 +1,53 @@
+"""add_async_tasks_table
+
+Revision ID: 7b3e1f9c5a28
+Revises: 2d7c5e9a4b16
+Create Date: 2026-10-17 21:06:47.302915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3e1f9c5a28'
+down_revision: Union[str, None] = '2d7c5e9a4b16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('async_tasks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('task_id', sa.String(length=64), nullable=False),
+    sa.Column('task_type', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('progress', sa.Integer(), nullable=False),
+    sa.Column('total_batches', sa.Integer(), nullable=False),
+    sa.Column('completed_batches', sa.Integer(), nullable=False),
+    sa.Column('message', sa.Text(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('worker_id', sa.String(length=100), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_async_tasks_id'), 'async_tasks', ['id'], unique=False)
+    op.create_index(op.f('ix_async_tasks_task_id'), 'async_tasks', ['task_id'], unique=True)
+    op.create_index(op.f('ix_async_tasks_status'), 'async_tasks', ['status'], unique=False)
+    op.create_index(op.f('ix_async_tasks_heartbeat_at'), 'async_tasks', ['heartbeat_at'], unique=False)
+    op.create_index(op.f('ix_async_tasks_completed_at'), 'async_tasks', ['completed_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_async_tasks_completed_at'), table_name='async_tasks')
+    op.drop_index(op.f('ix_async_tasks_heartbeat_at'), table_name='async_tasks')
+    op.drop_index(op.f('ix_async_tasks_status'), table_name='async_tasks')
+    op.drop_index(op.f('ix_async_tasks_task_id'), table_name='async_tasks')
+    op.drop_index(op.f('ix_async_tasks_id'), table_name='async_tasks')
+    op.drop_table('async_tasks')
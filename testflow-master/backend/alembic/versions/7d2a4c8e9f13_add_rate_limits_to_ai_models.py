@@ -0,0 +1,32 @@
+"""add_rate_limits_to_ai_models
+
+Revision ID: 7d2a4c8e9f13
+Revises: 3c9e1f7a2b64
+Create Date: 2026-10-17 11:03:27.518842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2a4c8e9f13'
+down_revision: Union[str, None] = '3c9e1f7a2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('ai_models', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rpm_limit', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('tpm_limit', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('max_in_flight', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('ai_models', schema=None) as batch_op:
+        batch_op.drop_column('max_in_flight')
+        batch_op.drop_column('tpm_limit')
+        batch_op.drop_column('rpm_limit')
@@ -0,0 +1,60 @@
+"""add_test_case_signatures_table
+
+Revision ID: 9b3e7f1c5a28
+Revises: c7f19b2e4d30
+Create Date: 2026-10-17 17:21:05.274913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e7f1c5a28'
+down_revision: Union[str, None] = 'c7f19b2e4d30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('test_case_signatures',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('test_case_id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=True),
+    sa.Column('module_id', sa.Integer(), nullable=True),
+    sa.Column('simhash', sa.BigInteger(), nullable=False),
+    sa.Column('band0', sa.Integer(), nullable=False),
+    sa.Column('band1', sa.Integer(), nullable=False),
+    sa.Column('band2', sa.Integer(), nullable=False),
+    sa.Column('band3', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('duplicate_of_id', sa.Integer(), nullable=True),
+    sa.Column('distance', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['test_case_id'], ['test_cases.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['module_id'], ['modules.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['duplicate_of_id'], ['test_cases.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_test_case_signatures_id'), 'test_case_signatures', ['id'], unique=False)
+    op.create_index(op.f('ix_test_case_signatures_test_case_id'), 'test_case_signatures', ['test_case_id'], unique=True)
+    op.create_index(op.f('ix_test_case_signatures_project_id'), 'test_case_signatures', ['project_id'], unique=False)
+    op.create_index(op.f('ix_test_case_signatures_module_id'), 'test_case_signatures', ['module_id'], unique=False)
+    op.create_index(op.f('ix_test_case_signatures_duplicate_of_id'), 'test_case_signatures', ['duplicate_of_id'], unique=False)
+    for i in range(4):
+        op.create_index(f'ix_test_case_signatures_project_band{i}', 'test_case_signatures', ['project_id', f'band{i}'], unique=False)
+
+
+def downgrade() -> None:
+    for i in range(4):
+        op.drop_index(f'ix_test_case_signatures_project_band{i}', table_name='test_case_signatures')
+    op.drop_index(op.f('ix_test_case_signatures_duplicate_of_id'), table_name='test_case_signatures')
+    op.drop_index(op.f('ix_test_case_signatures_module_id'), table_name='test_case_signatures')
+    op.drop_index(op.f('ix_test_case_signatures_project_id'), table_name='test_case_signatures')
+    op.drop_index(op.f('ix_test_case_signatures_test_case_id'), table_name='test_case_signatures')
+    op.drop_index(op.f('ix_test_case_signatures_id'), table_name='test_case_signatures')
+    op.drop_table('test_case_signatures')
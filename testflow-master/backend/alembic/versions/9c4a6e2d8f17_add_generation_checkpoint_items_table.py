@@ -0,0 +1,88 @@
+"""add_generation_checkpoint_items_table
+
+Revision ID: 9c4a6e2d8f17
+Revises: 7b3e1f9c5a28
+Create Date: 2026-10-17 23:14:05.661204
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4a6e2d8f17'
+down_revision: Union[str, None] = '7b3e1f9c5a28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _checkpoints_table():
+    return sa.table('generation_checkpoints',
+        sa.column('id', sa.Integer()),
+        sa.column('produced', sa.JSON()),
+        sa.column('completed', sa.JSON()),
+    )
+
+
+def upgrade() -> None:
+    items = op.create_table('generation_checkpoint_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('checkpoint_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=30), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['checkpoint_id'], ['generation_checkpoints.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_generation_checkpoint_items_id'), 'generation_checkpoint_items', ['id'], unique=False)
+    op.create_index(op.f('ix_generation_checkpoint_items_checkpoint_id'), 'generation_checkpoint_items', ['checkpoint_id'], unique=False)
+
+    # 已有检查点的进度从 JSON 列迁移到进度项
+    bind = op.get_bind()
+    checkpoints = _checkpoints_table()
+    rows = []
+    for checkpoint_id, produced, completed in bind.execute(
+        sa.select(checkpoints.c.id, checkpoints.c.produced, checkpoints.c.completed)
+    ):
+        for is_completed, data in ((False, produced), (True, completed)):
+            if isinstance(data, str):
+                data = json.loads(data)
+            for kind, ids in (data or {}).items():
+                rows.extend(
+                    {'checkpoint_id': checkpoint_id, 'kind': kind, 'item_id': item_id, 'completed': is_completed}
+                    for item_id in ids
+                )
+    if rows:
+        op.bulk_insert(items, rows)
+    bind.execute(checkpoints.update().values(produced=sa.null(), completed=sa.null()))
+
+
+def downgrade() -> None:
+    # 进度项写回 JSON 列
+    bind = op.get_bind()
+    checkpoints = _checkpoints_table()
+    items = sa.table('generation_checkpoint_items',
+        sa.column('id', sa.Integer()),
+        sa.column('checkpoint_id', sa.Integer()),
+        sa.column('kind', sa.String()),
+        sa.column('item_id', sa.Integer()),
+        sa.column('completed', sa.Boolean()),
+    )
+    progress = {}
+    for checkpoint_id, kind, item_id, is_completed in bind.execute(
+        sa.select(items.c.checkpoint_id, items.c.kind, items.c.item_id, items.c.completed).order_by(items.c.id)
+    ):
+        ids = progress.setdefault(checkpoint_id, ({}, {}))[1 if is_completed else 0].setdefault(kind, [])
+        if item_id not in ids:
+            ids.append(item_id)
+    for checkpoint_id, (produced, completed) in progress.items():
+        bind.execute(
+            checkpoints.update().where(checkpoints.c.id == checkpoint_id).values(produced=produced, completed=completed)
+        )
+
+    op.drop_index(op.f('ix_generation_checkpoint_items_checkpoint_id'), table_name='generation_checkpoint_items')
+    op.drop_index(op.f('ix_generation_checkpoint_items_id'), table_name='generation_checkpoint_items')
+    op.drop_table('generation_checkpoint_items')
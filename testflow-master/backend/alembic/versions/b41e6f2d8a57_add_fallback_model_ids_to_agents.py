@@ -0,0 +1,28 @@
+"""add_fallback_model_ids_to_agents
+
+Revision ID: b41e6f2d8a57
+Revises: 7d2a4c8e9f13
+Create Date: 2026-10-17 13:26:54.097315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41e6f2d8a57'
+down_revision: Union[str, None] = '7d2a4c8e9f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('agents', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fallback_model_ids', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('agents', schema=None) as batch_op:
+        batch_op.drop_column('fallback_model_ids')
@@ -0,0 +1,46 @@
+"""add_llm_telemetry_to_task_logs
+
+Revision ID: c7f19b2e4d30
+Revises: e5a8c3d1f702
+Create Date: 2026-10-17 16:02:41.518263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7f19b2e4d30'
+down_revision: Union[str, None] = 'e5a8c3d1f702'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('task_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('run_id', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('stage', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('model', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('ttft', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('prompt_tokens', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('completion_tokens', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('retry_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('cache_hit', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('error_class', sa.String(length=30), nullable=True))
+        batch_op.create_index(batch_op.f('ix_task_logs_run_id'), ['run_id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('task_logs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_task_logs_run_id'))
+        batch_op.drop_column('error_class')
+        batch_op.drop_column('cache_hit')
+        batch_op.drop_column('retry_count')
+        batch_op.drop_column('completion_tokens')
+        batch_op.drop_column('prompt_tokens')
+        batch_op.drop_column('ttft')
+        batch_op.drop_column('model')
+        batch_op.drop_column('stage')
+        batch_op.drop_column('run_id')
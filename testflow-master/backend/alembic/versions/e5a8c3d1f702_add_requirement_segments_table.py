@@ -0,0 +1,42 @@
+"""add_requirement_segments_table
+
+Revision ID: e5a8c3d1f702
+Revises: b41e6f2d8a57
+Create Date: 2026-10-17 15:42:18.530671
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a8c3d1f702'
+down_revision: Union[str, None] = 'b41e6f2d8a57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('requirement_segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('requirement_file_id', sa.Integer(), nullable=False),
+    sa.Column('segment_index', sa.Integer(), nullable=False),
+    sa.Column('heading', sa.String(length=500), nullable=True),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('token_count', sa.Integer(), nullable=False),
+    sa.Column('terms', sa.JSON(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['requirement_file_id'], ['requirement_files.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_requirement_segments_id'), 'requirement_segments', ['id'], unique=False)
+    op.create_index(op.f('ix_requirement_segments_requirement_file_id'), 'requirement_segments', ['requirement_file_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_requirement_segments_requirement_file_id'), table_name='requirement_segments')
+    op.drop_index(op.f('ix_requirement_segments_id'), table_name='requirement_segments')
+    op.drop_table('requirement_segments')
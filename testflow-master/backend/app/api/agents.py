@@ -7,7 +7,7 @@ from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
 from app.database import get_db
-from app.core.dependencies import get_current_active_user
+from app.core.dependencies import get_current_active_user, get_current_admin_user
 from app.models.user import User
 from app.services.agent_service_real import agent_service_real as agent_service
 from app.schemas.user import User as UserSchema
@@ -32,6 +32,7 @@ class TestPointGenerationRequest(BaseModel):
     """
     requirement_points: List[dict] = Field(..., description="需求点列表")
     agent_id: Optional[int] = Field(default=None, description="指定智能体ID")
+    module_id: Optional[int] = Field(default=None, description="模块ID（提供时检索相关需求文档分段作为上下文）")
 
 
 class TestCaseDesignRequest(BaseModel):
@@ -131,6 +132,16 @@ class AsyncTaskResponse(BaseModel):
     message: str
 
 
+def submit_interactive_task(task_type: str, run_task: Any, total_batches: int) -> str:
+    """以交互优先级提交异步任务（优先于一键生成和项目批量生成启动），队列已满时返回429"""
+    from app.services.async_task_manager import TaskPriority, task_manager
+    
+    try:
+        return task_manager.submit(task_type, run_task, total_batches, priority=TaskPriority.INTERACTIVE)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+
+
 class AsyncTaskStatusResponse(BaseModel):
     """异步任务状态响应"""
     task_id: str
@@ -173,7 +184,8 @@ async def generate_test_points(
         result = await service.execute_test_point_generation(
             requirement_points=request.requirement_points,
             user_id=current_user.id,
-            agent_id=agent_id
+            agent_id=agent_id,
+            module_id=request.module_id
         )
         
         return AgentTaskResponse(
@@ -201,7 +213,6 @@ async def generate_test_points_async(
     
     测试分类、设计方法和并发配置由后端从系统设置自动加载
     """
-    import asyncio
     from app.models.ai_config import Agent, AgentType
     from app.services.agent_service_real import AgentServiceReal
     from app.services.async_task_manager import task_manager
@@ -214,10 +225,6 @@ async def generate_test_points_async(
     batch_size = max(2, concurrency * 2)
     total_batches = (len(request.requirement_points) + batch_size - 1) // batch_size
     
-    # 创建异步任务
-    task_id = task_manager.create_task("test_point_generation", total_batches)
-    task_manager.start_task(task_id)
-    
     # 获取agent_id
     agent_id = request.agent_id
     if not agent_id:
@@ -229,14 +236,15 @@ async def generate_test_points_async(
             agent_id = agent.id
     
     # 后台执行任务
-    async def run_task():
+    async def run_task(task_id: str):
         try:
             service = AgentServiceReal(db=db)
             result = await service.execute_test_point_generation(
                 requirement_points=request.requirement_points,
                 user_id=current_user.id,
                 agent_id=agent_id,
-                task_id=task_id
+                task_id=task_id,
+                module_id=request.module_id
             )
             
             if result["success"]:
@@ -246,14 +254,13 @@ async def generate_test_points_async(
         except Exception as e:
             task_manager.fail_task(task_id, str(e))
     
-    # 启动后台任务
-    asyncio_task = asyncio.create_task(run_task())
-    task_manager.register_running_task(task_id, asyncio_task)
+    # 提交后台任务（达到并发上限时排队）
+    task_id = submit_interactive_task("test_point_generation", run_task, total_batches)
     
     return AsyncTaskResponse(
         task_id=task_id,
-        status="running",
-        message=f"任务已启动，共 {len(request.requirement_points)} 个需求点，分 {total_batches} 批处理（并发数: {concurrency}）"
+        status=task_manager.get_task(task_id).status.value,
+        message=f"任务已提交，共 {len(request.requirement_points)} 个需求点，分 {total_batches} 批处理（并发数: {concurrency}）"
     )
 
 
@@ -307,6 +314,10 @@ async def cancel_task(
         )
     
     task_manager.cancel_task(task_id)
+    if task.task_type == "project_generation":
+        # 批量任务：同时取消其子任务
+        from app.services.project_generation import project_generation
+        project_generation.cancel(task_id)
     
     return CancelTaskResponse(
         success=True,
@@ -341,11 +352,12 @@ async def design_test_cases_async(
     5. 优化完成后更新数据库
     6. 前端通过轮询获取进度和结果
     """
-    import asyncio
     from app.models.ai_config import Agent, AgentType
     from app.models.testcase import TestCase, TestCaseStatus
     from app.services.agent_service_real import AgentServiceReal
     from app.services.async_task_manager import task_manager
+    from app.services.quality_gate import create_quality_gate
+    from app.services.testcase_dedup import test_case_dedup
     
     # 从系统设置加载并发配置
     task_manager.load_config_from_db(db)
@@ -357,10 +369,6 @@ async def design_test_cases_async(
     # 总批次 = 生成批次 * 2（生成占50%，优化占50%）
     total_batches = generation_batches * 2
     
-    # 创建异步任务
-    task_id = task_manager.create_task("test_case_design", total_batches)
-    task_manager.start_task(task_id)
-    
     # 获取设计智能体ID
     design_agent_id = request.agent_id
     if not design_agent_id:
@@ -387,7 +395,7 @@ async def design_test_cases_async(
     user_id = current_user.id
     
     # 后台执行任务
-    async def run_task():
+    async def run_task(task_id: str):
         from app.database import SessionLocal
         task_db = SessionLocal()
         total_saved = 0
@@ -398,6 +406,7 @@ async def design_test_cases_async(
             """保存一批测试用例到数据库，返回成功保存的数量"""
             nonlocal total_saved, saved_test_cases
             saved_count = 0
+            batch_cases = []
             for tc_data in test_cases_data:
                 try:
                     # 从agent_service继承的属性
@@ -423,19 +432,26 @@ async def design_test_cases_async(
                     )
                     task_db.add(test_case)
                     task_db.flush()  # 获取ID
-                    saved_test_cases.append({
-                        "id": test_case.id,
-                        "title": test_case.title,
-                        "description": test_case.description,
-                        "preconditions": test_case.preconditions,
-                        "test_steps": test_case.test_steps,
-                        "expected_result": test_case.expected_result
-                    })
-                    saved_count += 1
+                    batch_cases.append(test_case)
                 except Exception as e:
                     print(f"⚠️ 创建测试用例对象失败: {e}")
                     continue
             
+            # 近似重复检查：写入指纹，合并模式下丢弃新生成的重复用例
+            merged = set(test_case_dedup.check_new_cases(task_db, batch_cases, service.generation_config))
+            for test_case in batch_cases:
+                if test_case.id in merged:
+                    continue
+                saved_test_cases.append({
+                    "id": test_case.id,
+                    "title": test_case.title,
+                    "description": test_case.description,
+                    "preconditions": test_case.preconditions,
+                    "test_steps": test_case.test_steps,
+                    "expected_result": test_case.expected_result
+                })
+                saved_count += 1
+            
             try:
                 task_db.commit()
                 total_saved += saved_count
@@ -469,16 +485,18 @@ async def design_test_cases_async(
                 task_manager.fail_task(task_id, result.get("error", "生成测试用例失败"))
                 return
             
-            # 阶段2：自动优化生成的测试用例（占50%进度）
-            if saved_test_cases and optimize_agent_id:
-                print(f"🔄 开始自动优化 {len(saved_test_cases)} 个测试用例...")
+            # 阶段2：自动优化生成的测试用例（占50%进度），只优化未通过质量门禁的用例
+            quality_gate = create_quality_gate(service.generation_config)
+            cases_to_optimize, _ = quality_gate.split(saved_test_cases) if optimize_agent_id else ([], [])
+            if cases_to_optimize:
+                print(f"🔄 开始自动优化 {len(cases_to_optimize)} 个测试用例（{len(saved_test_cases) - len(cases_to_optimize)} 个通过质量门禁）...")
                 
                 # 更新进度提示
                 task_manager.update_progress(task_id, 50, "正在优化测试用例...")
                 
                 # 调用优化服务
                 optimize_result = await service.execute_test_case_optimization(
-                    original_test_cases=saved_test_cases,
+                    original_test_cases=cases_to_optimize,
                     review_feedback=[],
                     optimization_requirements="全面优化测试用例质量，确保测试步骤清晰、预期结果明确",
                     user_id=user_id,
@@ -516,21 +534,21 @@ async def design_test_cases_async(
             task_manager.complete_task(task_id, {
                 "saved_count": total_saved,
                 "optimized_count": optimized_count if 'optimized_count' in dir() else 0,
-                "total_generated": result.get("data", {}).get("total_generated", 0)
+                "total_generated": result.get("data", {}).get("total_generated", 0),
+                "quality_gate": quality_gate.get_stats()
             })
         except Exception as e:
             task_manager.fail_task(task_id, str(e))
         finally:
             task_db.close()
     
-    # 启动后台任务
-    asyncio_task = asyncio.create_task(run_task())
-    task_manager.register_running_task(task_id, asyncio_task)
+    # 提交后台任务（达到并发上限时排队）
+    task_id = submit_interactive_task("test_case_design", run_task, total_batches)
     
     return AsyncTaskResponse(
         task_id=task_id,
-        status="running",
-        message=f"任务已启动，共 {len(request.test_points)} 个测试点（生成+优化）"
+        status=task_manager.get_task(task_id).status.value,
+        message=f"任务已提交，共 {len(request.test_points)} 个测试点（生成+优化）"
     )
 
 
@@ -613,7 +631,6 @@ async def optimize_test_cases_batch(
     4. 如果auto_save=True，自动更新数据库中的测试用例
     5. 前端通过轮询获取进度和结果
     """
-    import asyncio
     from app.models.ai_config import Agent, AgentType
     from app.models.testcase import TestCase
     from app.services.agent_service_real import AgentServiceReal
@@ -625,10 +642,6 @@ async def optimize_test_cases_batch(
     # 计算批次数（每个用例作为一个批次）
     total_batches = len(request.test_cases)
     
-    # 创建异步任务
-    task_id = task_manager.create_task("test_case_optimization", total_batches)
-    task_manager.start_task(task_id)
-    
     # 获取agent_id
     agent_id = request.agent_id
     if not agent_id:
@@ -648,7 +661,7 @@ async def optimize_test_cases_batch(
     user_id = current_user.id
     
     # 后台执行任务
-    async def run_task():
+    async def run_task(task_id: str):
         # 创建新的数据库会话用于后台任务
         from app.database import SessionLocal
         task_db = SessionLocal()
@@ -719,15 +732,14 @@ async def optimize_test_cases_batch(
         finally:
             task_db.close()
     
-    # 启动后台任务
-    asyncio_task = asyncio.create_task(run_task())
-    task_manager.register_running_task(task_id, asyncio_task)
+    # 提交后台任务（达到并发上限时排队）
+    task_id = submit_interactive_task("test_case_optimization", run_task, total_batches)
     
     concurrency = task_manager.max_concurrent_tasks
     return AsyncTaskResponse(
         task_id=task_id,
-        status="running",
-        message=f"批量优化任务已启动，共 {len(request.test_cases)} 个测试用例（并发数: {concurrency}）"
+        status=task_manager.get_task(task_id).status.value,
+        message=f"批量优化任务已提交，共 {len(request.test_cases)} 个测试用例（并发数: {concurrency}）"
     )
 
 
@@ -755,17 +767,19 @@ def get_agent_list(
 @router.get("/task-logs", response_model=TaskLogResponse)
 def get_task_logs(
     agent_id: Optional[int] = None,
+    run_id: Optional[str] = None,
     limit: int = 50,
     db: Session = Depends(get_db),
     current_user: UserSchema = Depends(get_current_active_user)
 ) -> Any:
-    """获取任务执行日志"""
+    """获取任务执行日志（每次AI调用一条：模型、阶段、延迟、token数、重试、缓存命中）"""
     try:
         logs = agent_service.get_task_logs(
             db=db,
             user_id=current_user.id,
             agent_id=agent_id,
-            limit=limit
+            limit=limit,
+            run_id=run_id
         )
         
         return TaskLogResponse(
@@ -780,6 +794,93 @@ def get_task_logs(
         )
 
 
+@router.get("/task-logs/stats")
+def get_task_log_stats(
+    agent_id: Optional[int] = None,
+    run_id: Optional[str] = None,
+    since_hours: float = 24,
+    db: Session = Depends(get_db),
+    current_user: UserSchema = Depends(get_current_active_user)
+) -> Any:
+    """AI调用汇总：按模型和阶段统计延迟/首token延迟的 p50、p95，按任务统计调用数和token数
+    
+    指定 run_id 时只统计该任务，否则统计最近 since_hours 小时
+    """
+    from app.services.llm_telemetry import aggregate_logs, llm_telemetry
+    
+    try:
+        llm_telemetry.flush()
+        stats = aggregate_logs(db, agent_id=agent_id, run_id=run_id, since_hours=since_hours)
+        stats["writer"] = llm_telemetry.get_stats()
+        return stats
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取AI调用统计失败: {str(e)}"
+        )
+
+
+@router.get("/cache/stats")
+def get_llm_cache_stats(
+    current_user: UserSchema = Depends(get_current_active_user)
+) -> Any:
+    """获取LLM响应缓存统计（命中/未命中次数、条目数、占用空间）"""
+    from app.services.llm_cache import llm_cache
+    
+    return llm_cache.get_stats()
+
+
+@router.delete("/cache")
+def clear_llm_cache(
+    current_user: UserSchema = Depends(get_current_admin_user)
+) -> Any:
+    """清空LLM响应缓存（仅管理员）"""
+    from app.services.llm_cache import llm_cache
+    
+    removed = llm_cache.clear()
+    return {"message": "LLM响应缓存已清空", "removed": removed}
+
+
+@router.get("/rate-limits")
+def get_rate_limit_stats(
+    current_user: UserSchema = Depends(get_current_active_user)
+) -> Any:
+    """获取各模型的限流状态（限额、在途请求数、排队数、被限流次数）"""
+    from app.services.rate_limiter import rate_limiter
+    
+    return {"models": rate_limiter.get_stats()}
+
+
+@router.get("/concurrency")
+def get_adaptive_concurrency_stats(
+    current_user: UserSchema = Depends(get_current_active_user)
+) -> Any:
+    """获取各模型当前的自适应并发窗口（AIMD）及延迟、错误率"""
+    from app.services.concurrency_controller import concurrency_controller
+    
+    return concurrency_controller.get_stats()
+
+
+@router.get("/circuit-breakers")
+def get_circuit_breaker_stats(
+    current_user: UserSchema = Depends(get_current_active_user)
+) -> Any:
+    """获取各模型的熔断状态（连续失败次数、剩余熔断时间）"""
+    from app.services.circuit_breaker import circuit_breakers
+    
+    return {"models": circuit_breakers.get_stats()}
+
+
+@router.get("/retries")
+def get_retry_stats(
+    current_user: UserSchema = Depends(get_current_active_user)
+) -> Any:
+    """获取AI调用重试统计（按错误类型的失败次数、重试次数，恢复/放弃次数）"""
+    from app.services.retry_policy import retry_stats
+    
+    return retry_stats.get_stats()
+
+
 @router.get("/types")
 def get_agent_types() -> Any:
     """获取智能体类型列表"""
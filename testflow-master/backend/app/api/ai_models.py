@@ -12,11 +12,24 @@ from app.models.user import User
 from app.models.ai_config import AIModel, Agent, AgentType
 from app.schemas.user import User as UserSchema
 from app.core.security import get_password_hash
+from app.core.ai_client import ai_client_manager, normalize_base_url
+from app.services.rate_limiter import rate_limiter, model_key
 
 
 router = APIRouter()
 
 
+async def _release_client(db: Session, base_url: str, api_key: Optional[str]) -> None:
+    """关闭连接池中旧端点的客户端（仍有其他模型使用该端点时保留）"""
+    endpoint = (normalize_base_url(base_url), api_key or "")
+    in_use = any(
+        (normalize_base_url(m.base_url), m.api_key or "") == endpoint
+        for m in db.query(AIModel.base_url, AIModel.api_key).all()
+    )
+    if not in_use:
+        await ai_client_manager.remove_client(base_url, api_key)
+
+
 # 请求模型
 class AIModelCreate(BaseModel):
     """AI模型创建请求"""
@@ -30,6 +43,9 @@ class AIModelCreate(BaseModel):
     max_tokens: int = Field(default=4000, ge=100, le=128000, description="最大令牌数")
     temperature: float = Field(default=0.7, ge=0.0, le=2.0, description="温度参数")
     stream_support: bool = Field(default=True, description="是否支持流式输出")
+    rpm_limit: Optional[int] = Field(default=None, ge=1, description="每分钟请求数上限(可选)")
+    tpm_limit: Optional[int] = Field(default=None, ge=1, description="每分钟token数上限(可选)")
+    max_in_flight: Optional[int] = Field(default=None, ge=1, description="最大并发请求数(可选)")
     is_active: bool = Field(default=True, description="是否激活")
 
 
@@ -45,6 +61,9 @@ class AIModelUpdate(BaseModel):
     max_tokens: Optional[int] = Field(None, ge=100, le=128000, description="最大令牌数")
     temperature: Optional[float] = Field(None, ge=0.0, le=2.0, description="温度参数")
     stream_support: Optional[bool] = Field(None, description="是否支持流式输出")
+    rpm_limit: Optional[int] = Field(None, ge=1, description="每分钟请求数上限(可选)")
+    tpm_limit: Optional[int] = Field(None, ge=1, description="每分钟token数上限(可选)")
+    max_in_flight: Optional[int] = Field(None, ge=1, description="最大并发请求数(可选)")
     is_active: Optional[bool] = Field(None, description="是否激活")
 
 
@@ -62,6 +81,8 @@ class AgentCreate(BaseModel):
     system_prompt: Optional[str] = Field(default=None, description="系统提示词")
     temperature: float = Field(default=0.7, description="温度参数")
     max_tokens: int = Field(default=2000, description="最大令牌数")
+    cache_enabled: bool = Field(default=True, description="是否启用LLM响应缓存")
+    fallback_model_ids: List[int] = Field(default_factory=list, description="备用模型ID列表（按优先级排序）")
 
 
 class AgentUpdate(BaseModel):
@@ -72,6 +93,8 @@ class AgentUpdate(BaseModel):
     system_prompt: Optional[str] = Field(default=None, description="系统提示词")
     temperature: Optional[float] = Field(default=None, description="温度参数")
     max_tokens: Optional[int] = Field(default=None, description="最大令牌数")
+    cache_enabled: Optional[bool] = Field(default=None, description="是否启用LLM响应缓存")
+    fallback_model_ids: Optional[List[int]] = Field(default=None, description="备用模型ID列表（按优先级排序）")
     is_active: Optional[bool] = Field(default=None, description="是否激活")
 
 
@@ -88,6 +111,9 @@ class AIModelResponse(BaseModel):
     max_tokens: int
     temperature: float
     stream_support: bool
+    rpm_limit: Optional[int] = None
+    tpm_limit: Optional[int] = None
+    max_in_flight: Optional[int] = None
     is_active: bool
     created_at: str
     updated_at: str
@@ -105,6 +131,9 @@ class AIModelDetailResponse(BaseModel):
     max_tokens: int
     temperature: float
     stream_support: bool
+    rpm_limit: Optional[int] = None
+    tpm_limit: Optional[int] = None
+    max_in_flight: Optional[int] = None
     is_active: bool
     created_at: str
     updated_at: str
@@ -128,6 +157,8 @@ class AgentResponse(BaseModel):
     ai_model_name: str
     temperature: float
     max_tokens: int
+    cache_enabled: bool = True
+    fallback_model_ids: List[int] = []
     system_prompt: Optional[str] = None
     prompt_template: Optional[str] = None
     is_active: bool
@@ -162,6 +193,9 @@ def create_ai_model(
             max_tokens=model_data.max_tokens,
             temperature=model_data.temperature,
             stream_support=model_data.stream_support,
+            rpm_limit=model_data.rpm_limit,
+            tpm_limit=model_data.tpm_limit,
+            max_in_flight=model_data.max_in_flight,
             is_active=model_data.is_active,
             created_by=current_user.id
         )
@@ -169,6 +203,7 @@ def create_ai_model(
         db.add(ai_model)
         db.commit()
         db.refresh(ai_model)
+        rate_limiter.configure(model_key(ai_model), ai_model.rpm_limit, ai_model.tpm_limit, ai_model.max_in_flight)
         
         return AIModelResponse(
             id=ai_model.id,
@@ -179,6 +214,9 @@ def create_ai_model(
             max_tokens=ai_model.max_tokens,
             temperature=ai_model.temperature,
             stream_support=ai_model.stream_support,
+            rpm_limit=ai_model.rpm_limit,
+            tpm_limit=ai_model.tpm_limit,
+            max_in_flight=ai_model.max_in_flight,
             is_active=ai_model.is_active,
             created_at=ai_model.created_at.isoformat(),
             updated_at=ai_model.updated_at.isoformat()
@@ -218,6 +256,9 @@ def get_ai_models(
             max_tokens=model.max_tokens,
             temperature=model.temperature,
             stream_support=model.stream_support,
+            rpm_limit=model.rpm_limit,
+            tpm_limit=model.tpm_limit,
+            max_in_flight=model.max_in_flight,
             is_active=model.is_active,
             created_at=model.created_at.isoformat(),
             updated_at=model.updated_at.isoformat()
@@ -250,6 +291,9 @@ def get_ai_model_detail(
         max_tokens=ai_model.max_tokens,
         temperature=ai_model.temperature,
         stream_support=ai_model.stream_support,
+        rpm_limit=ai_model.rpm_limit,
+        tpm_limit=ai_model.tpm_limit,
+        max_in_flight=ai_model.max_in_flight,
         is_active=ai_model.is_active,
         created_at=ai_model.created_at.isoformat(),
         updated_at=ai_model.updated_at.isoformat()
@@ -257,7 +301,7 @@ def get_ai_model_detail(
 
 
 @router.put("/models/{model_id}", response_model=AIModelResponse)
-def update_ai_model(
+async def update_ai_model(
     model_id: int,
     model_data: AIModelUpdate,
     db: Session = Depends(get_db),
@@ -271,6 +315,7 @@ def update_ai_model(
             detail="AI模型不存在"
         )
     
+    old_endpoint = (ai_model.base_url, ai_model.api_key)
     try:
         # 更新字段
         update_data = model_data.dict(exclude_unset=True)
@@ -283,6 +328,9 @@ def update_ai_model(
         
         db.commit()
         db.refresh(ai_model)
+        rate_limiter.configure(model_key(ai_model), ai_model.rpm_limit, ai_model.tpm_limit, ai_model.max_in_flight)
+        if (ai_model.base_url, ai_model.api_key) != old_endpoint:
+            await _release_client(db, *old_endpoint)
         
         return AIModelResponse(
             id=ai_model.id,
@@ -293,6 +341,9 @@ def update_ai_model(
             max_tokens=ai_model.max_tokens,
             temperature=ai_model.temperature,
             stream_support=ai_model.stream_support,
+            rpm_limit=ai_model.rpm_limit,
+            tpm_limit=ai_model.tpm_limit,
+            max_in_flight=ai_model.max_in_flight,
             is_active=ai_model.is_active,
             created_at=ai_model.created_at.isoformat(),
             updated_at=ai_model.updated_at.isoformat()
@@ -307,7 +358,7 @@ def update_ai_model(
 
 
 @router.delete("/models/{model_id}")
-def delete_ai_model(
+async def delete_ai_model(
     model_id: int,
     db: Session = Depends(get_db),
     current_user: UserSchema = Depends(get_current_admin_user)
@@ -329,8 +380,10 @@ def delete_ai_model(
         )
     
     try:
+        old_endpoint = (ai_model.base_url, ai_model.api_key)
         db.delete(ai_model)
         db.commit()
+        await _release_client(db, *old_endpoint)
         return {"message": "AI模型删除成功"}
         
     except Exception as e:
@@ -357,8 +410,6 @@ async def test_ai_model(
         )
     
     try:
-        import httpx
-        
         # 构建测试请求
         test_payload = {
             "model": ai_model.model_id,
@@ -375,34 +426,35 @@ async def test_ai_model(
             "Content-Type": "application/json"
         }
         
-        # 发送测试请求
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{ai_model.base_url.rstrip('/')}/chat/completions",
-                json=test_payload,
-                headers=headers
+        # 发送测试请求（复用连接池，测试同时完成连接预热）
+        client = ai_client_manager.get_client(ai_model.base_url, ai_model.api_key)
+        response = await client.post(
+            f"{normalize_base_url(ai_model.base_url)}/chat/completions",
+            json=test_payload,
+            headers=headers,
+            timeout=30.0
+        )
+        
+        if response.status_code == 200:
+            response_data = response.json()
+            return AIModelTestResponse(
+                success=True,
+                message="模型测试成功，连接正常",
+                response=response_data
             )
+        else:
+            error_detail = response.text
+            try:
+                error_json = response.json()
+                error_detail = error_json.get("error", {}).get("message", error_detail)
+            except:
+                pass
             
-            if response.status_code == 200:
-                response_data = response.json()
-                return AIModelTestResponse(
-                    success=True,
-                    message="模型测试成功，连接正常",
-                    response=response_data
-                )
-            else:
-                error_detail = response.text
-                try:
-                    error_json = response.json()
-                    error_detail = error_json.get("error", {}).get("message", error_detail)
-                except:
-                    pass
-                
-                return AIModelTestResponse(
-                    success=False,
-                    message=f"模型测试失败: HTTP {response.status_code}",
-                    error=error_detail
-                )
+            return AIModelTestResponse(
+                success=False,
+                message=f"模型测试失败: HTTP {response.status_code}",
+                error=error_detail
+            )
                 
     except Exception as e:
         return AIModelTestResponse(
@@ -450,6 +502,8 @@ def create_agent(
             system_prompt=agent_data.system_prompt,
             temperature=agent_data.temperature,
             max_tokens=agent_data.max_tokens,
+            cache_enabled=agent_data.cache_enabled,
+            fallback_model_ids=agent_data.fallback_model_ids,
             created_by=current_user.id
         )
         
@@ -465,6 +519,8 @@ def create_agent(
             ai_model_name=ai_model.name,
             temperature=agent.temperature,
             max_tokens=agent.max_tokens,
+            cache_enabled=agent.cache_enabled,
+            fallback_model_ids=agent.fallback_model_ids or [],
             is_active=agent.is_active,
             created_at=agent.created_at.isoformat(),
             updated_at=agent.updated_at.isoformat()
@@ -501,6 +557,8 @@ def get_agents(
             ai_model_name=ai_model.name if ai_model else "未设置",
             temperature=agent.temperature,
             max_tokens=agent.max_tokens,
+            cache_enabled=agent.cache_enabled,
+            fallback_model_ids=agent.fallback_model_ids or [],
             system_prompt=agent.system_prompt,
             prompt_template=agent.prompt_template,
             is_active=agent.is_active,
@@ -564,6 +622,8 @@ def update_agent(
             ai_model_name=ai_model.name if ai_model else "未设置",
             temperature=agent.temperature,
             max_tokens=agent.max_tokens,
+            cache_enabled=agent.cache_enabled,
+            fallback_model_ids=agent.fallback_model_ids or [],
             system_prompt=agent.system_prompt,
             prompt_template=agent.prompt_template,
             is_active=agent.is_active,
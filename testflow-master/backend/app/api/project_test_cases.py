@@ -429,6 +429,38 @@ async def delete_single_test_case(
     return {"message": "删除成功", "id": case_id}
 
 
+class DedupRequest(BaseModel):
+    """近似重复扫描请求"""
+    merge: bool = False  # 是否合并（删除AI生成且未编辑过的重复用例）
+    max_distance: Optional[int] = None  # 最大汉明距离，为空则使用系统设置
+
+
+@router.post("/projects/{project_id}/test-cases/dedup")
+async def dedup_test_cases(
+    project_id: int,
+    request: DedupRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """扫描项目内近似重复的测试用例"""
+    from app.services.settings_service import SettingsService
+    from app.services.testcase_dedup import test_case_dedup
+    
+    # 权限检查（合并需要编辑权限）
+    if request.merge:
+        check_project_edit_permission(project_id, current_user, db)
+    else:
+        check_project_access(project_id, current_user, db)
+    
+    max_distance = request.max_distance
+    if max_distance is None:
+        max_distance = SettingsService.get_generation_config_cached(db).dedup_max_distance
+    if not 0 <= max_distance <= 3:
+        raise HTTPException(status_code=400, detail="最大汉明距离范围为 0-3")
+    
+    return test_case_dedup.scan_project(db, project_id, max_distance=max_distance, merge=request.merge)
+
+
 class ExportRequest(BaseModel):
     """导出请求"""
     ids: Optional[List[int]] = None  # 指定导出的用例ID，为空则导出全部
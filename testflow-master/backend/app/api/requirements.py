@@ -23,6 +23,7 @@ from app.schemas.requirement import (
 )
 from app.core.dependencies import get_current_active_user
 from app.utils.file_extractor import extract_text_from_file, extract_images_from_docx
+from app.services.requirement_index import requirement_index
 import os
 import uuid
 from pathlib import Path
@@ -136,6 +137,14 @@ async def upload_requirement_file(
     db.commit()
     db.refresh(db_file)
     
+    # 切分文档并建立检索分段（失败不影响上传，生成时会重新分段）
+    if db_file.is_extracted:
+        try:
+            requirement_index.index_file(db, db_file)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"需求文档分段失败: {e}")
+    
     # 对于DOCX文件，提取图片
     if file_type_clean == 'docx':
         try:
@@ -392,6 +401,13 @@ def get_requirement_file_content(
             
             db.commit()
             db.refresh(req_file)
+            
+            if req_file.is_extracted:
+                try:
+                    requirement_index.index_file(db, req_file)
+                except Exception as e:
+                    db.rollback()
+                    logger.warning(f"需求文档分段失败: {e}")
     
     requirement_points = db.query(RequirementPoint).filter(
         RequirementPoint.requirement_file_id == file_id
@@ -667,12 +683,50 @@ def delete_module_requirement_point(
 
 # ========== 一键生成测试用例 ==========
 
+def select_pipeline_agents(db: Session) -> dict:
+    """为一键生成的每个阶段选择对应类型的智能体"""
+    from app.models.ai_config import Agent, AgentType
+    
+    # 为每个阶段选择对应类型的智能体
+    requirement_agent = db.query(Agent).filter(
+        Agent.is_active == True,
+        Agent.type == AgentType.REQUIREMENT_SPLITTER
+    ).first()
+    
+    test_point_agent = db.query(Agent).filter(
+        Agent.is_active == True,
+        Agent.type == AgentType.TEST_POINT_GENERATOR
+    ).first()
+    
+    test_case_agent = db.query(Agent).filter(
+        Agent.is_active == True,
+        Agent.type == AgentType.TEST_CASE_DESIGNER
+    ).first()
+    
+    optimizer_agent = db.query(Agent).filter(
+        Agent.is_active == True,
+        Agent.type == AgentType.TEST_CASE_OPTIMIZER
+    ).first()
+    
+    # 如果某个类型的智能体不存在，使用第一个可用的智能体作为后备
+    fallback_agent = db.query(Agent).filter(Agent.is_active == True).first()
+    if not fallback_agent:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="没有可用的智能体")
+    
+    return {
+        "requirement": requirement_agent.id if requirement_agent else fallback_agent.id,
+        "test_point": test_point_agent.id if test_point_agent else fallback_agent.id,
+        "test_case": test_case_agent.id if test_case_agent else fallback_agent.id,
+        "optimizer": optimizer_agent.id if optimizer_agent else fallback_agent.id
+    }
+
+
 @router.post("/{project_id}/modules/{module_id}/requirements/files/{file_id}/generate-all")
 async def generate_all_test_artifacts(
     project_id: int,
     module_id: int,
     file_id: int,
-    background_tasks: BackgroundTasks,
+    incremental: Optional[bool] = None,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ) -> Any:
@@ -684,11 +738,11 @@ async def generate_all_test_artifacts(
     3. 基于测试点生成测试用例
     4. 优化生成的测试用例
     
+    需求文件已生成过时，默认只重新生成修改过的文档分段（incremental=false 强制全量生成）。
     整个过程在后台异步执行，支持进度跟踪和取消操作。
     """
-    from app.services.async_task_manager import task_manager
+    from app.services.async_task_manager import TaskPriority, task_manager
     from app.services.agent_service_real import AgentServiceReal
-    from app.models.ai_config import Agent
     
     # 权限检查
     project = db.query(Project).filter(Project.id == project_id).first()
@@ -728,54 +782,10 @@ async def generate_all_test_artifacts(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"获取需求文件内容失败: {str(e)}")
     
     # 获取各阶段的智能体配置
-    from app.models.ai_config import AgentType
-    
-    # 为每个阶段选择对应类型的智能体
-    requirement_agent = db.query(Agent).filter(
-        Agent.is_active == True,
-        Agent.type == AgentType.REQUIREMENT_SPLITTER
-    ).first()
-    
-    test_point_agent = db.query(Agent).filter(
-        Agent.is_active == True,
-        Agent.type == AgentType.TEST_POINT_GENERATOR
-    ).first()
-    
-    test_case_agent = db.query(Agent).filter(
-        Agent.is_active == True,
-        Agent.type == AgentType.TEST_CASE_DESIGNER
-    ).first()
-    
-    optimizer_agent = db.query(Agent).filter(
-        Agent.is_active == True,
-        Agent.type == AgentType.TEST_CASE_OPTIMIZER
-    ).first()
-    
-    # 如果某个类型的智能体不存在，使用第一个可用的智能体作为后备
-    fallback_agent = db.query(Agent).filter(Agent.is_active == True).first()
-    if not fallback_agent:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="没有可用的智能体")
-    
-    agent_ids = {
-        "requirement": requirement_agent.id if requirement_agent else fallback_agent.id,
-        "test_point": test_point_agent.id if test_point_agent else fallback_agent.id,
-        "test_case": test_case_agent.id if test_case_agent else fallback_agent.id,
-        "optimizer": optimizer_agent.id if optimizer_agent else fallback_agent.id
-    }
-    
-    # 创建异步任务
-    task_id = task_manager.create_task("one_click_generation", total_batches=100)
-    task_manager.start_task(task_id)
-    
-    print(f"\n{'='*60}")
-    print(f"[一键生成] 任务已创建: {task_id}")
-    print(f"[一键生成] task_manager 实例 ID: {id(task_manager)}")
-    print(f"[一键生成] 当前所有任务: {list(task_manager._tasks.keys())}")
-    print(f"[一键生成] 任务数量: {len(task_manager._tasks)}")
-    print(f"{'='*60}\n")
+    agent_ids = select_pipeline_agents(db)
     
     # 异步执行完整流程
-    async def execute_pipeline():
+    async def execute_pipeline(task_id: str):
         # 创建新的数据库会话用于后台任务
         from app.database import SessionLocal
         db_session = SessionLocal()
@@ -789,7 +799,8 @@ async def generate_all_test_artifacts(
                 user_id=current_user.id,
                 agent_ids=agent_ids,
                 image_paths=image_paths,
-                task_id=task_id
+                task_id=task_id,
+                incremental=incremental
             )
         except Exception as e:
             print(f"[一键生成] 后台任务执行失败: {e}")
@@ -798,7 +809,20 @@ async def generate_all_test_artifacts(
         finally:
             db_session.close()
     
-    background_tasks.add_task(execute_pipeline)
+    # 提交异步任务（达到并发上限时排队，单次智能体调用优先）
+    try:
+        task_id = task_manager.submit(
+            "one_click_generation", execute_pipeline, total_batches=100, priority=TaskPriority.NORMAL
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    
+    print(f"\n{'='*60}")
+    print(f"[一键生成] 任务已创建: {task_id}")
+    print(f"[一键生成] task_manager 实例 ID: {id(task_manager)}")
+    print(f"[一键生成] 当前所有任务: {list(task_manager._tasks.keys())}")
+    print(f"[一键生成] 任务数量: {len(task_manager._tasks)}")
+    print(f"{'='*60}\n")
     
     return {
         "task_id": task_id,
@@ -807,6 +831,218 @@ async def generate_all_test_artifacts(
     }
 
 
+@router.get("/{project_id}/generation-runs")
+def list_interrupted_generation_runs(
+    project_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Any:
+    """获取项目中已中断或失败、可从检查点恢复的一键生成任务"""
+    from app.services.pipeline_checkpoint import checkpoint_summary, list_resumable
+    
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="项目不存在")
+    
+    if not check_project_permission(project, current_user, [ProjectRole.VIEWER, ProjectRole.MEMBER, ProjectRole.OWNER]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权查看生成任务")
+    
+    runs = [checkpoint_summary(c) for c in list_resumable(db, project_id)]
+    return {"runs": runs, "total": len(runs)}
+
+
+@router.post("/{project_id}/generation-runs/{task_id}/resume")
+async def resume_generation_run(
+    project_id: int,
+    task_id: str,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Any:
+    """从检查点恢复中断的一键生成任务
+    
+    已完成的需求点、测试点和用例不会重新生成，只继续处理未完成的部分。
+    返回新的任务ID，进度查询方式与一键生成相同。
+    """
+    from app.services.async_task_manager import TaskPriority, task_manager
+    from app.services.agent_service_real import AgentServiceReal
+    from app.services.pipeline_checkpoint import PipelineCheckpoint, claim_for_resume, release_claim
+    
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="项目不存在")
+    
+    if not check_project_permission(project, current_user, [ProjectRole.MEMBER, ProjectRole.OWNER]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权执行此操作")
+    
+    checkpoint = PipelineCheckpoint.load(db, task_id)
+    if checkpoint is None or checkpoint.record.project_id != project_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="生成任务不存在")
+    # 提交前占用检查点，重复请求不会把同一检查点恢复两次
+    new_task_id = task_manager.new_task_id()
+    if not claim_for_resume(db, task_id, new_task_id):
+        db.refresh(checkpoint.record)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"任务状态为 {checkpoint.record.status}，无法恢复"
+        )
+    
+    async def execute_resume(new_task_id: str):
+        from app.database import SessionLocal
+        db_session = SessionLocal()
+        try:
+            print(f"[一键生成] 开始恢复任务: {task_id} → {new_task_id}")
+            service = AgentServiceReal(db=db_session)
+            await service.resume_full_generation_pipeline(task_id, new_task_id)
+        except Exception as e:
+            print(f"[一键生成] 恢复任务执行失败: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            db_session.close()
+    
+    try:
+        task_manager.submit(
+            "one_click_generation", execute_resume, total_batches=100,
+            priority=TaskPriority.NORMAL, task_id=new_task_id
+        )
+    except ValueError as e:
+        release_claim(db, task_id, new_task_id)
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    
+    return {
+        "task_id": new_task_id,
+        "resumed_from": task_id,
+        "message": "生成任务正在从检查点恢复"
+    }
+
+
+# ========== 项目批量生成 ==========
+
+class ProjectGenerationRequest(BaseModel):
+    """项目批量生成请求模型（模块和需求文件都不指定时处理项目内所有已提取的需求文件）"""
+    module_ids: Optional[List[int]] = None
+    file_ids: Optional[List[int]] = None
+    incremental: Optional[bool] = None
+
+
+class ProjectGenerationRetryRequest(BaseModel):
+    """重试批量生成子任务的请求模型（不指定需求文件时重试所有失败的子任务）"""
+    file_ids: Optional[List[int]] = None
+
+
+def _get_generation_job(project_id: int, job_id: str):
+    from app.services.project_generation import project_generation
+    
+    job = project_generation.get_job(job_id)
+    if not job or job.project_id != project_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="批量生成任务不存在")
+    return job
+
+
+@router.post("/{project_id}/generation-jobs")
+async def create_project_generation_job(
+    project_id: int,
+    request: ProjectGenerationRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Any:
+    """项目批量生成：对多个模块/需求文件执行一键生成
+    
+    每个需求文件一个子流程，同时执行的文件数和所有子流程共享的AI调用并发数由生成配置控制。
+    通过 GET /generation-jobs/{job_id} 查看汇总进度和各文件结果，失败的文件可单独重试。
+    """
+    from app.services.project_generation import project_generation
+    
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="项目不存在")
+    
+    if not check_project_permission(project, current_user, [ProjectRole.MEMBER, ProjectRole.OWNER]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权执行此操作")
+    
+    query = db.query(RequirementFile).filter(
+        RequirementFile.project_id == project_id,
+        RequirementFile.is_extracted == True,
+        RequirementFile.module_id.isnot(None)
+    )
+    if request.module_ids:
+        query = query.filter(RequirementFile.module_id.in_(request.module_ids))
+    if request.file_ids:
+        query = query.filter(RequirementFile.id.in_(request.file_ids))
+    files = [f for f in query.order_by(RequirementFile.module_id, RequirementFile.id).all() if f.extracted_content]
+    if not files:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="没有可生成的需求文件（需已关联模块并提取内容）")
+    
+    agent_ids = select_pipeline_agents(db)
+    try:
+        job = project_generation.create_job(db, project_id, current_user.id, agent_ids, files, request.incremental)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    
+    background_tasks.add_task(project_generation.run, job)
+    
+    return {
+        "job_id": job.job_id,
+        "files": len(files),
+        "message": "批量生成任务已创建，正在后台执行"
+    }
+
+
+@router.get("/{project_id}/generation-jobs/{job_id}")
+def get_project_generation_job(
+    project_id: int,
+    job_id: str,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Any:
+    """获取批量生成任务的汇总进度、各需求文件的状态和已完成文件的结果"""
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="项目不存在")
+    
+    if not check_project_permission(project, current_user, [ProjectRole.VIEWER, ProjectRole.MEMBER, ProjectRole.OWNER]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权查看生成任务")
+    
+    return _get_generation_job(project_id, job_id).to_dict()
+
+
+@router.post("/{project_id}/generation-jobs/{job_id}/retry")
+async def retry_project_generation_job(
+    project_id: int,
+    job_id: str,
+    request: ProjectGenerationRetryRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Any:
+    """重试批量生成任务中失败的需求文件（有检查点时从检查点继续），不影响其他文件"""
+    from app.services.project_generation import project_generation
+    
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="项目不存在")
+    
+    if not check_project_permission(project, current_user, [ProjectRole.MEMBER, ProjectRole.OWNER]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权执行此操作")
+    
+    job = _get_generation_job(project_id, job_id)
+    try:
+        retried = project_generation.retry(job, request.file_ids)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if not retried:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="没有需要重试的失败子任务")
+    
+    background_tasks.add_task(project_generation.run, job, retried)
+    
+    return {
+        "job_id": job.job_id,
+        "retried_file_ids": [sub.file_id for sub in retried],
+        "message": f"已重新执行 {len(retried)} 个需求文件"
+    }
+
+
 # ========== 按模块管理测试点 ==========
 
 @router.get("/{project_id}/modules/{module_id}/test-points")
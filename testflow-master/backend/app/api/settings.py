@@ -1,6 +1,6 @@
 """
 系统设置API路由
-提供测试分类、测试设计方法和并发配置的管理接口
+提供测试分类、测试设计方法、并发配置和生成配置的管理接口
 """
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
@@ -14,7 +14,7 @@ from app.services.async_task_manager import task_manager
 from app.schemas.settings import (
     TestCategoryCreate, TestCategoryUpdate, TestCategoryResponse,
     TestDesignMethodCreate, TestDesignMethodUpdate, TestDesignMethodResponse,
-    ConcurrencyConfig
+    ConcurrencyConfig, GenerationConfig
 )
 
 router = APIRouter()
@@ -271,6 +271,7 @@ def update_concurrency_config(
         - task_timeout: 30-600秒
         - retry_count: 0-5
         - queue_size: 10-1000
+        - adaptive_max_in_flight: 1-64
         
         更新后会自动刷新任务管理器的配置
     """
@@ -280,3 +281,38 @@ def update_concurrency_config(
     task_manager.reload_config(db)
     
     return result
+
+
+# ============== Generation Config Endpoints ==============
+
+@router.get("/generation", response_model=GenerationConfig)
+def get_generation_config(
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """获取生成配置
+    
+    Returns:
+        当前生成配置
+    """
+    return SettingsService.get_generation_config(db)
+
+
+@router.put("/generation", response_model=GenerationConfig)
+def update_generation_config(
+    config: GenerationConfig,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """更新生成配置
+    
+    Args:
+        config: 新的生成配置
+    
+    Returns:
+        更新后的生成配置
+    
+    Note:
+        新配置在下一次生成任务开始时生效
+    """
+    return SettingsService.update_generation_config(db, config)
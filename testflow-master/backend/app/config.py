@@ -40,6 +40,52 @@ class Settings(BaseSettings):
     max_tokens: int = 2000
     temperature: float = 0.7
 
+    # AI HTTP连接池配置（按 base_url + api_key 复用长连接）
+    ai_http_timeout: float = 300.0  # 单次请求读超时（秒）
+    ai_http_connect_timeout: float = 10.0  # 建立连接超时（秒）
+    ai_http_max_connections: int = 100  # 每个连接池最大连接数
+    ai_http_max_keepalive_connections: int = 20  # 每个连接池最大空闲保活连接数
+    ai_http_keepalive_expiry: float = 120.0  # 空闲连接保活时间（秒）
+    ai_http2_enabled: bool = False  # 是否启用HTTP/2（需要安装 h2）
+    ai_http_warmup_enabled: bool = True  # 启动时是否预热模型连接
+    ai_incremental_parse_enabled: bool = True  # 流式输出时边接收边解析，逐个保存已完成的用例
+    ai_stream_include_usage: bool = False  # 流式请求附带 stream_options.include_usage（供应商支持时返回准确token数）
+    ai_max_continuations: int = 2  # 响应因 max_tokens 被截断时自动续写的最大次数（0表示不续写）
+
+    # LLM响应缓存配置
+    llm_cache_enabled: bool = True
+    llm_cache_path: str = "./llm_cache.db"  # 独立的SQLite缓存文件
+    llm_cache_ttl: int = 7 * 24 * 3600  # 缓存有效期（秒），0表示不过期
+    llm_cache_max_entries: int = 5000  # 最大缓存条数
+    llm_cache_max_bytes: int = 200 * 1024 * 1024  # 最大缓存字节数（200MB）
+    llm_record_path: Optional[str] = None  # 录制真实AI调用的JSONL文件（供 benchmarks/mock_llm.py 回放），为空不录制
+
+    # AI调用遥测配置（每次智能体调用写入一条 TaskLog）
+    llm_telemetry_enabled: bool = True
+    llm_telemetry_flush_interval: float = 2.0  # 后台批量写入间隔（秒）
+    llm_telemetry_batch_size: int = 100  # 队列达到该条数时立即写入
+
+    # 系统设置缓存：每个工作进程缓存系统设置，其他进程修改的设置在该时间内生效（秒），0表示只在本进程修改时失效
+    settings_cache_ttl: float = 5.0
+
+    # 异步任务状态存储（多个工作进程共享任务状态，服务重启后仍可查询）
+    task_store_backend: str = "database"  # memory：只保存在进程内；database：写入数据库
+    task_store_url: Optional[str] = None  # 为空时写入主数据库，也可指定独立的数据库（如 sqlite:///./task_store.db）
+    task_store_flush_interval: float = 1.0  # 进度更新批量写入间隔（秒）
+    task_store_heartbeat_interval: float = 10.0  # 执行中任务的心跳更新间隔（秒）
+    task_store_stale_timeout: float = 60.0  # 心跳超过该时间未更新的任务视为所在进程已退出（秒）
+    task_store_retention_hours: int = 24  # 已结束任务的保留时间（小时）
+
+    # 多模态图片预处理配置
+    image_max_edge: int = 1568  # 图片最长边（像素），超过时等比缩放（需要安装 Pillow）
+    image_jpeg_quality: int = 85  # 重新压缩为JPEG时的质量
+    image_detail: str = "auto"  # image_url 的 detail 参数：low / high / auto
+    image_dedup_distance: int = 5  # 感知哈希汉明距离不超过该值视为重复图片
+    image_max_count: int = 20  # 单次请求最多发送的图片数
+    image_max_total_bytes: int = 8 * 1024 * 1024  # 单次请求图片总字节数上限（8MB）
+    image_max_total_tokens: int = 20000  # 单次请求图片预估token总数上限
+    image_cache_dir: str = "./image_cache"  # 处理后图片的磁盘缓存目录
+
     # OpenAI API配置
     openai_api_key: Optional[str] = Field(
         default=None,
@@ -1,12 +1,12 @@
 """
-AI客户端基础类
+AI客户端连接池
 支持OpenAI兼容格式的所有模型
+
+每个 (base_url, api_key) 组合共享一个长生命周期的 httpx.AsyncClient，
+批量调用时复用 TCP/TLS 连接（keep-alive），避免每次调用都重新握手。
 """
 import asyncio
-import json
-import time
-from typing import Dict, Any, Optional, List, AsyncGenerator
-from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional, List, Tuple
 import httpx
 from pydantic import BaseModel
 
@@ -27,192 +27,176 @@ class AIResponse(BaseModel):
     finish_reason: Optional[str] = None
 
 
-class BaseAIClient(ABC):
-    """AI客户端基础抽象类"""
-    
-    def __init__(self, api_key: str, base_url: Optional[str] = None, model: str = "gpt-3.5-turbo"):
-        self.api_key = api_key
-        self.base_url = base_url or "https://api.openai.com/v1"
-        self.model = model
-        self.client = httpx.AsyncClient(
-            timeout=httpx.Timeout(60.0),
-            headers={"Authorization": f"Bearer {api_key}"}
-        )
-    
-    async def __aenter__(self):
-        return self
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
-    
-    @abstractmethod
-    async def chat_completion(
-        self,
-        messages: List[AIMessage],
-        temperature: float = 0.7,
-        max_tokens: int = 2000,
-        **kwargs
-    ) -> AIResponse:
-        """聊天完成接口"""
-        pass
-    
-    @abstractmethod
-    async def stream_chat_completion(
-        self,
-        messages: List[AIMessage],
-        temperature: float = 0.7,
-        max_tokens: int = 2000,
-        **kwargs
-    ) -> AsyncGenerator[str, None]:
-        """流式聊天完成接口"""
-        pass
-
-
-class OpenAICompatibleClient(BaseAIClient):
-    """OpenAI兼容格式客户端"""
-    
-    async def chat_completion(
-        self,
-        messages: List[AIMessage],
-        temperature: float = 0.7,
-        max_tokens: int = 2000,
-        **kwargs
-    ) -> AIResponse:
-        """聊天完成"""
-        try:
-            # 构建请求数据
-            request_data = {
-                "model": self.model,
-                "messages": [{"role": msg.role, "content": msg.content} for msg in messages],
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                **kwargs
-            }
-            
-            # 发送请求
-            response = await self.client.post(
-                f"{self.base_url}/chat/completions",
-                json=request_data
-            )
-            response.raise_for_status()
-            
-            # 解析响应
-            data = response.json()
-            choice = data["choices"][0]
-            
-            return AIResponse(
-                content=choice["message"]["content"],
-                usage=data.get("usage"),
-                model=data.get("model"),
-                finish_reason=choice.get("finish_reason")
-            )
-            
-        except httpx.HTTPError as e:
-            raise Exception(f"AI API请求失败: {e}")
-        except KeyError as e:
-            raise Exception(f"AI API响应格式错误: {e}")
-    
-    async def stream_chat_completion(
-        self,
-        messages: List[AIMessage],
-        temperature: float = 0.7,
-        max_tokens: int = 2000,
-        **kwargs
-    ) -> AsyncGenerator[str, None]:
-        """流式聊天完成"""
-        try:
-            # 构建请求数据
-            request_data = {
-                "model": self.model,
-                "messages": [{"role": msg.role, "content": msg.content} for msg in messages],
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "stream": True,
-                **kwargs
-            }
-            
-            # 发送流式请求
-            async with self.client.stream(
-                "POST",
-                f"{self.base_url}/chat/completions",
-                json=request_data
-            ) as response:
-                response.raise_for_status()
-                
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]  # 移除 "data: " 前缀
-                        
-                        if data_str.strip() == "[DONE]":
-                            break
-                        
-                        try:
-                            data = json.loads(data_str)
-                            choice = data["choices"][0]
-                            
-                            if "delta" in choice and "content" in choice["delta"]:
-                                content = choice["delta"]["content"]
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError:
-                            continue
-                            
-        except httpx.HTTPError as e:
-            raise Exception(f"AI流式API请求失败: {e}")
-
-
-class AIClientFactory:
-    """AI客户端工厂"""
-    
-    @staticmethod
-    def create_client(
-        provider: str,
-        api_key: str,
-        model: str,
-        base_url: Optional[str] = None
-    ) -> BaseAIClient:
-        """创建AI客户端"""
-        if provider.lower() in ["openai", "anthropic", "deepseek", "zhipu", "moonshot"]:
-            return OpenAICompatibleClient(
-                api_key=api_key,
-                base_url=base_url,
-                model=model
-            )
-        else:
-            raise ValueError(f"不支持的AI提供商: {provider}")
-
-
-# 全局AI客户端管理器
+class AIRequestError(Exception):
+    """AI接口返回非200状态码
+
+    status_code 和 retry_after（秒，来自 Retry-After 响应头）供限流和重试策略使用
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（只支持秒数格式）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class AITimeoutError(Exception):
+    """AI接口请求超时（连接或读取）"""
+
+    def __init__(self, message: str = "API调用超时，请稍后重试"):
+        super().__init__(message)
+
+
+class AIResponseParseError(Exception):
+    """AI响应无法解析为JSON（模型输出格式错误）"""
+
+
+class AIResponseTruncatedError(Exception):
+    """AI响应因达到 max_tokens 上限被截断（finish_reason=length）
+
+    重试同样的请求大概率仍会被截断，调用方应缩小批次后重新请求
+    """
+
+    def __init__(self, content: str, message: str = "AI响应被截断（达到max_tokens上限）"):
+        super().__init__(message)
+        self.content = content
+
+
+def normalize_base_url(base_url: str) -> str:
+    """标准化 OpenAI 兼容 API 的基础URL（统一以 /v1 结尾）"""
+    base_url = (base_url or "").rstrip('/')
+    if not base_url.endswith('/v1'):
+        base_url = f"{base_url}/v1"
+    return base_url
+
+
+def _http2_available() -> bool:
+    """检查是否安装了 HTTP/2 依赖（h2）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
 class AIClientManager:
-    """AI客户端管理器"""
-    
-    def __init__(self):
-        self._clients: Dict[int, BaseAIClient] = {}
-    
-    async def get_client(self, model_config: Dict[str, Any]) -> BaseAIClient:
-        """获取AI客户端"""
-        model_id = model_config["id"]
-        
-        # 如果客户端已存在，直接返回
-        if model_id in self._clients:
-            return self._clients[model_id]
-        
-        # 创建新客户端
-        client = AIClientFactory.create_client(
-            provider=model_config["provider"],
-            api_key=model_config["api_key"],
-            model=model_config["model_id"],
-            base_url=model_config.get("base_url")
+    """AI客户端管理器（连接池）
+
+    - 按 (base_url, api_key) 缓存 httpx.AsyncClient，进程内共享
+    - 连接数、保活时间、HTTP/2 等参数来自应用配置
+    - 应用启动时预热连接，关闭时统一释放
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None
+    ):
+        self._clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+        self._max_connections = max_connections or settings.ai_http_max_connections
+        self._max_keepalive_connections = max_keepalive_connections or settings.ai_http_max_keepalive_connections
+        self._keepalive_expiry = keepalive_expiry or settings.ai_http_keepalive_expiry
+
+        http2_requested = settings.ai_http2_enabled if http2 is None else http2
+        self._http2 = http2_requested and _http2_available()
+        if http2_requested and not self._http2:
+            print("⚠️ [AIClientManager] 未安装 h2，HTTP/2 已降级为 HTTP/1.1（pip install httpx[http2]）")
+
+    @property
+    def http2(self) -> bool:
+        """是否启用了HTTP/2"""
+        return self._http2
+
+    def _build_client(self, api_key: str) -> httpx.AsyncClient:
+        """创建带连接池限制的长连接客户端"""
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.ai_http_timeout, connect=settings.ai_http_connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self._max_connections,
+                max_keepalive_connections=self._max_keepalive_connections,
+                keepalive_expiry=self._keepalive_expiry
+            ),
+            headers={"Authorization": f"Bearer {api_key}"},
+            http2=self._http2
         )
-        
-        self._clients[model_id] = client
+
+    def get_client(self, base_url: str, api_key: str) -> httpx.AsyncClient:
+        """获取（或创建）指定端点的共享客户端
+
+        Args:
+            base_url: API基础URL
+            api_key: API密钥
+
+        Returns:
+            共享的 httpx.AsyncClient
+        """
+        key = (normalize_base_url(base_url), api_key or "")
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = self._build_client(api_key or "")
+            self._clients[key] = client
         return client
-    
-    async def remove_client(self, model_id: int):
-        """移除客户端"""
-        if model_id in self._clients:
-            client = self._clients.pop(model_id)
-            await client.__aexit__(None, None, None)
+
+    async def warmup(self, endpoints: List[Tuple[str, str]], timeout: float = 5.0) -> int:
+        """预热连接：为每个端点建立连接并放回连接池
+
+        发送一个轻量的 GET /models 请求，响应状态码不重要（401/404 同样完成了握手），
+        失败也不影响应用启动。
+
+        Args:
+            endpoints: (base_url, api_key) 列表
+            timeout: 单个端点预热超时（秒）
+
+        Returns:
+            成功建立连接的端点数量
+        """
+        unique = {(normalize_base_url(b), k or "") for b, k in endpoints if b}
+
+        async def _warm(base_url: str, api_key: str) -> bool:
+            client = self.get_client(base_url, api_key)
+            try:
+                response = await client.get(f"{base_url}/models", timeout=timeout)
+                await response.aclose()
+                return True
+            except Exception as e:
+                print(f"⚠️ [AIClientManager] 预热失败 {base_url}: {e}")
+                return False
+
+        results = await asyncio.gather(*[_warm(b, k) for b, k in unique])
+        return sum(1 for ok in results if ok)
+
+    async def remove_client(self, base_url: str, api_key: str) -> None:
+        """移除并关闭指定端点的客户端（模型的地址或密钥变更、模型删除时调用）"""
+        client = self._clients.pop((normalize_base_url(base_url), api_key or ""), None)
+        if client is not None:
+            await client.aclose()
+
+    async def close_all(self) -> None:
+        """关闭所有客户端（应用关闭时调用）"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*[c.aclose() for c in clients], return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接池信息"""
+        return {
+            "clients": len(self._clients),
+            "http2": self._http2,
+            "max_connections": self._max_connections,
+            "max_keepalive_connections": self._max_keepalive_connections,
+            "keepalive_expiry": self._keepalive_expiry
+        }
 
 
 # 全局客户端管理器实例
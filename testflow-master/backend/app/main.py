@@ -9,6 +9,7 @@ from app.config import settings, get_settings
 from app.database import create_tables, SessionLocal
 from app.services.settings_service import SettingsService
 from app.services.async_task_manager import task_manager
+from app.core.ai_client import ai_client_manager
 
 
 @asynccontextmanager
@@ -42,6 +43,31 @@ async def lifespan(app: FastAPI):
         # 加载并发配置到任务管理器
         task_manager.load_config_from_db(db)
         print("✅ 任务管理器并发配置加载完成")
+        task_manager.start_store()
+        
+        # 上次进程中未执行完的一键生成任务标记为已中断，可通过 API 从检查点恢复
+        # （其他工作进程中仍在执行的任务除外）
+        from app.services.pipeline_checkpoint import mark_interrupted_runs
+        interrupted = mark_interrupted_runs(db)
+        if interrupted:
+            print(f"⚠️ 检测到 {len(interrupted)} 个中断的生成任务，可从检查点恢复: "
+                  f"{', '.join(c.task_id for c in interrupted)}")
+        
+        # 加载模型限额到限流器
+        from app.models.ai_config import AIModel
+        from app.services.rate_limiter import rate_limiter
+        rate_limiter.configure_from_models(db.query(AIModel).all())
+        print("✅ AI模型限流配置加载完成")
+        
+        # 预热已激活模型的HTTP连接
+        if settings.ai_http_warmup_enabled:
+            endpoints = [
+                (m.base_url, m.api_key)
+                for m in db.query(AIModel).filter(AIModel.is_active == True).all()
+            ]
+            if endpoints:
+                warmed = await ai_client_manager.warmup(endpoints)
+                print(f"✅ AI连接池预热完成: {warmed}/{len(endpoints)} 个模型端点")
     except Exception as e:
         print(f"⚠️ 初始化警告: {e}")
     finally:
@@ -49,6 +75,10 @@ async def lifespan(app: FastAPI):
     
     yield
     # 关闭时的清理工作
+    await ai_client_manager.close_all()
+    from app.services.llm_telemetry import llm_telemetry
+    llm_telemetry.flush()
+    task_manager.close()
     print("👋 应用关闭")
 
 
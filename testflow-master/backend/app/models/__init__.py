@@ -6,7 +6,11 @@ from app.models.project import Project
 from app.models.module import Module, ModuleAssignment, ModuleStatus, ModulePriority
 from app.models.requirement import RequirementFile, RequirementPoint
 from app.models.requirement_image import RequirementImage
+from app.models.requirement_segment import RequirementSegment
 from app.models.testcase import TestPoint, TestCase, TestCaseReview
+from app.models.testcase_signature import TestCaseSignature
+from app.models.generation_checkpoint import GenerationCheckpoint, GenerationCheckpointItem
+from app.models.async_task import AsyncTaskRecord
 from app.models.ai_config import AIModel, Agent, TaskLog
 from app.models.settings import TestCategory, TestDesignMethod, SystemConfig
 
@@ -21,9 +25,14 @@ __all__ = [
     "RequirementFile",
     "RequirementPoint",
     "RequirementImage",
+    "RequirementSegment",
     "TestPoint",
     "TestCase",
     "TestCaseReview",
+    "TestCaseSignature",
+    "GenerationCheckpoint",
+    "GenerationCheckpointItem",
+    "AsyncTaskRecord",
     "AIModel",
     "Agent",
     "TaskLog",
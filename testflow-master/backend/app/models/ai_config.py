@@ -40,6 +40,9 @@ class AIModel(Base):
     max_tokens: Mapped[int] = mapped_column(Integer, default=4000)  # 最大令牌数
     temperature: Mapped[float] = mapped_column(Float, default=0.7)  # 温度参数
     stream_support: Mapped[bool] = mapped_column(Boolean, default=True)  # 是否支持流式输出
+    rpm_limit: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # 每分钟请求数上限（空表示不限制）
+    tpm_limit: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # 每分钟token数上限（空表示不限制）
+    max_in_flight: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # 最大并发请求数（空表示不限制）
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     
     # 用户信息
@@ -71,6 +74,8 @@ class Agent(Base):
     system_prompt: Mapped[Optional[str]] = mapped_column(Text)  # 系统提示词
     temperature: Mapped[float] = mapped_column(Float, default=0.7)
     max_tokens: Mapped[int] = mapped_column(Integer, default=128000)  # 128k tokens
+    cache_enabled: Mapped[bool] = mapped_column(Boolean, default=True)  # 是否启用LLM响应缓存
+    fallback_model_ids: Mapped[Optional[List[int]]] = mapped_column(JSON, nullable=True)  # 备用模型ID（按优先级排序）
     
     # 状态
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
@@ -104,6 +109,17 @@ class TaskLog(Base):
     error_message: Mapped[Optional[str]] = mapped_column(Text)
     execution_time: Mapped[Optional[float]] = mapped_column(Float)  # 执行时间（秒）
     
+    # AI调用遥测（task_type 为 llm_call 时填写）
+    run_id: Mapped[Optional[str]] = mapped_column(String(64), index=True)  # 所属异步任务ID
+    stage: Mapped[Optional[str]] = mapped_column(String(50))  # 调用阶段（智能体类型）
+    model: Mapped[Optional[str]] = mapped_column(String(100))  # 实际响应的模型（故障转移后可能是备用模型）
+    ttft: Mapped[Optional[float]] = mapped_column(Float)  # 首token延迟（秒）
+    prompt_tokens: Mapped[Optional[int]] = mapped_column(Integer)
+    completion_tokens: Mapped[Optional[int]] = mapped_column(Integer)
+    retry_count: Mapped[int] = mapped_column(Integer, default=0)
+    cache_hit: Mapped[bool] = mapped_column(Boolean, default=False)
+    error_class: Mapped[Optional[str]] = mapped_column(String(30))  # 最终失败时的错误类型
+    
     # 用户信息
     created_by: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     
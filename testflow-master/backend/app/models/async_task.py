@@ -0,0 +1,41 @@
+"""
+异步任务状态模型
+"""
+from typing import Any, Optional
+from datetime import datetime
+from sqlalchemy import Integer, String, Text, DateTime, JSON
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Base
+
+
+class AsyncTaskRecord(Base):
+    """异步任务状态模型 - AsyncTaskManager 的持久化任务状态，供多个工作进程查询和服务重启后查询
+
+    时间字段与 AsyncTask 一致，均为不带时区的 UTC 时间
+    """
+    __tablename__ = "async_tasks"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    task_id: Mapped[str] = mapped_column(String(64), nullable=False, unique=True, index=True)
+    task_type: Mapped[str] = mapped_column(String(50), nullable=False)
+    # pending / running / completed / failed / cancelled / timeout
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending", index=True)
+    progress: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total_batches: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    completed_batches: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # 任务结果：生成的数据已保存在各自的表中，这里是返回给前端的结果摘要和数据ID
+    result: Mapped[Optional[Any]] = mapped_column(JSON, nullable=True)
+
+    # 执行任务的工作进程和心跳（工作进程退出后心跳停止更新，超时的任务由其他进程标记为失败）
+    worker_id: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, index=True)
+
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, index=True)
+
+    def __repr__(self) -> str:
+        return f"AsyncTaskRecord(task_id={self.task_id!r}, status={self.status!r}, progress={self.progress})"
@@ -0,0 +1,77 @@
+"""
+生成任务检查点模型
+"""
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from sqlalchemy import Boolean, Integer, String, Text, ForeignKey, DateTime, JSON
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class GenerationCheckpoint(Base):
+    """生成任务检查点模型 - 一键生成的阶段、已完成的项和已产出的数据ID，用于服务重启后恢复"""
+    __tablename__ = "generation_checkpoints"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    task_id: Mapped[str] = mapped_column(String(64), nullable=False, unique=True, index=True)
+    task_type: Mapped[str] = mapped_column(String(50), nullable=False, default="one_click_generation")
+    # running / completed / failed / interrupted / resuming（恢复任务已提交）/ resumed
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="running", index=True)
+    # requirement（需求点生成中）/ streaming（测试点 → 用例 → 优化）/ finished
+    stage: Mapped[str] = mapped_column(String(30), nullable=False, default="requirement")
+
+    # 任务参数（恢复时按原参数继续执行）
+    project_id: Mapped[Optional[int]] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), index=True)
+    module_id: Mapped[int] = mapped_column(ForeignKey("modules.id", ondelete="CASCADE"), nullable=False)
+    requirement_file_id: Mapped[int] = mapped_column(
+        ForeignKey("requirement_files.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+    user_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    agent_ids: Mapped[Dict[str, Any]] = mapped_column(JSON, nullable=False)
+    params: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSON, nullable=True)  # image_paths、incremental
+    context_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # 生成配置和智能体配置的哈希
+
+    # 旧版本记录的进度：{"requirement_points": [...], "test_points": [...], "test_cases": [...]}
+    # 新的进度逐条写入 generation_checkpoint_items
+    produced: Mapped[Optional[Dict[str, List[int]]]] = mapped_column(JSON, nullable=True)
+    completed: Mapped[Optional[Dict[str, List[int]]]] = mapped_column(JSON, nullable=True)
+    progress: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    resumed_by_task_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # 接续执行的新任务
+
+    # 时间戳
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now()
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"GenerationCheckpoint(task_id={self.task_id!r}, status={self.status!r}, stage={self.stage!r})"
+
+
+class GenerationCheckpointItem(Base):
+    """检查点进度项模型 - 每产出或完成一个数据写入一行，只追加不更新"""
+    __tablename__ = "generation_checkpoint_items"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    checkpoint_id: Mapped[int] = mapped_column(
+        ForeignKey("generation_checkpoints.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+    kind: Mapped[str] = mapped_column(String(30), nullable=False)  # requirement_points / test_points / test_cases
+    item_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # False：已产出；True：已完成下一阶段的工作
+    completed: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+
+    def __repr__(self) -> str:
+        return f"GenerationCheckpointItem(checkpoint_id={self.checkpoint_id}, kind={self.kind!r}, item_id={self.item_id})"
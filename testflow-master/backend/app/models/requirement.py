@@ -1,9 +1,9 @@
 """
 需求相关数据模型
 """
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Enum
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Enum, JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 import enum
@@ -41,6 +41,9 @@ class RequirementFile(Base):
     has_images: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     image_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     
+    # 上次一键生成时的文档分段指纹（用于增量重新生成）
+    generation_fingerprint: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSON, nullable=True)
+    
     # 时间戳
     upload_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     
@@ -50,6 +53,7 @@ class RequirementFile(Base):
     uploader: Mapped["User"] = relationship("User")
     requirement_points: Mapped[List["RequirementPoint"]] = relationship("RequirementPoint", back_populates="requirement_file")
     images: Mapped[List["RequirementImage"]] = relationship("RequirementImage", back_populates="requirement_file", cascade="all, delete-orphan")
+    segments: Mapped[List["RequirementSegment"]] = relationship("RequirementSegment", back_populates="requirement_file", cascade="all, delete-orphan")
     
     def __repr__(self) -> str:
         return f"RequirementFile(id={self.id!r}, filename={self.filename!r}, project_id={self.project_id!r})"
@@ -71,6 +75,7 @@ class RequirementPoint(Base):
     priority: Mapped[str] = mapped_column(String(20), default="medium")  # high/medium/low
     source: Mapped[str] = mapped_column(String(20), default="manual")  # ai_generated/manual
     order_num: Mapped[int] = mapped_column("order_index", Integer, default=0, index=True)  # 排序号，数据库列名为order_index
+    source_segment_hash: Mapped[Optional[str]] = mapped_column(String(64), index=True)  # 来源文档分段的指纹（一键生成时记录）
     
     # 状态（保留以兼容旧数据）
     status: Mapped[Optional[RequirementStatus]] = mapped_column(Enum(RequirementStatus), default=RequirementStatus.DRAFT)
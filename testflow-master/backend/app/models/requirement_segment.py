@@ -0,0 +1,47 @@
+"""
+需求文档分段模型
+"""
+from typing import Any, Dict, Optional
+from datetime import datetime
+from sqlalchemy import Integer, String, Text, ForeignKey, DateTime, JSON
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class RequirementSegment(Base):
+    """需求文档分段模型 - 按标题切分的文档片段及其分词结果，用于BM25检索"""
+    __tablename__ = "requirement_segments"
+    
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    requirement_file_id: Mapped[int] = mapped_column(
+        ForeignKey("requirement_files.id", ondelete="CASCADE"), 
+        nullable=False, 
+        index=True
+    )
+    
+    # 分段内容
+    segment_index: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # 在文档中的顺序
+    heading: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    token_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # 预估token数
+    
+    # 检索信息
+    terms: Mapped[Dict[str, Any]] = mapped_column(JSON, nullable=False)  # 词项 -> 词频
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)  # 分段时文档内容的哈希，用于判断是否过期
+    
+    # 时间戳
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), 
+        server_default=func.now()
+    )
+    
+    # 关系
+    requirement_file: Mapped["RequirementFile"] = relationship(
+        "RequirementFile", 
+        back_populates="segments"
+    )
+    
+    def __repr__(self) -> str:
+        return f"RequirementSegment(id={self.id!r}, file_id={self.requirement_file_id!r}, index={self.segment_index!r})"
@@ -0,0 +1,58 @@
+"""
+测试用例指纹模型
+"""
+from typing import Optional
+from datetime import datetime
+from sqlalchemy import BigInteger, Integer, String, ForeignKey, DateTime, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class TestCaseSignature(Base):
+    """测试用例指纹模型 - 用例内容的 SimHash 及其分段，用于近似重复检测"""
+    __tablename__ = "test_case_signatures"
+    __table_args__ = tuple(
+        Index(f"ix_test_case_signatures_project_band{i}", "project_id", f"band{i}") for i in range(4)
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    test_case_id: Mapped[int] = mapped_column(
+        ForeignKey("test_cases.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+        index=True
+    )
+    project_id: Mapped[Optional[int]] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), index=True)
+    module_id: Mapped[Optional[int]] = mapped_column(ForeignKey("modules.id", ondelete="SET NULL"), index=True)
+
+    # 64位 SimHash（按有符号整数存储）及其4个16位分段，任一分段相同即为候选（按项目+分段建联合索引）
+    simhash: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    band0: Mapped[int] = mapped_column(Integer, nullable=False)
+    band1: Mapped[int] = mapped_column(Integer, nullable=False)
+    band2: Mapped[int] = mapped_column(Integer, nullable=False)
+    band3: Mapped[int] = mapped_column(Integer, nullable=False)
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)  # 计算指纹时用例内容的哈希，用于判断是否过期
+
+    # 近似重复标记：与之重复的较早用例
+    duplicate_of_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("test_cases.id", ondelete="SET NULL"),
+        nullable=True,
+        index=True
+    )
+    distance: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # 与重复用例的汉明距离
+
+    # 时间戳
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now()
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"TestCaseSignature(test_case_id={self.test_case_id!r}, duplicate_of_id={self.duplicate_of_id!r})"
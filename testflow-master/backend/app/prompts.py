@@ -289,6 +289,57 @@ TEST_CASE_DESIGN_USER = """
 """
 
 
+# 共享上下文前缀：需求文档（或其摘要）放在提示词最前面，所有批次保持一致，便于命中提示词缓存
+TEST_CASE_DESIGN_SHARED_CONTEXT = """
+<shared_context>
+【原始需求文档】
+{{requirement_content}}
+</shared_context>
+"""
+
+# 需求文档已放在共享前缀中时，填入 TEST_CASE_DESIGN_USER 的 {{requirement_content}}
+SHARED_CONTEXT_REFERENCE = "（见提示词开头 <shared_context> 中的原始需求文档）"
+
+
+# ============================================================
+# 需求文档摘要提示词
+# ============================================================
+
+REQUIREMENT_DIGEST_SYSTEM = """你是一个需求分析专家，擅长把冗长的需求文档压缩为供测试设计使用的摘要。"""
+
+REQUIREMENT_DIGEST_USER = """
+<context>
+【原始需求文档】
+{{content}}
+</context>
+
+<task>
+请将上述需求文档压缩为一份测试设计用的摘要，控制在约 {{max_tokens}} 字以内：
+1. 按功能模块组织，保留模块名称和层级关系
+2. 保留所有业务规则、约束条件、字段校验规则、取值范围和边界值
+3. 保留状态流转、权限角色、异常处理和错误提示等信息
+4. 删除背景介绍、修订记录、重复描述等与测试设计无关的内容
+5. 不要添加原文中不存在的内容
+</task>
+
+<output_format>
+只输出JSON，格式为：{"digest": "摘要内容"}
+JSON字符串中避免使用双引号(")，如需引用文字请使用单引号(')
+</output_format>
+"""
+
+
+# ============================================================
+# 续写提示词（响应因 max_tokens 被截断时追加在已输出内容之后）
+# ============================================================
+
+CONTINUATION_USER = """上一条回复因长度限制被截断。请从中断处直接继续输出剩余内容：
+1. 紧接上一条回复的最后一个字符开始输出，不要重复已经输出的内容，也不要从头重新输出
+2. 不要添加任何解释说明，也不要添加 ```json 等代码块开头标记
+3. 输出完成后，整体内容应是一个完整、合法的JSON
+"""
+
+
 # ============================================================
 # 用例优化提示词
 # ============================================================
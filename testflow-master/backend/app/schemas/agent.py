@@ -3,7 +3,7 @@
 """
 from pydantic import BaseModel, Field, ConfigDict
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from enum import Enum
 
 
@@ -24,6 +24,8 @@ class AgentBase(BaseModel):
     system_prompt: Optional[str] = Field(None, description="系统提示词")
     temperature: float = Field(default=0.7, ge=0.0, le=2.0, description="温度参数")
     max_tokens: int = Field(default=128000, ge=100, le=128000, description="最大令牌数")
+    cache_enabled: bool = Field(default=True, description="是否启用LLM响应缓存")
+    fallback_model_ids: Optional[List[int]] = Field(default=None, description="备用模型ID列表（按优先级排序）")
     is_active: bool = Field(default=True, description="是否激活")
 
 
@@ -41,6 +43,8 @@ class AgentUpdate(BaseModel):
     system_prompt: Optional[str] = Field(None, description="系统提示词")
     temperature: Optional[float] = Field(None, ge=0.0, le=2.0, description="温度参数")
     max_tokens: Optional[int] = Field(None, ge=100, le=128000, description="最大令牌数")
+    cache_enabled: Optional[bool] = Field(None, description="是否启用LLM响应缓存")
+    fallback_model_ids: Optional[List[int]] = Field(None, description="备用模型ID列表（按优先级排序）")
     is_active: Optional[bool] = Field(None, description="是否激活")
 
 
@@ -13,6 +13,9 @@ class AIModelBase(BaseModel):
     api_key: str = Field(..., min_length=10, description="API密钥")
     max_tokens: int = Field(default=4000, ge=100, le=128000, description="最大令牌数")
     temperature: float = Field(default=0.7, ge=0.0, le=2.0, description="温度参数")
+    rpm_limit: Optional[int] = Field(default=None, ge=1, description="每分钟请求数上限")
+    tpm_limit: Optional[int] = Field(default=None, ge=1, description="每分钟token数上限")
+    max_in_flight: Optional[int] = Field(default=None, ge=1, description="最大并发请求数")
     is_active: bool = Field(default=True, description="是否激活")
 
 
@@ -31,6 +34,9 @@ class AIModelUpdate(BaseModel):
     api_key: Optional[str] = Field(None, min_length=10, description="API密钥")
     max_tokens: Optional[int] = Field(None, ge=100, le=128000, description="最大令牌数")
     temperature: Optional[float] = Field(None, ge=0.0, le=2.0, description="温度参数")
+    rpm_limit: Optional[int] = Field(None, ge=1, description="每分钟请求数上限")
+    tpm_limit: Optional[int] = Field(None, ge=1, description="每分钟token数上限")
+    max_in_flight: Optional[int] = Field(None, ge=1, description="最大并发请求数")
     is_active: Optional[bool] = Field(None, description="是否激活")
 
 
@@ -110,6 +110,204 @@ class ConcurrencyConfig(BaseModel):
         le=1000,
         description="任务队列大小（范围：10-1000）"
     )
+    adaptive_concurrency: bool = Field(
+        default=True,
+        description="是否按延迟和限流错误自适应调整每个模型的并发（AIMD）"
+    )
+    adaptive_max_in_flight: int = Field(
+        default=16,
+        ge=1,
+        le=64,
+        description="自适应并发窗口上限（范围：1-64）"
+    )
+    hedging_enabled: bool = Field(
+        default=False,
+        description="首token迟迟未返回时是否向备用模型（或同一模型）发起对冲请求，先返回者胜出"
+    )
+    hedge_percentile: float = Field(
+        default=0.95,
+        ge=0.5,
+        le=0.99,
+        description="对冲请求的触发延迟取该模型首token延迟的分位数（范围：0.5-0.99）"
+    )
+    hedge_min_delay: int = Field(
+        default=5,
+        ge=1,
+        le=120,
+        description="对冲请求的最小触发延迟，单位秒（范围：1-120）"
+    )
+    circuit_failure_threshold: int = Field(
+        default=5,
+        ge=1,
+        le=50,
+        description="模型连续失败多少次后熔断（范围：1-50）"
+    )
+    circuit_open_seconds: int = Field(
+        default=60,
+        ge=5,
+        le=600,
+        description="模型熔断持续时间，单位秒（范围：5-600）"
+    )
+    retry_budget_attempts: int = Field(
+        default=30,
+        ge=0,
+        le=500,
+        description="单个任务所有AI调用累计的重试次数上限（范围：0-500）"
+    )
+    retry_budget_seconds: int = Field(
+        default=300,
+        ge=0,
+        le=3600,
+        description="单个任务连续失败时继续重试的时长上限，从第一次失败算起，任一调用成功后重新计时，单位秒（范围：0-3600）"
+    )
+
+
+# ============== Generation Config Schema ==============
+
+class GenerationConfig(BaseModel):
+    """生成配置模式
+    
+    用于控制一键生成流程的参数：
+    - 批次规划：设计/优化阶段按token预算自适应分批
+    - 需求上下文：用例设计携带完整文档、相关章节节选或一次性摘要
+    - 流水线：测试点、用例设计、用例优化各阶段的流式执行和工作协程数
+    - 质量门禁：本地规则打分，低于阈值的用例才送去AI优化
+    - 近似去重：保存用例时检测与项目内已有用例的近似重复，标记或合并
+    - 增量生成：需求文件修改后只重新生成变化的部分
+    - 批量生成：项目批量生成的并行文件数和共享的AI调用并发数
+    """
+    adaptive_batching: bool = Field(
+        default=True,
+        description="是否按token预算自适应分批（关闭时每批固定3个）"
+    )
+    design_max_batch_size: int = Field(
+        default=10,
+        ge=1,
+        le=50,
+        description="用例设计每批最多测试点数（范围：1-50）"
+    )
+    design_tokens_per_case: int = Field(
+        default=600,
+        ge=100,
+        le=8000,
+        description="每个设计用例的预估输出token数（范围：100-8000）"
+    )
+    optimize_max_batch_size: int = Field(
+        default=10,
+        ge=1,
+        le=50,
+        description="用例优化每批最多用例数（范围：1-50）"
+    )
+    optimize_tokens_per_case: int = Field(
+        default=700,
+        ge=100,
+        le=8000,
+        description="每个优化用例的预估输出token数（范围：100-8000）"
+    )
+    max_input_tokens: int = Field(
+        default=32000,
+        ge=1000,
+        le=1000000,
+        description="单次调用的输入token预算（范围：1000-1000000）"
+    )
+    context_mode: str = Field(
+        default="excerpt",
+        pattern="^(full|prefix|excerpt|summary)$",
+        description="用例设计携带需求文档的方式：full 完整文档 / prefix 完整文档作为稳定前缀 / excerpt 相关章节节选 / summary 一次性摘要"
+    )
+    context_excerpt_tokens: int = Field(
+        default=2000,
+        ge=200,
+        le=32000,
+        description="excerpt 模式下每批（或每个需求点）携带的需求文档节选token上限（范围：200-32000）"
+    )
+    context_summary_tokens: int = Field(
+        default=1500,
+        ge=200,
+        le=16000,
+        description="summary 模式下需求文档摘要的目标长度（范围：200-16000）"
+    )
+    context_top_k: int = Field(
+        default=3,
+        ge=1,
+        le=20,
+        description="excerpt 模式下每个测试点/需求点检索的需求文档分段数（范围：1-20）"
+    )
+    context_full_threshold_tokens: int = Field(
+        default=3000,
+        ge=0,
+        le=100000,
+        description="需求文档不超过该token数时直接完整携带（作为稳定前缀）（范围：0-100000）"
+    )
+    pipeline_streaming: bool = Field(
+        default=True,
+        description="完整生成流程是否流式执行：测试点生成、用例设计、用例优化重叠进行（关闭时逐阶段执行）"
+    )
+    pipeline_test_point_workers: int = Field(
+        default=0,
+        ge=0,
+        le=64,
+        description="流式流程中测试点生成阶段的工作协程数，0表示使用AI调用并发数（范围：0-64）"
+    )
+    pipeline_design_workers: int = Field(
+        default=0,
+        ge=0,
+        le=64,
+        description="流式流程中用例设计阶段的工作协程数，0表示使用AI调用并发数（范围：0-64）"
+    )
+    pipeline_optimize_workers: int = Field(
+        default=0,
+        ge=0,
+        le=64,
+        description="流式流程中用例优化阶段的工作协程数，0表示使用AI调用并发数（范围：0-64）"
+    )
+    pipeline_queue_size: int = Field(
+        default=16,
+        ge=1,
+        le=1000,
+        description="流式流程中每个阶段的队列长度上限，下游积压时上游等待（范围：1-1000）"
+    )
+    quality_gate_enabled: bool = Field(
+        default=True,
+        description="完整生成流程中是否先用本地规则为用例打分，只优化低于阈值的用例"
+    )
+    quality_gate_threshold: int = Field(
+        default=80,
+        ge=0,
+        le=101,
+        description="用例质量分低于该值才送去AI优化，101表示全部优化（范围：0-101）"
+    )
+    dedup_enabled: bool = Field(
+        default=True,
+        description="保存生成的用例时是否检查与项目内已有用例近似重复"
+    )
+    dedup_action: str = Field(
+        default="flag",
+        pattern="^(flag|merge)$",
+        description="发现近似重复时的处理方式：flag 仅标记 / merge 丢弃新生成的重复用例"
+    )
+    dedup_max_distance: int = Field(
+        default=3,
+        ge=0,
+        le=3,
+        description="判定为近似重复的最大 SimHash 汉明距离（范围：0-3）"
+    )
+    incremental_regeneration: bool = Field(
+        default=True,
+        description="一键生成时是否只重新生成需求文档中修改过的分段（关闭时清空后全量生成）"
+    )
+    bulk_parallel_files: int = Field(
+        default=2,
+        ge=1,
+        le=20,
+        description="项目批量生成时同时执行的需求文件数（范围：1-20）"
+    )
+    bulk_llm_call_budget: int = Field(
+        default=0,
+        ge=0,
+        le=256,
+        description="项目批量生成时所有需求文件共享的AI调用并发数，0表示使用AI调用并发数（范围：0-256）"
+    )
 
 
 # ============== System Config Schemas ==============
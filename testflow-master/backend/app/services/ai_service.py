@@ -3,12 +3,71 @@ AI服务 - 调用大语言模型
 只支持 OpenAI 兼容格式的 API 调用
 支持流式生成，避免长时间连接超时
 """
+import asyncio
 import json
 import os
 import base64
-from typing import Dict, Any, List, Optional
+import time
+from typing import Dict, Any, List, Optional, Callable, Tuple
 import httpx
 
+from app.core.ai_client import (
+    ai_client_manager, normalize_base_url, parse_retry_after,
+    AIRequestError, AIResponseTruncatedError, AITimeoutError
+)
+from app.services.rate_limiter import rate_limiter, estimate_message_tokens
+from app.services.concurrency_controller import concurrency_controller
+from app.services.image_pipeline import image_pipeline
+from app.services.llm_recorder import llm_recorder
+from app.services.llm_telemetry import current_call_metrics
+from app.services.batch_planner import estimate_tokens
+from app.utils.json_repair import repair_json
+from app.prompts import CONTINUATION_USER
+from app.config import settings
+
+
+# 判断续写内容与已输出内容重叠时，要求的最短重叠长度（过短容易误判）
+_MIN_OVERLAP = 8
+_MAX_OVERLAP = 500
+
+
+def _stitch_continuation(previous: str, continuation: str) -> str:
+    """返回续写响应中需要追加的部分（去掉模型重复输出的内容）"""
+    # 模型从头重新输出了一遍
+    if continuation.startswith(previous):
+        return continuation[len(previous):]
+    
+    # 模型又输出了代码块开头标记
+    if "```" in previous and continuation.lstrip().startswith("```"):
+        continuation = continuation.lstrip()
+        newline = continuation.find("\n")
+        continuation = continuation[newline + 1:] if newline >= 0 else ""
+        fence = previous.find("```")
+        newline = previous.find("\n", fence)
+        body = previous[newline + 1:] if newline >= 0 else ""
+        if body and continuation.startswith(body):
+            return continuation[len(body):]
+    
+    # 续写开头重复了已输出内容的结尾
+    for size in range(min(len(previous), len(continuation), _MAX_OVERLAP), _MIN_OVERLAP - 1, -1):
+        if previous.endswith(continuation[:size]):
+            return continuation[size:]
+    return continuation
+
+
+def _is_complete_json(text: str) -> bool:
+    """拼接后的内容是否为结构完整的JSON（非JSON内容不校验）"""
+    if "{" not in text and "[" not in text:
+        return True
+    repaired, truncated = repair_json(text)
+    if truncated:
+        return False
+    try:
+        json.loads(repaired)
+        return True
+    except json.JSONDecodeError:
+        return False
+
 
 class AIService:
     """AI服务类 - 使用 OpenAI 兼容格式调用大语言模型"""
@@ -40,28 +99,109 @@ class AIService:
         api_key: str,
         base_url: str,
         temperature: float = 0.7,
-        max_tokens: int = 2000
+        max_tokens: int = 2000,
+        on_delta: Optional[Callable[[str], None]] = None,
+        max_continuations: Optional[int] = None,
+        model_key: Optional[str] = None
     ) -> str:
         """
         流式调用 OpenAI 兼容格式的 API，收集所有输出后返回
         
+        响应因达到 max_tokens 被截断（finish_reason=length）时，把已输出的内容作为 assistant 消息、
+        追加续写指令继续请求，并把各段输出拼接为一个完整响应
+        
         Args:
             model: 模型ID
             messages: 消息列表
             api_key: API密钥
             base_url: API基础URL
             temperature: 温度参数
-            max_tokens: 最大令牌数
+            max_tokens: 最大令牌数（每次请求）
+            on_delta: 增量回调，每收到一段内容调用一次（用于边生成边解析）
+            max_continuations: 最多续写次数，默认使用 settings.ai_max_continuations
+            model_key: 限流器、并发窗口使用的模型键（rate_limiter.model_key），默认使用模型ID
             
         Returns:
             AI响应内容（完整收集后返回）
+            
+        Raises:
+            AIRequestError: 接口返回非200状态码
+            AIResponseTruncatedError: 续写次数用尽仍被截断，或拼接后的内容不是完整的JSON
+        
+        Note:
+            调用前按模型键排队获取限流额度（RPM/TPM/并发），所有任务共享同一限流器
         """
-        # 确保 base_url 格式正确
-        base_url = base_url.rstrip('/')
-        if not base_url.endswith('/v1'):
-            base_url = f"{base_url}/v1"
+        if max_continuations is None:
+            max_continuations = settings.ai_max_continuations
         
-        url = f"{base_url}/chat/completions"
+        full_content = ""
+        first_token_latency = None
+        prompt_tokens = completion_tokens = 0
+        usage_reported = True
+        continuations = 0
+        while True:
+            if continuations == 0:
+                request_messages = messages
+            else:
+                request_messages = messages + [
+                    {"role": "assistant", "content": full_content},
+                    {"role": "user", "content": CONTINUATION_USER}
+                ]
+            # 续写的内容要先去掉与已输出内容重复的部分，因此整段收到后再回调
+            content, finish_reason, usage, ttft = await self._stream_once(
+                model, request_messages, api_key, base_url, temperature, max_tokens,
+                on_delta if continuations == 0 else None, model_key
+            )
+            if continuations == 0:
+                first_token_latency = ttft
+                full_content = content
+            else:
+                addition = _stitch_continuation(full_content, content)
+                full_content += addition
+                if on_delta and addition:
+                    on_delta(addition)
+            prompt_tokens += (usage or {}).get("prompt_tokens") or estimate_message_tokens(request_messages)
+            completion_tokens += (usage or {}).get("completion_tokens") or estimate_tokens(content)
+            usage_reported = usage_reported and bool(usage)
+            
+            if finish_reason != "length":
+                break
+            print(f"✂️ AI响应被截断: finish_reason=length, max_tokens={max_tokens}")
+            if continuations >= max_continuations:
+                raise AIResponseTruncatedError(full_content)
+            continuations += 1
+            print(f"➕ 自动续写 ({continuations}/{max_continuations})，已输出 {len(full_content)} 字符")
+        
+        if continuations and not _is_complete_json(full_content):
+            print(f"⚠️ 续写拼接后的内容不是完整的JSON，按截断处理")
+            raise AIResponseTruncatedError(full_content, "AI响应续写拼接后仍不完整")
+        
+        # 检查响应内容是否有效
+        if not full_content or len(full_content) < 10:  # 内容太短，可能无效
+            print(f"❌ AI返回内容过短: {len(full_content)} 字符")
+            raise Exception(f"AI返回内容无效: 内容过短 ({len(full_content)} 字符)")
+        
+        metrics = current_call_metrics()
+        if metrics is not None:
+            # 供应商未返回 usage 时按文本估算
+            metrics.record_response(model, first_token_latency, prompt_tokens, completion_tokens, usage_reported)
+        return full_content
+    
+    async def _stream_once(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        api_key: str,
+        base_url: str,
+        temperature: float,
+        max_tokens: int,
+        on_delta: Optional[Callable[[str], None]] = None,
+        model_key: Optional[str] = None
+    ) -> Tuple[str, Optional[str], Optional[Dict[str, Any]], Optional[float]]:
+        """发送一次流式请求，返回 (内容, finish_reason, usage, 首token延迟)"""
+        key = model_key or model
+        # 确保 base_url 格式正确
+        url = f"{normalize_base_url(base_url)}/chat/completions"
         
         headers = {
             "Authorization": f"Bearer {api_key}",
@@ -75,13 +215,25 @@ class AIService:
             "max_tokens": max_tokens,
             "stream": True  # 启用流式输出
         }
+        if settings.ai_stream_include_usage:
+            data["stream_options"] = {"include_usage": True}
         
         print(f"🤖 AI流式调用: model={model}, url={url}")
         
         collected_content = []
+        finish_reason = None
+        usage = None
         
-        try:
-            async with httpx.AsyncClient(timeout=300.0) as client:  # 增加超时时间
+        # 按模型键排队获取限流额度（所有任务共享）
+        metrics = current_call_metrics()
+        if metrics is not None:
+            metrics.http_calls += 1
+        async with rate_limiter.limit(key, estimate_message_tokens(messages)) as permit:
+            start = time.perf_counter()
+            first_token_latency = None  # 首token延迟，作为自适应并发的延迟信号
+            try:
+                # 使用连接池中的长连接客户端（复用 TCP/TLS 连接）
+                client = ai_client_manager.get_client(base_url, api_key)
                 async with client.stream("POST", url, headers=headers, json=data) as response:
                     print(f"📡 API请求: {response.status_code} {response.url}")
                     print(f"📝 请求数据: {json.dumps(data, ensure_ascii=False, indent=2)[:500]}...")
@@ -89,46 +241,69 @@ class AIService:
                         error_text = await response.aread()
                         error_str = error_text.decode()
                         print(f"❌ API调用失败: {response.status_code} - {error_str}")
-                        raise Exception(f"API返回错误: {response.status_code}，详情: {error_str[:200]}...")
-                    
+                        retry_after = parse_retry_after(response.headers.get("retry-after"))
+                        if response.status_code == 429:
+                            # 供应商限流：暂停该模型的所有排队请求
+                            permit.limiter.pause(retry_after or 1.0)
+                        if response.status_code == 429 or response.status_code >= 500:
+                            concurrency_controller.record_congestion(key, f"HTTP {response.status_code}")
+                        raise AIRequestError(
+                            f"API返回错误: {response.status_code}，详情: {error_str[:200]}...",
+                            status_code=response.status_code,
+                            retry_after=retry_after
+                        )
+                
                     async for line in response.aiter_lines():
                         if not line:
                             continue
-                        
+                    
                         # 处理 SSE 格式
                         if line.startswith("data: "):
                             data_str = line[6:]  # 去掉 "data: " 前缀
-                            
+                        
                             if data_str.strip() == "[DONE]":
                                 break
-                            
+                        
                             try:
                                 chunk = json.loads(data_str)
+                                if chunk.get("usage"):
+                                    usage = chunk["usage"]
                                 if "choices" in chunk and chunk["choices"]:
+                                    finish_reason = chunk["choices"][0].get("finish_reason") or finish_reason
                                     delta = chunk["choices"][0].get("delta", {})
                                     content = delta.get("content", "")
                                     if content:
+                                        if first_token_latency is None:
+                                            first_token_latency = time.perf_counter() - start
                                         collected_content.append(content)
+                                        if on_delta:
+                                            on_delta(content)
                             except json.JSONDecodeError:
                                 continue
             
-            full_content = "".join(collected_content)
-            print(f"✅ AI流式响应完成，内容长度: {len(full_content)}")
-            print(f"📝 完整响应内容: {full_content}")
-            
-            # 检查响应内容是否有效
-            if not full_content or len(full_content) < 10:  # 内容太短，可能无效
-                print(f"❌ AI返回内容过短: {len(full_content)} 字符")
-                raise Exception(f"AI返回内容无效: 内容过短 ({len(full_content)} 字符)")
+                full_content = "".join(collected_content)
+                permit.record_output(full_content)
+                print(f"✅ AI流式响应完成，内容长度: {len(full_content)}")
+                print(f"📝 完整响应内容: {full_content}")
+                llm_recorder.record(
+                    model, messages, max_tokens, full_content, finish_reason,
+                    first_token_latency, time.perf_counter() - start
+                )
             
-            return full_content
+                concurrency_controller.record_success(
+                    key,
+                    first_token_latency if first_token_latency is not None else time.perf_counter() - start,
+                    permit.limiter.in_flight
+                )
+                return full_content, finish_reason, usage, first_token_latency
                     
-        except httpx.TimeoutException:
-            print("❌ API调用超时")
-            raise Exception("API调用超时，请稍后重试")
-        except Exception as e:
-            print(f"❌ AI流式调用异常: {e}")
-            raise
+            except httpx.TimeoutException:
+                print("❌ API调用超时")
+                concurrency_controller.record_congestion(key, "请求超时")
+                raise AITimeoutError()
+            except Exception as e:
+                print(f"❌ AI流式调用异常: {e}")
+                raise
     
     async def call_ai(
         self,
@@ -137,7 +312,9 @@ class AIService:
         api_key: str,
         base_url: str,
         temperature: float = 0.7,
-        max_tokens: int = 2000
+        max_tokens: int = 2000,
+        on_delta: Optional[Callable[[str], None]] = None,
+        model_key: Optional[str] = None
     ) -> str:
         """
         调用 OpenAI 兼容格式的 API（使用流式模式避免超时）
@@ -149,6 +326,8 @@ class AIService:
             base_url: API基础URL
             temperature: 温度参数
             max_tokens: 最大令牌数
+            on_delta: 增量回调
+            model_key: 限流器、并发窗口使用的模型键，默认使用模型ID
             
         Returns:
             AI响应内容
@@ -160,7 +339,9 @@ class AIService:
             api_key=api_key,
             base_url=base_url,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            on_delta=on_delta,
+            model_key=model_key
         )
     
     async def call_ai_multimodal(
@@ -172,7 +353,9 @@ class AIService:
         base_url: str,
         system_prompt: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: int = 4000
+        max_tokens: int = 4000,
+        on_delta: Optional[Callable[[str], None]] = None,
+        model_key: Optional[str] = None
     ) -> str:
         """
         多模态AI调用接口 - 支持文本和图片输入（OpenAI兼容格式，流式模式）
@@ -186,29 +369,15 @@ class AIService:
             system_prompt: 系统提示词
             temperature: 温度参数
             max_tokens: 最大令牌数
+            on_delta: 增量回调
+            model_key: 限流器、并发窗口使用的模型键，默认使用模型ID
             
         Returns:
             AI响应内容
         """
-        # 构建多模态消息内容
+        # 构建多模态消息内容（图片经过缩放、去重、预算限制，处理结果有缓存）
         content = [{"type": "text", "text": text_content}]
-        
-        # 添加图片
-        for image_path in image_paths:
-            try:
-                image_data = self.encode_image_to_base64(image_path)
-                mime_type = self.get_image_mime_type(image_path)
-                
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mime_type};base64,{image_data}",
-                        "detail": "high"
-                    }
-                })
-            except Exception as e:
-                print(f"⚠️ 无法加载图片 {image_path}: {e}")
-                continue
+        content.extend(await asyncio.to_thread(image_pipeline.prepare, image_paths))
         
         # 构建消息
         messages = []
@@ -224,7 +393,9 @@ class AIService:
                 api_key=api_key,
                 base_url=base_url,
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                on_delta=on_delta,
+                model_key=model_key
             )
         except Exception as e:
             # 检查是否是"not a VLM"错误
@@ -246,7 +417,9 @@ class AIService:
                     api_key=api_key,
                     base_url=base_url,
                     temperature=temperature,
-                    max_tokens=max_tokens
+                    max_tokens=max_tokens,
+                    on_delta=on_delta,
+                    model_key=model_key
                 )
             else:
                 # 其他错误，重新抛出
@@ -2,14 +2,25 @@
 异步任务管理器
 用于管理后台异步任务，支持并发处理和状态轮询
 支持从系统设置加载并发配置
+任务状态同时写入任务存储（见 task_store），多个工作进程之间可以互相查询和取消任务
+通过 submit 提交的任务由任务管理器调度：达到并发上限时按优先级排队，有任务结束时自动启动下一个
 """
 import asyncio
+import json
+import os
+import socket
+import threading
+import time
 import uuid
-from typing import Dict, Any, Optional, List, Callable, TYPE_CHECKING
-from datetime import datetime
-from enum import Enum
+from collections import deque
+from typing import Dict, Any, Optional, List, Callable, Set, Deque, Awaitable, TYPE_CHECKING
+from datetime import datetime, timedelta
+from enum import Enum, IntEnum
 from dataclasses import dataclass, field
 
+from app.config import settings
+from app.services.task_store import ACTIVE_STATUSES, TaskStore, create_task_store
+
 if TYPE_CHECKING:
     from sqlalchemy.orm import Session
 
@@ -24,6 +35,17 @@ class AsyncTaskStatus(str, Enum):
     TIMEOUT = "timeout"
 
 
+class TaskPriority(IntEnum):
+    """任务优先级（数值越小越先启动）"""
+    INTERACTIVE = 0  # 单次智能体调用（测试点生成、用例设计、用例优化），用户正在等待结果
+    NORMAL = 1  # 一键生成、从检查点恢复
+    BULK = 2  # 项目批量生成的子任务
+
+
+# 任务执行函数：接收任务ID，返回要执行的协程
+TaskFactory = Callable[[str], Awaitable[Any]]
+
+
 @dataclass
 class AsyncTask:
     """异步任务数据类"""
@@ -36,6 +58,7 @@ class AsyncTask:
     result: Optional[Any] = None
     error: Optional[str] = None
     message: Optional[str] = None  # 进度消息
+    priority: TaskPriority = TaskPriority.NORMAL
     created_at: datetime = field(default_factory=datetime.utcnow)
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
@@ -55,6 +78,44 @@ class AsyncTask:
             "started_at": self.started_at.isoformat() if self.started_at else None,
             "completed_at": self.completed_at.isoformat() if self.completed_at else None,
         }
+    
+    def to_record(self) -> Dict[str, Any]:
+        """写入任务存储的字段（结果转换为可JSON序列化的值）"""
+        result = self.result
+        if result is not None:
+            result = json.loads(json.dumps(result, ensure_ascii=False, default=str))
+        return {
+            "task_id": self.task_id,
+            "task_type": self.task_type,
+            "status": self.status.value,
+            "progress": self.progress,
+            "total_batches": self.total_batches,
+            "completed_batches": self.completed_batches,
+            "result": result,
+            "error": self.error,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "completed_at": self.completed_at,
+        }
+    
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "AsyncTask":
+        """由任务存储中的记录构造（其他工作进程的任务）"""
+        return cls(
+            task_id=record["task_id"],
+            task_type=record["task_type"],
+            status=AsyncTaskStatus(record["status"]),
+            progress=record["progress"] or 0,
+            total_batches=record["total_batches"] or 0,
+            completed_batches=record["completed_batches"] or 0,
+            result=record["result"],
+            error=record["error"],
+            message=record["message"],
+            created_at=record["created_at"],
+            started_at=record["started_at"],
+            completed_at=record["completed_at"],
+        )
 
 
 class AsyncTaskManager:
@@ -65,6 +126,18 @@ class AsyncTaskManager:
     - task_timeout: 任务超时时间（秒）
     - retry_count: 失败重试次数
     - queue_size: 任务队列大小
+    - adaptive_concurrency: 是否启用按模型的自适应并发（AIMD）
+    
+    进程内的任务字典是任务存储的写穿缓存：
+    - 任务创建时立即写入存储（轮询请求可能落到其他工作进程）
+    - 状态和进度变化只标记为待写入，由后台线程按 task_store_flush_interval 批量写入，任务结束时立即唤醒
+    - 后台线程同时更新本进程执行中任务的心跳，并把心跳超时的任务（所在进程已退出）标记为失败
+    - 查询和取消本进程没有的任务时读写存储
+    
+    调度：
+    - submit 提交任务执行函数，有空闲槽位（max_concurrent_tasks）时立即启动，否则按优先级进入等待队列
+    - 任务结束（完成/失败/超时/取消）时释放槽位，从等待队列中启动下一个任务
+    - 每个优先级一个先进先出队列，入队、出队和计数都是 O(1)；取消的任务只从成员集合中移除，出队时跳过
     """
     
     # 默认配置值
@@ -76,38 +149,81 @@ class AsyncTaskManager:
     def __init__(self):
         self._tasks: Dict[str, AsyncTask] = {}
         self._running_tasks: Dict[str, asyncio.Task] = {}
-        self._pending_queue: List[str] = []  # 等待执行的任务队列
+        # 调度：各优先级的等待队列、队列中的任务、占用执行槽位的任务、待启动任务的执行函数
+        self._queues: Dict[TaskPriority, Deque[str]] = {priority: deque() for priority in TaskPriority}
+        self._queued: Set[str] = set()
+        self._slots: Set[str] = set()
+        self._factories: Dict[str, TaskFactory] = {}
+        self._executing: Set[str] = set()  # 执行函数尚未返回的任务
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
         
         # 并发配置（从系统设置加载）
         self._max_concurrent_tasks: int = self.DEFAULT_MAX_CONCURRENT_TASKS
         self._task_timeout: int = self.DEFAULT_TASK_TIMEOUT
         self._retry_count: int = self.DEFAULT_RETRY_COUNT
         self._queue_size: int = self.DEFAULT_QUEUE_SIZE
+        self._adaptive_concurrency: bool = True
+        self._adaptive_max_in_flight: int = 16
         
         # 配置是否已加载
         self._config_loaded: bool = False
+        self._config_version: int = -1  # 加载时的设置缓存版本
+        
+        # 任务存储（延迟创建）和批量写入
+        self._store: Optional[TaskStore] = None
+        self._worker_id: str = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._dirty: Set[str] = set()
+        self._store_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_maintenance: float = 0.0
     
     def load_config_from_db(self, db: "Session") -> None:
         """从数据库加载并发配置
         
+        通过进程内设置缓存读取；设置未修改且缓存未过期时直接返回，不查询数据库
+        
         Args:
             db: 数据库会话
         """
         try:
-            from app.services.settings_service import SettingsService
+            from app.services.settings_service import SettingsService, settings_cache
             
-            config = SettingsService.get_concurrency_config(db)
+            version = settings_cache.version
+            if self._config_loaded and version == self._config_version:
+                return
+            config = SettingsService.get_concurrency_config_cached(db)
             self._max_concurrent_tasks = config.max_concurrent_tasks
             self._task_timeout = config.task_timeout
             self._retry_count = config.retry_count
             self._queue_size = config.queue_size
+            self._adaptive_concurrency = config.adaptive_concurrency
+            self._adaptive_max_in_flight = config.adaptive_max_in_flight
             self._config_loaded = True
+            self._config_version = version
+            
+            # 自适应并发窗口以 max_concurrent_tasks 为初始值
+            from app.services.concurrency_controller import concurrency_controller
+            concurrency_controller.configure(
+                enabled=config.adaptive_concurrency,
+                initial_window=config.max_concurrent_tasks,
+                max_window=config.adaptive_max_in_flight
+            )
+            from app.services.circuit_breaker import circuit_breakers
+            circuit_breakers.configure(
+                failure_threshold=config.circuit_failure_threshold,
+                open_seconds=config.circuit_open_seconds
+            )
             
             print(f"[AsyncTaskManager] 已加载并发配置: "
                   f"max_concurrent_tasks={self._max_concurrent_tasks}, "
                   f"task_timeout={self._task_timeout}s, "
                   f"retry_count={self._retry_count}, "
                   f"queue_size={self._queue_size}")
+            # 并发上限调高后立即启动等待中的任务
+            self._dispatch()
         except Exception as e:
             print(f"[AsyncTaskManager] 加载并发配置失败，使用默认值: {e}")
             self._config_loaded = False
@@ -120,6 +236,7 @@ class AsyncTaskManager:
         Args:
             db: 数据库会话
         """
+        self._config_loaded = False
         self.load_config_from_db(db)
     
     @property
@@ -142,19 +259,45 @@ class AsyncTaskManager:
         """获取任务队列大小"""
         return self._queue_size
     
+    @property
+    def llm_call_concurrency(self) -> int:
+        """单个任务内同时发起的AI调用数
+        
+        启用自适应并发时由各模型的AIMD窗口（在限流器中）控制实际在途数，
+        任务内只按窗口上限设置信号量，避免固定值限制住窗口增长
+        """
+        if self._adaptive_concurrency:
+            return max(self._max_concurrent_tasks, self._adaptive_max_in_flight)
+        return self._max_concurrent_tasks
+    
     @property
     def config_loaded(self) -> bool:
         """配置是否已从数据库加载"""
         return self._config_loaded
     
+    @property
+    def store(self) -> TaskStore:
+        """任务状态存储"""
+        if self._store is None:
+            self._store = create_task_store()
+        return self._store
+    
+    def set_store(self, store: TaskStore) -> None:
+        """替换任务状态存储（需在创建任务前调用）"""
+        self._store = store
+    
+    @property
+    def worker_id(self) -> str:
+        """本进程在任务存储中的标识"""
+        return self._worker_id
+    
     def get_running_task_count(self) -> int:
-        """获取当前正在运行的任务数"""
-        return sum(1 for task in self._tasks.values() 
-                   if task.status == AsyncTaskStatus.RUNNING)
+        """获取当前占用执行槽位的任务数"""
+        return len(self._slots)
     
     def get_pending_task_count(self) -> int:
         """获取等待执行的任务数"""
-        return len(self._pending_queue)
+        return len(self._queued)
     
     def can_start_new_task(self) -> bool:
         """检查是否可以启动新任务
@@ -172,16 +315,29 @@ class AsyncTaskManager:
         Returns:
             队列是否已满
         """
-        return len(self._pending_queue) >= self._queue_size
+        return len(self._queued) >= self._queue_size
+    
+    @staticmethod
+    def new_task_id() -> str:
+        """生成任务ID（需要在提交任务前引用任务ID时预先分配）"""
+        return str(uuid.uuid4())
     
-    def create_task(self, task_type: str, total_batches: int = 1) -> str:
-        """创建新任务，返回任务ID
+    def create_task(
+        self,
+        task_type: str,
+        total_batches: int = 1,
+        priority: TaskPriority = TaskPriority.NORMAL,
+        task_id: Optional[str] = None
+    ) -> str:
+        """创建新任务（状态为等待中），返回任务ID
         
-        如果达到并发限制，任务将被加入等待队列
+        任务由调用者执行时需调用 start_task；由任务管理器调度执行时使用 submit
         
         Args:
             task_type: 任务类型
             total_batches: 总批次数
+            priority: 优先级
+            task_id: 预先分配的任务ID（见 new_task_id），为空时自动生成
             
         Returns:
             任务ID
@@ -193,37 +349,105 @@ class AsyncTaskManager:
         if self.is_queue_full():
             raise ValueError(f"任务队列已满（最大{self._queue_size}个），请稍后重试")
         
-        task_id = str(uuid.uuid4())
+        task_id = task_id or self.new_task_id()
         task = AsyncTask(
             task_id=task_id,
             task_type=task_type,
-            total_batches=total_batches
+            total_batches=total_batches,
+            priority=priority
         )
         self._tasks[task_id] = task
+        self._mark_dirty(task_id, flush=True)
+        return task_id
+    
+    def submit(
+        self,
+        task_type: str,
+        factory: TaskFactory,
+        total_batches: int = 1,
+        priority: TaskPriority = TaskPriority.NORMAL,
+        task_id: Optional[str] = None
+    ) -> str:
+        """创建任务并交给任务管理器调度执行，返回任务ID
+        
+        有空闲槽位时立即启动，否则进入对应优先级的等待队列，有任务结束时自动启动。
+        执行函数返回后任务仍未结束时，以返回值完成任务；抛出异常时任务失败。
         
-        # 如果达到并发限制，加入等待队列
-        if not self.can_start_new_task():
-            self._pending_queue.append(task_id)
+        Args:
+            task_type: 任务类型
+            factory: 执行函数，接收任务ID，返回要执行的协程
+            total_batches: 总批次数
+            priority: 优先级
+            task_id: 预先分配的任务ID，为空时自动生成
+            
+        Returns:
+            任务ID
+            
+        Raises:
+            ValueError: 当队列已满时抛出
+        """
+        self._loop = asyncio.get_running_loop()
+        task_id = self.create_task(task_type, total_batches, priority, task_id)
+        self._factories[task_id] = factory
+        self._enqueue(task_id)
+        self._dispatch()
+        if task_id in self._queued:
             print(f"[AsyncTaskManager] 任务 {task_id} 已加入等待队列 "
-                  f"(当前运行: {self.get_running_task_count()}/{self._max_concurrent_tasks})")
-        
+                  f"(优先级: {priority.name}, 当前运行: {len(self._slots)}/{self._max_concurrent_tasks}, "
+                  f"等待: {len(self._queued)})")
         return task_id
     
-    def get_task(self, task_id: str) -> Optional[AsyncTask]:
-        """获取任务信息"""
+    async def wait_task(self, task_id: str) -> Optional[AsyncTask]:
+        """等待通过 submit 提交的任务执行结束（执行函数返回，或在等待队列中被取消）"""
+        if task_id in self._queued or task_id in self._executing:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(task_id, []).append(future)
+            await future
         return self._tasks.get(task_id)
     
+    def get_task(self, task_id: str) -> Optional[AsyncTask]:
+        """获取任务信息（本进程没有时从任务存储读取，返回的是快照）"""
+        task = self._tasks.get(task_id)
+        if task is None:
+            record = self._load_record(task_id)
+            if record:
+                task = AsyncTask.from_record(record)
+        return task
+    
     def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
         """获取任务状态"""
         task = self._tasks.get(task_id)
         if task:
             status_dict = task.to_dict()
             # 添加队列位置信息
-            if task_id in self._pending_queue:
-                status_dict["queue_position"] = self._pending_queue.index(task_id) + 1
+            if task_id in self._queued:
+                status_dict["queue_position"] = self._queue_position(task_id)
             return status_dict
+        record = self._load_record(task_id)
+        if record:
+            return AsyncTask.from_record(record).to_dict()
         return None
     
+    def is_task_alive(self, task_id: str) -> bool:
+        """任务是否仍在某个工作进程中等待或执行（心跳未超时）"""
+        task = self._tasks.get(task_id)
+        if task is not None:
+            return task.status in (AsyncTaskStatus.PENDING, AsyncTaskStatus.RUNNING)
+        record = self._load_record(task_id)
+        if not record or record["status"] not in ACTIVE_STATUSES or record["heartbeat_at"] is None:
+            return False
+        age = (datetime.utcnow() - record["heartbeat_at"]).total_seconds()
+        return age < settings.task_store_stale_timeout
+    
+    def _load_record(self, task_id: str) -> Optional[Dict[str, Any]]:
+        if not self.store.durable:
+            return None
+        try:
+            return self.store.load(task_id)
+        except Exception as e:
+            print(f"[AsyncTaskManager] 从任务存储读取任务 {task_id} 失败: {e}")
+            return None
+    
     def update_task_progress(self, task_id: str, completed_batches: int):
         """更新任务进度（基于批次数）"""
         task = self._tasks.get(task_id)
@@ -233,6 +457,7 @@ class AsyncTaskManager:
                 # 进度范围：5% ~ 95%（留5%给启动，5%给保存）
                 raw_progress = (completed_batches / task.total_batches) * 90
                 task.progress = int(5 + raw_progress)
+            self._mark_dirty(task_id)
     
     def update_progress(self, task_id: str, progress: int, message: str = None):
         """直接设置任务进度百分比
@@ -247,12 +472,17 @@ class AsyncTaskManager:
             task.progress = min(max(progress, 0), 100)
             if message:
                 task.message = message
+            self._mark_dirty(task_id)
     
-    def start_task(self, task_id: str) -> bool:
-        """标记任务开始
+    def start_task(self, task_id: str, hold_slot: bool = True) -> bool:
+        """标记由调用者执行的任务开始
+        
+        达到并发限制时任务进入等待队列并返回False，获得槽位后标记为运行中，调用者可通过 get_task 查询。
+        需要排队执行的任务应使用 submit 提交。
         
         Args:
             task_id: 任务ID
+            hold_slot: 是否占用执行槽位（只协调其他任务的汇总任务不占用，如项目批量生成）
             
         Returns:
             是否成功启动（如果达到并发限制则返回False）
@@ -261,20 +491,20 @@ class AsyncTaskManager:
         if not task:
             return False
         
-        # 检查是否可以启动
-        if not self.can_start_new_task() and task_id not in self._pending_queue:
-            # 如果不能启动且不在队列中，加入队列
-            self._pending_queue.append(task_id)
-            return False
-        
-        # 从等待队列中移除
-        if task_id in self._pending_queue:
-            self._pending_queue.remove(task_id)
-        
+        if hold_slot and task_id not in self._slots:
+            if not self.can_start_new_task():
+                self._enqueue(task_id)
+                return False
+            self._queued.discard(task_id)
+            self._slots.add(task_id)
+        self._mark_started(task)
+        return True
+    
+    def _mark_started(self, task: AsyncTask) -> None:
         task.status = AsyncTaskStatus.RUNNING
         task.started_at = datetime.utcnow()
         task.progress = 5  # 设置初始进度，表示任务已开始
-        return True
+        self._mark_dirty(task.task_id)
     
     def complete_task(self, task_id: str, result: Any):
         """标记任务完成"""
@@ -284,13 +514,14 @@ class AsyncTaskManager:
             task.progress = 100
             task.result = result
             task.completed_at = datetime.utcnow()
+            self._mark_dirty(task_id, wake=True)
         
         # 清理运行中的任务
         if task_id in self._running_tasks:
             del self._running_tasks[task_id]
         
-        # 尝试启动等待队列中的下一个任务
-        self._process_pending_queue()
+        # 释放槽位，启动等待队列中的下一个任务
+        self._release(task_id)
     
     def fail_task(self, task_id: str, error: str):
         """标记任务失败"""
@@ -299,13 +530,14 @@ class AsyncTaskManager:
             task.status = AsyncTaskStatus.FAILED
             task.error = error
             task.completed_at = datetime.utcnow()
+            self._mark_dirty(task_id, wake=True)
         
         # 清理运行中的任务
         if task_id in self._running_tasks:
             del self._running_tasks[task_id]
         
-        # 尝试启动等待队列中的下一个任务
-        self._process_pending_queue()
+        # 释放槽位，启动等待队列中的下一个任务
+        self._release(task_id)
     
     def timeout_task(self, task_id: str):
         """标记任务超时
@@ -320,37 +552,93 @@ class AsyncTaskManager:
             task.status = AsyncTaskStatus.TIMEOUT
             task.error = f"任务执行超时（超过{self._task_timeout}秒）"
             task.completed_at = datetime.utcnow()
+            self._mark_dirty(task_id, wake=True)
         
         # 取消正在运行的asyncio任务
         if task_id in self._running_tasks:
             self._running_tasks[task_id].cancel()
             del self._running_tasks[task_id]
         
-        # 尝试启动等待队列中的下一个任务
-        self._process_pending_queue()
+        # 释放槽位，启动等待队列中的下一个任务
+        self._release(task_id)
     
     def cancel_task(self, task_id: str):
-        """取消任务"""
+        """取消任务
+        
+        其他工作进程中的任务只在任务存储中标记为已取消，由执行任务的进程在下次写入时取消
+        """
         task = self._tasks.get(task_id)
+        if task is None and self.store.durable:
+            try:
+                if self.store.request_cancel(task_id):
+                    print(f"[AsyncTaskManager] 已请求取消其他进程中的任务 {task_id}")
+            except Exception as e:
+                print(f"[AsyncTaskManager] 取消任务 {task_id} 失败: {e}")
+            return
         if task:
             task.status = AsyncTaskStatus.CANCELLED
             task.completed_at = datetime.utcnow()
+            self._mark_dirty(task_id, wake=True)
         
-        # 从等待队列中移除
-        if task_id in self._pending_queue:
-            self._pending_queue.remove(task_id)
+        # 从等待队列中移除（尚未启动的任务不再执行）
+        if task_id in self._queued:
+            self._queued.discard(task_id)
+            self._factories.pop(task_id, None)
+            self._notify_waiters(task_id)
         
         # 取消正在运行的asyncio任务
         if task_id in self._running_tasks:
             self._running_tasks[task_id].cancel()
             del self._running_tasks[task_id]
         
-        # 尝试启动等待队列中的下一个任务
-        self._process_pending_queue()
+        # 释放槽位，启动等待队列中的下一个任务
+        self._release(task_id)
+    
+    def reopen_task(self, task_id: str) -> bool:
+        """把已结束的任务重新置为运行中，由本进程继续执行（如批量任务重试失败或已取消的子任务）
+        
+        其他进程中的任务从任务存储加载到本进程；多个进程同时重新打开同一个任务时只有一个成功
+        
+        Returns:
+            是否成功，任务不存在、未结束或已被其他进程重新打开时返回False
+        """
+        task = self._tasks.get(task_id)
+        if task is not None and task.status in (AsyncTaskStatus.PENDING, AsyncTaskStatus.RUNNING):
+            return False
+        if self.store.durable:
+            # 先写入本进程待写入的结束状态，再在存储中按状态条件重新打开
+            self.flush()
+            try:
+                if not self.store.reopen(self._worker_id, task_id):
+                    return False
+            except Exception as e:
+                print(f"[AsyncTaskManager] 重新打开任务 {task_id} 失败: {e}")
+                return False
+            if task is None:
+                record = self._load_record(task_id)
+                if record is None:
+                    return False
+                task = AsyncTask.from_record(record)
+                self._tasks[task_id] = task
+        elif task is None:
+            return False
+        task.status = AsyncTaskStatus.RUNNING
+        task.error = None
+        task.completed_at = None
+        self._mark_dirty(task_id)
+        return True
+    
+    def set_result(self, task_id: str, result: Any) -> None:
+        """更新执行中任务的结果（如批量任务的子任务状态，其他工作进程可从任务存储查询）"""
+        task = self._tasks.get(task_id)
+        if task:
+            task.result = result
+            self._mark_dirty(task_id)
     
     def register_running_task(self, task_id: str, asyncio_task: asyncio.Task):
         """注册正在运行的asyncio任务"""
         self._running_tasks[task_id] = asyncio_task
+        self._loop = asyncio_task.get_loop()
     
     async def execute_with_timeout(self, task_id: str, coro) -> Any:
         """执行任务并应用超时限制
@@ -372,23 +660,90 @@ class AsyncTaskManager:
             self.timeout_task(task_id)
             raise
     
-    def _process_pending_queue(self):
-        """处理等待队列中的任务
-        
-        当有任务完成时调用，尝试启动等待队列中的下一个任务
-        """
-        while self._pending_queue and self.can_start_new_task():
-            next_task_id = self._pending_queue[0]
-            task = self._tasks.get(next_task_id)
-            if task and task.status == AsyncTaskStatus.PENDING:
-                # 任务仍在等待，可以启动
-                self._pending_queue.pop(0)
-                print(f"[AsyncTaskManager] 从队列启动任务 {next_task_id}")
-                # 注意：实际启动需要外部调用者处理
-                break
-            else:
-                # 任务已被取消或状态改变，从队列移除
-                self._pending_queue.pop(0)
+    def _enqueue(self, task_id: str) -> None:
+        """加入任务优先级对应的等待队列"""
+        if task_id in self._queued:
+            return
+        self._queued.add(task_id)
+        self._queues[self._tasks[task_id].priority].append(task_id)
+    
+    def _pop_next(self) -> Optional[str]:
+        """取出优先级最高的等待任务（跳过已取消的任务）"""
+        for queue in self._queues.values():
+            while queue:
+                task_id = queue.popleft()
+                if task_id in self._queued:
+                    self._queued.discard(task_id)
+                    return task_id
+        return None
+    
+    def _queue_position(self, task_id: str) -> int:
+        """任务在等待队列中的位置（从1开始，优先级更高的任务排在前面）"""
+        position = 0
+        for queue in self._queues.values():
+            for queued_id in queue:
+                if queued_id in self._queued:
+                    position += 1
+                    if queued_id == task_id:
+                        return position
+        return position
+    
+    def _release(self, task_id: str) -> None:
+        """任务结束：释放执行槽位并启动等待中的任务"""
+        if task_id in self._slots:
+            self._slots.discard(task_id)
+            self._dispatch()
+    
+    def _dispatch(self) -> None:
+        """有空闲槽位时按优先级启动等待中的任务"""
+        while self._queued and self.can_start_new_task():
+            task_id = self._pop_next()
+            task = self._tasks.get(task_id) if task_id else None
+            if task is None or task.status != AsyncTaskStatus.PENDING:
+                self._factories.pop(task_id, None)
+                continue
+            self._slots.add(task_id)
+            factory = self._factories.pop(task_id, None)
+            if factory is None:
+                # 由调用者执行的任务（start_task 排队），获得槽位后标记为运行中
+                self._mark_started(task)
+                continue
+            if self._loop is None or self._loop.is_closed():
+                self._slots.discard(task_id)
+                self.fail_task(task_id, "任务调度失败：事件循环不可用")
+                continue
+            self._mark_started(task)
+            self._executing.add(task_id)
+            self._running_tasks[task_id] = self._loop.create_task(self._execute(task_id, factory))
+    
+    async def _execute(self, task_id: str, factory: TaskFactory) -> None:
+        """执行调度的任务，执行函数没有结束任务时按返回值/异常结束任务"""
+        try:
+            result = await factory(task_id)
+            if self._is_active(task_id):
+                self.complete_task(task_id, result)
+        except asyncio.CancelledError:
+            if self._is_active(task_id):
+                self.fail_task(task_id, "任务已中断")
+            raise
+        except Exception as e:
+            print(f"[AsyncTaskManager] 任务 {task_id} 执行失败: {e}")
+            if self._is_active(task_id):
+                self.fail_task(task_id, str(e))
+        finally:
+            self._executing.discard(task_id)
+            self._running_tasks.pop(task_id, None)
+            self._release(task_id)
+            self._notify_waiters(task_id)
+    
+    def _is_active(self, task_id: str) -> bool:
+        task = self._tasks.get(task_id)
+        return task is not None and task.status in (AsyncTaskStatus.PENDING, AsyncTaskStatus.RUNNING)
+    
+    def _notify_waiters(self, task_id: str) -> None:
+        for future in self._waiters.pop(task_id, []):
+            if not future.done():
+                future.set_result(None)
     
     def get_next_pending_task(self) -> Optional[str]:
         """获取下一个等待执行的任务ID
@@ -396,15 +751,12 @@ class AsyncTaskManager:
         Returns:
             下一个等待执行的任务ID，如果队列为空或达到并发限制则返回None
         """
-        if not self._pending_queue or not self.can_start_new_task():
+        if not self._queued or not self.can_start_new_task():
             return None
-        
-        # 查找第一个仍在等待状态的任务
-        for task_id in self._pending_queue:
-            task = self._tasks.get(task_id)
-            if task and task.status == AsyncTaskStatus.PENDING:
-                return task_id
-        
+        for queue in self._queues.values():
+            for task_id in queue:
+                if task_id in self._queued:
+                    return task_id
         return None
     
     def cleanup_old_tasks(self, max_age_hours: int = 24):
@@ -421,8 +773,132 @@ class AsyncTaskManager:
             del self._tasks[task_id]
             if task_id in self._running_tasks:
                 del self._running_tasks[task_id]
-            if task_id in self._pending_queue:
-                self._pending_queue.remove(task_id)
+            self._queued.discard(task_id)
+            self._slots.discard(task_id)
+            self._factories.pop(task_id, None)
+    
+    def _mark_dirty(self, task_id: str, flush: bool = False, wake: bool = False) -> None:
+        """标记任务状态待写入存储
+        
+        Args:
+            flush: 立即在当前线程写入
+            wake: 立即唤醒后台写入线程
+        """
+        if not self.store.durable:
+            return
+        with self._store_lock:
+            self._dirty.add(task_id)
+        self._ensure_flusher()
+        if flush:
+            self.flush()
+        elif wake:
+            self._wakeup.set()
+    
+    def _ensure_flusher(self) -> None:
+        if self._loop is None:
+            try:
+                self._loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+        with self._store_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name="task-store", daemon=True)
+                self._flusher.start()
+    
+    def start_store(self) -> None:
+        """启动任务存储的后台线程（服务启动时调用，没有任务的进程也负责处理心跳超时的任务）"""
+        if self.store.durable:
+            self._ensure_flusher()
+    
+    def _run_flusher(self) -> None:
+        while True:
+            self._wakeup.wait(settings.task_store_flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            now = time.monotonic()
+            if now - self._last_maintenance >= settings.task_store_heartbeat_interval:
+                self._last_maintenance = now
+                self._maintain_store()
+    
+    def flush(self) -> int:
+        """把待写入的任务状态写入存储，返回写入的任务数"""
+        if not self.store.durable:
+            return 0
+        with self._flush_lock:
+            with self._store_lock:
+                task_ids = list(self._dirty)
+                self._dirty.clear()
+            rows = [self._tasks[task_id].to_record() for task_id in task_ids if task_id in self._tasks]
+            if not rows:
+                return 0
+            try:
+                cancelled = self.store.save(self._worker_id, rows)
+            except Exception as e:
+                print(f"[AsyncTaskManager] 写入 {len(rows)} 个任务状态失败: {e}")
+                with self._store_lock:
+                    self._dirty.update(row["task_id"] for row in rows)
+                return 0
+        for task_id in cancelled:
+            self._apply_remote_cancel(task_id)
+        return len(rows)
+    
+    def _apply_remote_cancel(self, task_id: str) -> None:
+        """在本进程中取消已被其他进程取消的任务（在事件循环线程中执行）"""
+        task = self._tasks.get(task_id)
+        if task is None or task.status not in (AsyncTaskStatus.PENDING, AsyncTaskStatus.RUNNING):
+            return
+        print(f"[AsyncTaskManager] 任务 {task_id} 已被其他进程取消")
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self._cancel_from_remote, task_id, task.task_type)
+        else:
+            self._cancel_from_remote(task_id, task.task_type)
+    
+    def _cancel_from_remote(self, task_id: str, task_type: str) -> None:
+        self.cancel_task(task_id)
+        if task_type == "project_generation":
+            # 批量任务同时取消本进程中执行的子任务
+            from app.services.project_generation import project_generation
+            project_generation.cancel(task_id)
+    
+    def _maintain_store(self) -> None:
+        """更新本进程执行中任务的心跳，处理心跳超时的任务并清理已结束的旧任务"""
+        active = [
+            task.task_id for task in list(self._tasks.values())
+            if task.status in (AsyncTaskStatus.PENDING, AsyncTaskStatus.RUNNING)
+        ]
+        now = datetime.utcnow()
+        try:
+            self.store.heartbeat(self._worker_id, active)
+            stale = self.store.expire_stale(now - timedelta(seconds=settings.task_store_stale_timeout))
+            self.store.purge(now - timedelta(hours=settings.task_store_retention_hours))
+        except Exception as e:
+            print(f"[AsyncTaskManager] 任务存储维护失败: {e}")
+            return
+        if stale:
+            print(f"[AsyncTaskManager] {len(stale)} 个任务所在进程已退出，标记为失败: {', '.join(stale)}")
+            # 对应的一键生成检查点标记为已中断，可从检查点恢复
+            from app.database import SessionLocal
+            from app.services.pipeline_checkpoint import mark_interrupted_runs
+            db = SessionLocal()
+            try:
+                mark_interrupted_runs(db, stale)
+            except Exception as e:
+                print(f"[AsyncTaskManager] 标记中断的生成任务失败: {e}")
+            finally:
+                db.close()
+    
+    def close(self) -> None:
+        """服务关闭时调用：写入待写入的任务状态，本进程未结束的任务标记为失败"""
+        if not self.store.durable:
+            return
+        self.flush()
+        try:
+            released = self.store.release(self._worker_id, "服务已关闭，任务已中断")
+            if released:
+                print(f"[AsyncTaskManager] 服务关闭，{released} 个未结束的任务标记为失败")
+        except Exception as e:
+            print(f"[AsyncTaskManager] 更新未结束任务状态失败: {e}")
     
     def get_config_info(self) -> Dict[str, Any]:
         """获取当前配置信息
@@ -437,7 +913,13 @@ class AsyncTaskManager:
             "queue_size": self._queue_size,
             "config_loaded": self._config_loaded,
             "running_tasks": self.get_running_task_count(),
-            "pending_tasks": self.get_pending_task_count()
+            "pending_tasks": self.get_pending_task_count(),
+            "pending_by_priority": {
+                priority.name.lower(): sum(1 for task_id in queue if task_id in self._queued)
+                for priority, queue in self._queues.items()
+            },
+            "task_store": type(self.store).__name__,
+            "worker_id": self._worker_id
         }
 
 
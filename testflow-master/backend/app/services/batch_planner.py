@@ -0,0 +1,159 @@
+"""
+Token预算批次规划
+按每个条目的预估token数和共享上下文大小，把测试点/测试用例装入尽量少的批次：
+- 输出预算：min(AIModel.max_tokens, Agent.max_tokens)，按每个条目的预估输出token数装箱
+- 输入预算：单次调用的输入token上限，扣除共享上下文（需求文档、提示词模板）后按条目装箱
+- 响应被截断（finish_reason=length）后，自动收紧对应智能体的批次上限
+"""
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# 中日韩字符（大多数分词器中约1个token/字）
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: Any) -> int:
+    """粗略估算文本的token数
+
+    中文按 1 token/字，其余字符按 4 字符/token 估算；非字符串按JSON序列化后估算
+    """
+    if text is None:
+        return 0
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def resolve_output_budget(model_max_tokens: Optional[int], agent_max_tokens: Optional[int]) -> int:
+    """单次调用的输出token预算：取模型和智能体配置中较小的非空值"""
+    candidates = [v for v in (model_max_tokens, agent_max_tokens) if v and v > 0]
+    return min(candidates) if candidates else 4000
+
+
+class BatchPlanner:
+    """批次规划器
+
+    Example:
+        >>> planner = BatchPlanner(output_budget=4000, output_tokens_per_item=800, max_items=10)
+        >>> [len(b) for b in planner.plan(list(range(12)))]
+        [4, 4, 4]
+    """
+
+    SAFETY_RATIO = 0.85  # 预算安全系数，为估算误差和JSON结构留余量
+
+    def __init__(
+        self,
+        output_budget: int,
+        output_tokens_per_item: int,
+        max_items: int,
+        input_budget: Optional[int] = None,
+        shared_tokens: int = 0,
+        item_cap: Optional[int] = None
+    ):
+        """
+        Args:
+            output_budget: 单次调用的输出token预算
+            output_tokens_per_item: 每个条目的预估输出token数
+            max_items: 每批最多条目数
+            input_budget: 单次调用的输入token预算（None表示不限制）
+            shared_tokens: 每次调用都要携带的共享上下文token数
+            item_cap: 截断学习得到的批次上限（None表示不限制）
+        """
+        self.output_budget = output_budget
+        self.output_tokens_per_item = max(1, output_tokens_per_item)
+        self.max_items = max(1, max_items)
+        self.input_budget = input_budget
+        self.shared_tokens = shared_tokens
+        self.item_cap = item_cap
+
+    @property
+    def items_per_batch_limit(self) -> int:
+        """按输出预算和上限计算的每批最大条目数"""
+        by_output = int(self.output_budget * self.SAFETY_RATIO) // self.output_tokens_per_item
+        limit = min(self.max_items, max(1, by_output))
+        if self.item_cap:
+            limit = min(limit, self.item_cap)
+        return max(1, limit)
+
+    def plan(self, items: Sequence[T], cost: Callable[[T], int] = estimate_tokens) -> List[List[T]]:
+        """按顺序装箱（保持条目原有顺序，每批至少1个条目）
+
+        Args:
+            items: 待分批的条目
+            cost: 单个条目的输入token估算函数
+
+        Returns:
+            批次列表
+        """
+        limit = self.items_per_batch_limit
+        input_room = None
+        if self.input_budget:
+            input_room = max(0, int(self.input_budget * self.SAFETY_RATIO) - self.shared_tokens)
+
+        batches: List[List[T]] = []
+        current: List[T] = []
+        used = 0
+        for item in items:
+            item_tokens = cost(item)
+            full = len(current) >= limit
+            if input_room is not None and current and used + item_tokens > input_room:
+                full = True
+            if full:
+                batches.append(current)
+                current, used = [], 0
+            current.append(item)
+            used += item_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+
+class TruncationTracker:
+    """记录各智能体因截断而收紧的批次上限
+
+    截断时把上限降为失败批次大小的一半；之后每连续成功若干批次放宽1个，
+    避免一次偶发截断让后续任务永久使用小批次。
+    """
+
+    RECOVER_AFTER = 5  # 连续成功N个批次后放宽上限
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caps: Dict[str, int] = {}
+        self._successes: Dict[str, int] = {}
+
+    def get_cap(self, key: str) -> Optional[int]:
+        """获取批次上限（None表示未发生过截断）"""
+        return self._caps.get(key)
+
+    def record_truncation(self, key: str, batch_size: int) -> int:
+        """记录一次截断，返回新的批次上限"""
+        with self._lock:
+            cap = max(1, batch_size // 2)
+            self._caps[key] = min(cap, self._caps.get(key, cap))
+            self._successes[key] = 0
+            print(f"✂️ [BatchPlanner] {key} 响应被截断，批次上限调整为 {self._caps[key]}")
+            return self._caps[key]
+
+    def record_success(self, key: str, batch_size: int) -> None:
+        """记录一次成功，连续成功后逐步放宽上限"""
+        with self._lock:
+            cap = self._caps.get(key)
+            if cap is None or batch_size < cap:
+                return
+            self._successes[key] = self._successes.get(key, 0) + 1
+            if self._successes[key] >= self.RECOVER_AFTER:
+                self._successes[key] = 0
+                self._caps[key] = cap + 1
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self._caps)
+
+
+# 全局截断记录
+truncation_tracker = TruncationTracker()
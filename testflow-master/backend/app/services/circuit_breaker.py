@@ -0,0 +1,138 @@
+"""
+模型熔断器
+按模型键（rate_limiter.model_key，区分同一 model_id 的不同供应商配置）记录端点故障（网络错误、超时、5xx），连续失败达到阈值后熔断：
+熔断期间调用直接跳过该模型、切换到智能体配置的备用模型；
+熔断时间结束后进入半开状态，只放行一个探测调用，其结果决定恢复还是继续熔断；
+探测期间的其他调用仍按熔断处理（探测调用超过熔断时间仍未返回结果时允许重新探测）。
+"""
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from app.core.ai_client import AIRequestError, AITimeoutError
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """是否为端点故障（计入熔断、可切换备用模型）
+
+    请求参数错误（4xx）、响应截断、JSON解析失败等与端点健康无关，不计入
+    """
+    if isinstance(error, AIRequestError):
+        return error.status_code >= 500
+    return isinstance(error, (AITimeoutError, httpx.TransportError))
+
+
+class CircuitBreaker:
+    """单个模型的熔断器"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, key: str, failure_threshold: int = 5, open_seconds: float = 60.0):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self.open_count = 0
+        self.probing = False  # 半开状态下是否已有探测调用在途
+        self.probe_started_at = 0.0
+
+    def allow(self) -> bool:
+        """是否允许调用该模型（半开状态下只放行一个探测调用）"""
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.open_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self.probing = False
+            print(f"🔌 [CircuitBreaker] 模型 {self.key} 熔断结束，进入半开状态")
+        if self.state == self.HALF_OPEN:
+            # 探测调用超过熔断时间仍未返回结果（如请求挂起）时，允许重新探测
+            if self.probing and now - self.probe_started_at < self.open_seconds:
+                return False
+            self.probing = True
+            self.probe_started_at = now
+        return True
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            print(f"✅ [CircuitBreaker] 模型 {self.key} 已恢复")
+        self.state = self.CLOSED
+        self.probing = False
+        self.consecutive_failures = 0
+
+    def release_probe(self) -> None:
+        """探测调用因与端点健康无关的原因结束（如请求参数错误、被取消），允许下一个调用重新探测"""
+        self.probing = False
+
+    def record_failure(self, error: str) -> None:
+        self.probing = False
+        self.consecutive_failures += 1
+        self.last_error = error[:200]
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.open_count += 1
+                print(f"⛔ [CircuitBreaker] 模型 {self.key} 连续失败 {self.consecutive_failures} 次，熔断 {self.open_seconds:.0f} 秒")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        remaining = 0.0
+        if self.state == self.OPEN:
+            remaining = max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+        return {
+            "model": self.key,
+            "state": self.state,
+            "probing": self.probing,
+            "consecutive_failures": self.consecutive_failures,
+            "open_remaining_seconds": round(remaining, 1),
+            "open_count": self.open_count,
+            "last_error": self.last_error,
+        }
+
+
+class CircuitBreakerRegistry:
+    """按模型管理熔断器（阈值来自系统设置中的并发配置）"""
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def configure(self, failure_threshold: int, open_seconds: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        for breaker in self._breakers.values():
+            breaker.failure_threshold = failure_threshold
+            breaker.open_seconds = open_seconds
+
+    def get(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(model, self.failure_threshold, self.open_seconds)
+            self._breakers[model] = breaker
+        return breaker
+
+    def allow(self, model: str) -> bool:
+        return self.get(model).allow()
+
+    def record_success(self, model: str) -> None:
+        self.get(model).record_success()
+
+    def record_failure(self, model: str, error: str) -> None:
+        self.get(model).record_failure(error)
+
+    def release_probe(self, model: str) -> None:
+        self.get(model).release_probe()
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        return [breaker.get_stats() for breaker in self._breakers.values()]
+
+
+# 全局熔断器实例
+circuit_breakers = CircuitBreakerRegistry()
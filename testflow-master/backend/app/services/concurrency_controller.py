@@ -0,0 +1,165 @@
+"""
+自适应并发控制（AIMD）
+按模型键（rate_limiter.model_key，区分同一 model_id 的不同供应商配置）维护一个在途请求窗口，由限流器在放行请求时读取：
+- 加性增：窗口被占满且首token延迟(p95)、错误率正常时，每次成功调用窗口 +1/窗口（约每轮 +1）
+- 乘性减：遇到 429 / 5xx / 超时，窗口减半（冷却期内只减一次，避免一次突发把窗口打到底）
+
+延迟信号使用首token延迟（TTFT），不受输出长度影响，更能反映供应商侧的排队情况。
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from app.utils.stats import percentile
+
+
+class ModelConcurrencyWindow:
+    """单个模型的并发窗口"""
+
+    SAMPLE_SIZE = 50  # 滑动窗口样本数
+    MIN_SAMPLES = 10  # 计算p95所需的最少样本数
+    LATENCY_TOLERANCE = 3.0  # p95超过基线延迟的倍数视为不健康
+    MAX_ERROR_RATE = 0.1  # 错误率上限
+    DECREASE_COOLDOWN = 2.0  # 两次减窗的最小间隔（秒）
+    DECREASE_FACTOR = 0.5
+
+    def __init__(self, key: str, initial: int, min_window: int, max_window: int):
+        self.key = key
+        self.min_window = min_window
+        self.max_window = max_window
+        self.window = float(min(max(initial, min_window), max_window))
+        self._latencies: Deque[float] = deque(maxlen=self.SAMPLE_SIZE)
+        self._outcomes: Deque[bool] = deque(maxlen=self.SAMPLE_SIZE)
+        self._baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.last_reason: Optional[str] = None
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_window, int(self.window))
+
+    def _p(self, q: float) -> Optional[float]:
+        if len(self._latencies) < self.MIN_SAMPLES:
+            return None
+        return percentile(self._latencies, q)
+
+    def _error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _healthy(self) -> bool:
+        p95 = self._p(0.95)
+        if p95 is None or self._baseline is None:
+            return self._error_rate() <= self.MAX_ERROR_RATE
+        return p95 <= self._baseline * self.LATENCY_TOLERANCE and self._error_rate() <= self.MAX_ERROR_RATE
+
+    def record_success(self, latency: float, in_flight: int, adjust: bool = True) -> None:
+        self._latencies.append(latency)
+        self._outcomes.append(True)
+        if not adjust:
+            return
+
+        # 基线取观测到的最低p50，并缓慢上浮以适应供应商的长期变化
+        p50 = self._p(0.5)
+        if p50 is not None:
+            self._baseline = p50 if self._baseline is None else min(self._baseline * 1.01, max(p50, 1e-3))
+
+        # 窗口未被占满时增大窗口没有意义（负载不足）
+        if in_flight >= self.limit and self._healthy() and self.window < self.max_window:
+            self.window = min(self.max_window, self.window + 1.0 / self.window)
+            self.increases += 1
+
+    def record_congestion(self, reason: str) -> None:
+        self._outcomes.append(False)
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        old = self.limit
+        self.window = max(float(self.min_window), self.window * self.DECREASE_FACTOR)
+        self.decreases += 1
+        self.last_reason = reason
+        print(f"📉 [AIMD] 模型 {self.key} {reason}，并发窗口 {old} → {self.limit}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        p50, p95 = self._p(0.5), self._p(0.95)
+        return {
+            "model": self.key,
+            "window": self.limit,
+            "window_raw": round(self.window, 2),
+            "min_window": self.min_window,
+            "max_window": self.max_window,
+            "ttft_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "ttft_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "baseline_ms": round(self._baseline * 1000, 1) if self._baseline is not None else None,
+            "error_rate": round(self._error_rate(), 3),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "last_reason": self.last_reason,
+        }
+
+
+class AdaptiveConcurrencyController:
+    """按模型管理并发窗口（配置来自系统设置中的并发配置）"""
+
+    def __init__(self, enabled: bool = True, initial_window: int = 3, max_window: int = 16, min_window: int = 1):
+        self.enabled = enabled
+        self.initial_window = initial_window
+        self.max_window = max_window
+        self.min_window = min_window
+        self._windows: Dict[str, ModelConcurrencyWindow] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool, initial_window: int, max_window: int) -> None:
+        """更新配置，已有窗口保留当前值但受新的上限约束"""
+        self.enabled = enabled
+        self.initial_window = initial_window
+        self.max_window = max(max_window, self.min_window)
+        for w in self._windows.values():
+            w.max_window = self.max_window
+            w.window = min(w.window, float(self.max_window))
+
+    def _get(self, model: str) -> ModelConcurrencyWindow:
+        w = self._windows.get(model)
+        if w is None:
+            with self._lock:
+                w = self._windows.get(model)
+                if w is None:
+                    w = ModelConcurrencyWindow(model, self.initial_window, self.min_window, self.max_window)
+                    self._windows[model] = w
+        return w
+
+    def window_for(self, model: str) -> Optional[int]:
+        """当前允许的在途请求数（未启用时返回None）"""
+        if not self.enabled:
+            return None
+        return self._get(model).limit
+
+    def record_success(self, model: str, latency: float, in_flight: int) -> None:
+        # 未启用自适应时也记录延迟样本，供对冲请求计算触发延迟
+        self._get(model).record_success(latency, in_flight, adjust=self.enabled)
+
+    def ttft_percentile(self, model: str, q: float) -> Optional[float]:
+        """模型首token延迟的分位数（秒，样本不足时返回None）"""
+        w = self._windows.get(model)
+        return w._p(q) if w is not None else None
+
+    def record_congestion(self, model: str, reason: str) -> None:
+        if self.enabled:
+            self._get(model).record_congestion(reason)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "initial_window": self.initial_window,
+            "max_window": self.max_window,
+            "models": [w.get_stats() for w in self._windows.values()],
+        }
+
+
+# 全局并发控制器实例
+concurrency_controller = AdaptiveConcurrencyController()
@@ -0,0 +1,174 @@
+"""
+需求文档上下文策略
+用例设计按批次调用AI，每个批次都需要需求文档作为业务上下文。不同模式下携带的内容不同：
+- full：每个批次携带完整文档（原有行为）
+- prefix：完整文档放在提示词最前面、批次变化的测试点放在后面，
+  系统提示词 + 文档构成稳定前缀，可命中供应商的提示词缓存（Prompt Caching）
+- excerpt：按标题切分文档，每个批次只携带BM25检索出的与本批测试点最相关的分段（受token预算限制）
+- summary：整个任务只让模型生成一次文档摘要，所有批次复用摘要（作为稳定前缀）
+
+文档本身小于 full_threshold_tokens 时，excerpt / summary 直接退化为 prefix。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.services.batch_planner import estimate_tokens
+from app.services.requirement_index import BM25Index, build_segments
+
+
+CONTEXT_MODES = ("full", "prefix", "excerpt", "summary")
+
+class ContextStats:
+    """上下文token统计（与每批都携带完整文档相比节省的token数）"""
+
+    def __init__(self, mode: str, document_tokens: int):
+        self.mode = mode
+        self.document_tokens = document_tokens
+        self.calls = 0
+        self.sent_tokens = 0
+        self.cacheable_tokens = 0
+        self.overhead_tokens = 0  # 生成摘要等一次性开销
+        self._lock = threading.Lock()
+
+    def record(self, sent_tokens: int, cacheable: bool = False) -> None:
+        with self._lock:
+            self.calls += 1
+            self.sent_tokens += sent_tokens
+            if cacheable:
+                self.cacheable_tokens += sent_tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        baseline = self.document_tokens * self.calls
+        saved = baseline - self.sent_tokens - self.overhead_tokens
+        return {
+            "mode": self.mode,
+            "document_tokens": self.document_tokens,
+            "calls": self.calls,
+            "baseline_tokens": baseline,
+            "sent_tokens": self.sent_tokens,
+            "overhead_tokens": self.overhead_tokens,
+            "saved_tokens": saved,
+            "saved_ratio": round(saved / baseline, 3) if baseline else 0.0,
+            "cacheable_prefix_tokens": self.cacheable_tokens,
+        }
+
+
+# 文档摘要缓存（按文档内容哈希，进程内复用，超过上限时淘汰最久未使用的摘要）
+DIGEST_CACHE_SIZE = 256
+_digest_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+class RequirementContext:
+    """一次用例设计任务的需求文档上下文
+
+    Example:
+        context = RequirementContext(content, mode="excerpt")
+        await context.prepare(summarize)
+        shared = context.shared_context          # 放在提示词最前面的稳定前缀（可能为空）
+        text = context.for_batch(test_points)    # 填入模板 {{requirement_content}} 的内容
+    """
+
+    def __init__(
+        self,
+        content: str,
+        mode: str = "excerpt",
+        excerpt_tokens: int = 2000,
+        summary_tokens: int = 1500,
+        full_threshold_tokens: int = 3000,
+        top_k: int = 3,
+        index: Optional[BM25Index] = None
+    ):
+        """
+        Args:
+            content: 完整需求文档（full / prefix / summary 模式使用）
+            top_k: excerpt 模式下每个测试点检索的分段数
+            index: 模块的持久化BM25索引，为空时按 content 临时构建
+        """
+        self.content = content or ""
+        self.document_tokens = estimate_tokens(self.content)
+        if mode not in CONTEXT_MODES:
+            mode = "full"
+        if mode in ("excerpt", "summary") and self.document_tokens <= full_threshold_tokens:
+            mode = "prefix"
+        self.mode = mode
+        self.excerpt_tokens = excerpt_tokens
+        self.summary_tokens = summary_tokens
+        self.top_k = top_k
+        self.digest: Optional[str] = None
+        self.stats = ContextStats(self.mode, self.document_tokens)
+
+        self._index = index
+        if self.mode == "excerpt":
+            self._build_index()
+
+    def _build_index(self) -> None:
+        if self._index is None or not len(self._index):
+            self._index = BM25Index(build_segments(self.content))
+
+    async def prepare(self, summarize: Callable[[str, int], Awaitable[str]]) -> None:
+        """summary 模式下生成（或复用）文档摘要；摘要失败时退化为 excerpt"""
+        if self.mode != "summary":
+            return
+        key = hashlib.sha256(f"{self.summary_tokens}:{self.content}".encode("utf-8")).hexdigest()
+        digest = _digest_cache.get(key)
+        if digest is not None:
+            _digest_cache.move_to_end(key)
+        else:
+            try:
+                digest = (await summarize(self.content, self.summary_tokens) or "").strip()
+            except Exception as e:
+                print(f"⚠️ [Context] 生成需求文档摘要失败，改用章节节选: {e}")
+                digest = ""
+            if digest:
+                _digest_cache[key] = digest
+                while len(_digest_cache) > DIGEST_CACHE_SIZE:
+                    _digest_cache.popitem(last=False)
+                self.stats.overhead_tokens += self.document_tokens
+        if not digest:
+            self.mode = self.stats.mode = "excerpt"
+            self._build_index()
+            return
+        self.digest = digest
+        print(f"📝 [Context] 需求文档摘要: {self.document_tokens} → {estimate_tokens(digest)} tokens")
+
+    @property
+    def shared_context(self) -> str:
+        """所有批次共用、放在提示词最前面的上下文"""
+        if self.mode == "prefix":
+            return self.content
+        if self.mode == "summary":
+            return self.digest or ""
+        return ""
+
+    @property
+    def planning_tokens(self) -> int:
+        """批次规划时每次调用按多少上下文token预估"""
+        if self.mode == "excerpt":
+            return min(self.document_tokens, self.excerpt_tokens)
+        if self.mode == "summary" and self.digest:
+            return estimate_tokens(self.digest)
+        return self.document_tokens
+
+    def for_batch(self, test_points: List[Dict[str, Any]]) -> str:
+        """本批次填入 {{requirement_content}} 的内容，并记录发送的token数"""
+        if not self.content:
+            return ""
+        if self.mode == "full":
+            self.stats.record(self.document_tokens)
+            return self.content
+        if self.mode in ("prefix", "summary"):
+            shared = self.shared_context
+            self.stats.record(estimate_tokens(shared), cacheable=True)
+            return ""
+        excerpt = self.excerpt([str(tp.get("content", "")) for tp in test_points])
+        self.stats.record(estimate_tokens(excerpt))
+        return excerpt
+
+    def excerpt(self, queries: List[str]) -> str:
+        """每个查询检索 top-k 分段，合并后按原文顺序拼接（受 excerpt_tokens 限制）"""
+        selected = self._index.retrieve(queries, self.top_k, self.excerpt_tokens)
+        if not selected and self._index.segments:
+            selected = [self._index.segments[0]]
+        return "（以下为与本批测试点相关的需求文档节选）\n\n" + "\n\n……\n\n".join(s.text for s in selected)
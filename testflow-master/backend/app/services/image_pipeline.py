@@ -0,0 +1,300 @@
+"""
+多模态请求的图片预处理
+需求文档（DOCX）中提取的截图通常分辨率很高、数量多，直接 base64 发送会让请求体达到数MB：
+- 缩放：最长边不超过 image_max_edge，重新压缩（JPEG / PNG 取较小者）
+- 去重：按感知哈希（dHash）去掉近似重复的截图
+- 预算：单次请求的图片数量、字节数、预估token数不超过上限，超出的图片按文档顺序丢弃
+- 缓存：处理后的图片按 (原文件哈希, 处理参数) 缓存到磁盘，base64 结果缓存在内存，
+  重试和重复调用不再重新读取、编码原图
+
+Pillow 已列入 requirements.txt；运行环境中缺少时不缩放、按文件内容精确去重，其余功能不变。
+"""
+import base64
+import io
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.services.llm_cache import hash_file
+from app.utils.file_extractor import _get_image_dimensions
+
+
+def _pil_available() -> bool:
+    """检查是否安装了 Pillow"""
+    try:
+        import PIL  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def estimate_image_tokens(width: Optional[int], height: Optional[int], detail: str = "high") -> int:
+    """按 OpenAI 视觉模型的计费规则估算图片token数（尺寸未知时按典型值）"""
+    if detail == "low":
+        return 85
+    if not width or not height:
+        return 765
+    # 先缩放到 2048x2048 以内，再把短边缩放到 768
+    scale = min(1.0, 2048 / max(width, height))
+    w, h = width * scale, height * scale
+    scale = min(1.0, 768 / min(w, h))
+    w, h = w * scale, h * scale
+    tiles = math.ceil(w / 512) * math.ceil(h / 512)
+    return 85 + 170 * tiles
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class PreparedImage:
+    """处理后的图片（可直接放入 image_url 消息）"""
+
+    def __init__(
+        self,
+        source: str,
+        file_hash: str,
+        mime_type: str,
+        data: bytes,
+        width: Optional[int],
+        height: Optional[int],
+        dhash: Optional[int]
+    ):
+        self.source = source
+        self.file_hash = file_hash
+        self.mime_type = mime_type
+        self.data = data
+        self.width = width
+        self.height = height
+        self.dhash = dhash
+        self._b64: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.data).decode("utf-8")
+        return self._b64
+
+    def tokens(self, detail: str) -> int:
+        return estimate_image_tokens(self.width, self.height, detail)
+
+    def to_content_part(self, detail: str) -> Dict[str, Any]:
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{self.mime_type};base64,{self.b64}",
+                "detail": detail
+            }
+        }
+
+
+class ImagePipeline:
+    """图片预处理管线（进程内共享内存缓存，磁盘缓存跨进程复用）"""
+
+    MEMORY_CACHE_SIZE = 256
+
+    def __init__(self):
+        self._memory: "OrderedDict[str, PreparedImage]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"processed": 0, "disk_hits": 0, "memory_hits": 0, "deduplicated": 0, "dropped": 0,
+                      "original_bytes": 0, "sent_bytes": 0}
+
+    @property
+    def cache_dir(self) -> Path:
+        return Path(settings.image_cache_dir)
+
+    def _params_key(self) -> str:
+        return f"e{settings.image_max_edge}q{settings.image_jpeg_quality}p{int(_pil_available())}"
+
+    def _source_key(self, path: str) -> str:
+        """内存缓存键：路径 + 修改时间 + 大小（避免每次都计算文件哈希）"""
+        try:
+            stat = os.stat(path)
+            return f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{self._params_key()}"
+        except OSError:
+            return f"{path}:missing"
+
+    def prepare_one(self, path: str) -> PreparedImage:
+        """处理单张图片（内存缓存 → 磁盘缓存 → 重新处理）"""
+        source_key = self._source_key(path)
+        with self._lock:
+            cached = self._memory.get(source_key)
+            if cached is not None:
+                self._memory.move_to_end(source_key)
+                self.stats["memory_hits"] += 1
+                return cached
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        file_hash = hash_file(path)
+        image = self._load_from_disk(path, file_hash)
+        if image is None:
+            image = self._process(path, file_hash)
+            self._save_to_disk(image)
+        else:
+            self.stats["disk_hits"] += 1
+
+        with self._lock:
+            self._memory[source_key] = image
+            while len(self._memory) > self.MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+        return image
+
+    def _cache_paths(self, file_hash: str) -> Tuple[Path, Path]:
+        base = self.cache_dir / file_hash[:2] / f"{file_hash}_{self._params_key()}"
+        return base.with_suffix(".bin"), base.with_suffix(".json")
+
+    def _load_from_disk(self, path: str, file_hash: str) -> Optional[PreparedImage]:
+        data_path, meta_path = self._cache_paths(file_hash)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            data = data_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        return PreparedImage(path, file_hash, meta["mime_type"], data, meta.get("width"), meta.get("height"), meta.get("dhash"))
+
+    def _save_to_disk(self, image: PreparedImage) -> None:
+        data_path, meta_path = self._cache_paths(image.file_hash)
+        try:
+            data_path.parent.mkdir(parents=True, exist_ok=True)
+            data_path.write_bytes(image.data)
+            meta_path.write_text(json.dumps({
+                "mime_type": image.mime_type,
+                "width": image.width,
+                "height": image.height,
+                "dhash": image.dhash
+            }), encoding="utf-8")
+        except OSError as e:
+            print(f"⚠️ [ImagePipeline] 写入图片缓存失败: {e}")
+
+    def _process(self, path: str, file_hash: str) -> PreparedImage:
+        """缩放、重新压缩并计算感知哈希"""
+        self.stats["processed"] += 1
+        with open(path, "rb") as f:
+            original = f.read()
+        if not _pil_available():
+            width, height = _get_image_dimensions(path)
+            return PreparedImage(path, file_hash, _mime_from_path(path), original, width, height, None)
+
+        from PIL import Image
+
+        try:
+            with Image.open(io.BytesIO(original)) as img:
+                img.load()
+                dhash = _dhash(img)
+                original_size = img.size
+                max_edge = settings.image_max_edge
+                if max(img.size) > max_edge:
+                    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+                has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+
+                candidates: List[Tuple[str, bytes]] = []
+                png = io.BytesIO()
+                img.save(png, format="PNG", optimize=True)
+                candidates.append(("image/png", png.getvalue()))
+                if not has_alpha:
+                    jpeg = io.BytesIO()
+                    img.convert("RGB").save(jpeg, format="JPEG", quality=settings.image_jpeg_quality, optimize=True)
+                    candidates.append(("image/jpeg", jpeg.getvalue()))
+                mime_type, data = min(candidates, key=lambda c: len(c[1]))
+                width, height = img.size
+        except Exception as e:
+            print(f"⚠️ [ImagePipeline] 图片处理失败，使用原图 {path}: {e}")
+            width, height = _get_image_dimensions(path)
+            return PreparedImage(path, file_hash, _mime_from_path(path), original, width, height, None)
+
+        if len(data) >= len(original) and (width, height) == original_size:
+            # 重新压缩没有变小（原图已足够小）时直接使用原图
+            mime_type, data = _mime_from_path(path), original
+        return PreparedImage(path, file_hash, mime_type, data, width, height, dhash)
+
+    def prepare(self, image_paths: List[str], detail: Optional[str] = None) -> List[Dict[str, Any]]:
+        """处理一次请求的全部图片，返回 image_url 消息片段（已去重并受预算限制）"""
+        detail = detail or settings.image_detail
+        parts: List[Dict[str, Any]] = []
+        kept: List[PreparedImage] = []
+        total_bytes = total_tokens = 0
+        original_bytes = 0
+        for path in image_paths:
+            try:
+                image = self.prepare_one(path)
+            except Exception as e:
+                print(f"⚠️ 无法加载图片 {path}: {e}")
+                continue
+            try:
+                original_bytes += os.path.getsize(path)
+            except OSError:
+                pass
+
+            if self._is_duplicate(image, kept):
+                self.stats["deduplicated"] += 1
+                continue
+            tokens = image.tokens(detail)
+            if (len(kept) >= settings.image_max_count
+                    or total_bytes + image.size > settings.image_max_total_bytes
+                    or total_tokens + tokens > settings.image_max_total_tokens):
+                self.stats["dropped"] += 1
+                continue
+            kept.append(image)
+            total_bytes += image.size
+            total_tokens += tokens
+            parts.append(image.to_content_part(detail))
+
+        self.stats["original_bytes"] += original_bytes
+        self.stats["sent_bytes"] += total_bytes
+        if image_paths:
+            print(f"🖼️ [ImagePipeline] {len(image_paths)} 张图片 → 发送 {len(kept)} 张, "
+                  f"{original_bytes / 1024:.0f}KB → {total_bytes / 1024:.0f}KB, ≈{total_tokens} tokens")
+        return parts
+
+    @staticmethod
+    def _is_duplicate(image: PreparedImage, kept: List[PreparedImage]) -> bool:
+        for other in kept:
+            if image.file_hash == other.file_hash:
+                return True
+            if (image.dhash is not None and other.dhash is not None
+                    and hamming_distance(image.dhash, other.dhash) <= settings.image_dedup_distance):
+                return True
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "pillow_available": _pil_available(), "memory_entries": len(self._memory)}
+
+
+def _mime_from_path(path: str) -> str:
+    ext = path.lower().rsplit(".", 1)[-1]
+    return {
+        "png": "image/png",
+        "jpg": "image/jpeg",
+        "jpeg": "image/jpeg",
+        "gif": "image/gif",
+        "webp": "image/webp",
+    }.get(ext, "image/png")
+
+
+def _dhash(img: Any, size: int = 8) -> int:
+    """差异哈希：灰度缩放到 (size+1)xsize，比较相邻像素亮度"""
+    from PIL import Image
+
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+# 全局图片预处理实例
+image_pipeline = ImagePipeline()
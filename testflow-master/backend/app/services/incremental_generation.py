@@ -0,0 +1,188 @@
+"""
+增量重新生成
+一键生成完成后，在需求文件上记录文档分段的指纹，并把每个需求点映射到它来源的分段（BM25最相关分段）。
+需求文档修改后再次生成时：
+- 对比新旧分段指纹，找出新增/修改的分段和已删除（或被修改）的旧分段
+- 只删除来源分段已不存在的AI需求点及其测试点、测试用例；用户编辑过的需求点、测试点、测试用例保留
+  （被编辑的测试点/用例与原需求点解除关联后保留在模块中）
+- 只把新增/修改的分段发送给需求分析，生成的需求点再走测试点 → 用例 → 优化流程
+"""
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.services.requirement_index import BM25Index, Segment, build_segments
+
+
+FINGERPRINT_VERSION = 1
+
+
+def segment_hash(text: str) -> str:
+    """分段指纹（忽略空白差异）"""
+    normalized = re.sub(r"\s+", " ", text or "").strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def fingerprint_segments(content: str) -> List[Segment]:
+    """切分文档，分段上附带指纹（segment.fingerprint）"""
+    segments = build_segments(content or "")
+    for segment in segments:
+        segment.fingerprint = segment_hash(segment.text)
+    return segments
+
+
+def build_fingerprint(segments: Sequence[Segment], unmapped_point_ids: Sequence[int] = ()) -> Dict[str, Any]:
+    """保存到 RequirementFile.generation_fingerprint 的内容
+
+    Args:
+        unmapped_point_ids: 本次生成中无法映射到来源分段的AI需求点（下次生成时不因这些需求点退回全量生成）
+    """
+    return {
+        "version": FINGERPRINT_VERSION,
+        "segments": [{"hash": s.fingerprint, "heading": s.heading[:200]} for s in segments],
+        "unmapped_points": list(unmapped_point_ids)
+    }
+
+
+def assign_sources(contents: Sequence[str], segments: Sequence[Segment]) -> List[Optional[str]]:
+    """为每个需求点找到最相关的来源分段，返回分段指纹（没有任何分段时为 None）
+
+    BM25 没有命中任何分段的需求点（与分段没有共同词项，如模型改写了用词）归入前一个需求点的来源分段
+    （需求点按文档顺序输出），第一个需求点归入第一个分段；只有一个分段时全部归入该分段
+    """
+    if not segments:
+        return [None] * len(contents)
+    if len(segments) == 1:
+        return [segments[0].fingerprint] * len(contents)
+    index = BM25Index(segments)
+    sources = []
+    previous = segments[0].fingerprint
+    for content in contents:
+        hits = index.search(content, top_k=1)
+        if hits:
+            previous = hits[0][1].fingerprint
+        sources.append(previous)
+    return sources
+
+
+@dataclass
+class RegenerationPlan:
+    """增量重新生成计划"""
+    incremental: bool
+    segments: List[Segment]  # 新文档的全部分段
+    changed_segments: List[Segment] = field(default_factory=list)  # 需要重新分析的分段
+    removed_hashes: List[str] = field(default_factory=list)  # 新文档中已不存在的旧分段指纹
+    unchanged_count: int = 0
+    reason: str = ""
+
+    @property
+    def changed_content(self) -> str:
+        """只包含新增/修改分段的需求文档（按原文顺序）"""
+        return "\n\n".join(s.text for s in self.changed_segments)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "incremental": self.incremental,
+            "reason": self.reason,
+            "segments": len(self.segments),
+            "changed_segments": len(self.changed_segments),
+            "removed_segments": len(self.removed_hashes),
+            "unchanged_segments": self.unchanged_count,
+        }
+
+
+def plan_regeneration(db: Any, req_file: Any, content: str, enabled: bool = True) -> RegenerationPlan:
+    """对比需求文件上次生成时的分段指纹，决定全量还是增量生成"""
+    from app.models.requirement import RequirementPoint
+
+    segments = fingerprint_segments(content)
+    fingerprint = (req_file.generation_fingerprint or {}) if req_file is not None else {}
+
+    def full(reason: str) -> RegenerationPlan:
+        return RegenerationPlan(incremental=False, segments=segments, changed_segments=list(segments), reason=reason)
+
+    if not enabled:
+        return full("未启用增量生成")
+    if fingerprint.get("version") != FINGERPRINT_VERSION or not fingerprint.get("segments"):
+        return full("需求文件没有上次生成的分段指纹")
+
+    # 上次生成后又通过其他方式重新拆分过需求点（AI需求点缺少来源分段），无法可靠地增量更新
+    # （上次生成本身无法映射的需求点已记录在指纹中，不计入）
+    query = db.query(RequirementPoint.id).filter(
+        RequirementPoint.requirement_file_id == req_file.id,
+        RequirementPoint.created_by_ai == True,
+        RequirementPoint.source_segment_hash.is_(None)
+    )
+    known_unmapped = fingerprint.get("unmapped_points") or []
+    if known_unmapped:
+        query = query.filter(RequirementPoint.id.notin_(known_unmapped))
+    unmapped = query.count()
+    if unmapped:
+        return full(f"{unmapped} 个AI需求点缺少来源分段")
+
+    old_hashes = {s["hash"] for s in fingerprint["segments"]}
+    new_hashes = {s.fingerprint for s in segments}
+    changed = [s for s in segments if s.fingerprint not in old_hashes]
+    removed = [h for h in dict.fromkeys(s["hash"] for s in fingerprint["segments"]) if h not in new_hashes]
+    return RegenerationPlan(
+        incremental=True,
+        segments=segments,
+        changed_segments=changed,
+        removed_hashes=removed,
+        unchanged_count=len(segments) - len(changed),
+        reason="按分段差异增量生成"
+    )
+
+
+def remove_stale_artifacts(db: Any, file_id: int, removed_hashes: Sequence[str]) -> Dict[str, int]:
+    """删除来源分段已不存在的AI需求点及其派生数据，保留用户编辑过的内容
+
+    - 用户编辑过的需求点：整体保留（包括其测试点和用例）
+    - 用户编辑过的测试点：与需求点解除关联后保留（包括其用例）
+    - 用户编辑过的测试用例：与测试点解除关联后保留在模块中
+    """
+    from app.models.requirement import RequirementPoint
+    from app.models.testcase import TestCase, TestPoint
+    from app.models.testcase_signature import TestCaseSignature
+
+    stats = {"requirement_points": 0, "test_points": 0, "test_cases": 0, "kept_test_points": 0, "kept_test_cases": 0}
+    if not removed_hashes:
+        return stats
+
+    rp_ids = [rp.id for rp in db.query(RequirementPoint.id).filter(
+        RequirementPoint.requirement_file_id == file_id,
+        RequirementPoint.source_segment_hash.in_(list(removed_hashes)),
+        RequirementPoint.edited_by_user == False
+    ).all()]
+    if not rp_ids:
+        return stats
+
+    # 批量更新/删除（不经过ORM级联，避免解除关联的对象被当作孤儿删除；fetch 同步会话中已加载的对象）
+    stats["kept_test_points"] = db.query(TestPoint).filter(
+        TestPoint.requirement_point_id.in_(rp_ids),
+        TestPoint.edited_by_user == True
+    ).update({TestPoint.requirement_point_id: None}, synchronize_session="fetch")
+
+    tp_ids = [tp.id for tp in db.query(TestPoint.id).filter(TestPoint.requirement_point_id.in_(rp_ids)).all()]
+    if tp_ids:
+        stats["kept_test_cases"] = db.query(TestCase).filter(
+            TestCase.test_point_id.in_(tp_ids),
+            TestCase.edited_by_user == True
+        ).update({TestCase.test_point_id: None}, synchronize_session="fetch")
+        case_ids = [tc.id for tc in db.query(TestCase.id).filter(TestCase.test_point_id.in_(tp_ids)).all()]
+        if case_ids:
+            db.query(TestCaseSignature).filter(
+                TestCaseSignature.test_case_id.in_(case_ids)
+            ).delete(synchronize_session="fetch")
+            stats["test_cases"] = db.query(TestCase).filter(
+                TestCase.id.in_(case_ids)
+            ).delete(synchronize_session="fetch")
+        stats["test_points"] = db.query(TestPoint).filter(
+            TestPoint.id.in_(tp_ids)
+        ).delete(synchronize_session="fetch")
+
+    stats["requirement_points"] = db.query(RequirementPoint).filter(
+        RequirementPoint.id.in_(rp_ids)
+    ).delete(synchronize_session="fetch")
+    return stats
@@ -0,0 +1,243 @@
+"""
+LLM响应缓存
+按 (模型, 系统提示词, 用户提示词, 温度, 图片摘要) 的内容哈希缓存AI响应，
+重复执行同一文档的生成流程时直接返回缓存结果，节省token和时间。
+
+使用独立的 SQLite 文件存储，支持 TTL 过期和按条数/字节数的 LRU 淘汰。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+
+
+def hash_file(path: str) -> str:
+    """计算文件内容的 SHA-256 摘要（文件不存在时使用路径）"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    except OSError:
+        digest.update(f"missing:{path}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_cache_key(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    image_paths: Optional[List[str]] = None
+) -> str:
+    """生成缓存键（内容寻址）
+
+    图片按文件内容计算摘要，同一张图片换了存储路径也能命中
+    """
+    payload = {
+        "model": model,
+        "system_prompt": system_prompt or "",
+        "user_prompt": user_prompt or "",
+        "temperature": round(float(temperature or 0), 4),
+        "images": [hash_file(p) for p in (image_paths or [])],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """基于 SQLite 的LLM响应缓存
+
+    - get/set 为同步操作（每次都会提交事务），内部加锁保证线程安全；
+      生成流程中通过 asyncio.to_thread 调用，不阻塞事件循环
+    - 过期条目在读取时删除，并在写入时周期性清理
+    - 超过条数或字节数上限时按最近访问时间淘汰
+    """
+
+    _PURGE_EVERY = 50  # 每写入N次执行一次淘汰
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        enabled: Optional[bool] = None
+    ):
+        self.path = path or settings.llm_cache_path
+        self.ttl = settings.llm_cache_ttl if ttl is None else ttl
+        self.max_entries = settings.llm_cache_max_entries if max_entries is None else max_entries
+        self.max_bytes = settings.llm_cache_max_bytes if max_bytes is None else max_bytes
+        self.enabled = settings.llm_cache_enabled if enabled is None else enabled
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes_since_purge = 0
+
+        # 进程内统计
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """延迟打开数据库连接并建表"""
+        if self._conn is None:
+            parent = Path(self.path).parent
+            parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_accessed ON llm_cache(last_accessed)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期返回None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                row = conn.execute(
+                    "SELECT response, created_at FROM llm_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self._misses += 1
+                    return None
+                response, created_at = row
+                if self.ttl and now - created_at > self.ttl:
+                    conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+                    conn.commit()
+                    self._misses += 1
+                    self._evictions += 1
+                    return None
+                conn.execute(
+                    "UPDATE llm_cache SET last_accessed = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+                    (now, key)
+                )
+                conn.commit()
+                self._hits += 1
+                return response
+        except sqlite3.Error as e:
+            print(f"⚠️ [LLMCache] 读取缓存失败: {e}")
+            return None
+
+    def set(self, key: str, response: str, model: Optional[str] = None) -> None:
+        """写入缓存"""
+        if not self.enabled or not response:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO llm_cache
+                        (cache_key, model, response, size, created_at, last_accessed, hit_count)
+                    VALUES (?, ?, ?, ?, ?, ?, 0)
+                    """,
+                    (key, model, response, len(response.encode("utf-8")), now, now)
+                )
+                conn.commit()
+                self._stores += 1
+                self._writes_since_purge += 1
+                if self._writes_since_purge >= self._PURGE_EVERY:
+                    self._writes_since_purge = 0
+                    self._purge_locked(now)
+        except sqlite3.Error as e:
+            print(f"⚠️ [LLMCache] 写入缓存失败: {e}")
+
+    def _purge_locked(self, now: float) -> None:
+        """清理过期条目并按LRU淘汰超限条目（调用方需持有锁）"""
+        conn = self._get_conn()
+        removed = 0
+        if self.ttl:
+            removed += conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if (self.max_entries and count > self.max_entries) or (self.max_bytes and total > self.max_bytes):
+            rows = conn.execute("SELECT cache_key, size FROM llm_cache ORDER BY last_accessed ASC").fetchall()
+            to_delete = []
+            for cache_key, size in rows:
+                if (not self.max_entries or count <= self.max_entries) and (not self.max_bytes or total <= self.max_bytes):
+                    break
+                to_delete.append((cache_key,))
+                count -= 1
+                total -= size
+            conn.executemany("DELETE FROM llm_cache WHERE cache_key = ?", to_delete)
+            removed += len(to_delete)
+
+        conn.commit()
+        self._evictions += removed
+
+    def purge(self) -> None:
+        """立即执行过期清理和容量淘汰"""
+        try:
+            with self._lock:
+                self._purge_locked(time.time())
+        except sqlite3.Error as e:
+            print(f"⚠️ [LLMCache] 清理缓存失败: {e}")
+
+    def clear(self) -> int:
+        """清空缓存，返回删除的条目数"""
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                removed = conn.execute("DELETE FROM llm_cache").rowcount
+                conn.commit()
+                return removed
+        except sqlite3.Error as e:
+            print(f"⚠️ [LLMCache] 清空缓存失败: {e}")
+            return 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计（命中/未命中计数为进程启动以来的累计值）"""
+        entries, total_bytes = 0, 0
+        try:
+            with self._lock:
+                entries, total_bytes = self._get_conn().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ [LLMCache] 读取统计失败: {e}")
+
+        lookups = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "path": os.path.abspath(self.path),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            "stores": self._stores,
+            "evictions": self._evictions,
+            "entries": entries,
+            "total_bytes": total_bytes,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# 全局缓存实例
+llm_cache = LLMResponseCache()
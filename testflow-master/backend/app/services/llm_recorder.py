@@ -0,0 +1,101 @@
+"""
+LLM调用录制
+配置 llm_record_path 后，AIService 把每次真实的 /chat/completions 调用（请求消息 + 完整响应 + 耗时）
+追加写入 JSONL 文件，供本地模拟供应商（benchmarks/mock_llm.py）按请求内容确定性地回放，
+从而在不调用真实供应商的情况下复现一次完整的生成流程、对比并发和批次配置的性能。
+
+记录中不包含 API 密钥；图片内容只保留哈希。
+"""
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.config import settings
+
+
+def _strip_images(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把 image_url 中的 base64 数据替换为哈希（避免记录文件过大，回放时按同样规则计算键）"""
+    result = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "image_url":
+                    url = (part.get("image_url") or {}).get("url", "")
+                    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+                    part = {"type": "image_url", "image_url": {"url": f"sha256:{digest}"}}
+                parts.append(part)
+            message = {**message, "content": parts}
+        result.append(message)
+    return result
+
+
+def request_key(messages: List[Dict[str, Any]]) -> str:
+    """请求的回放键：只由消息内容决定（与模型名、温度无关，换模型配置后仍可回放）"""
+    payload = json.dumps(_strip_images(messages), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMRecorder:
+    """把真实调用追加写入 JSONL 文件"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.llm_record_path)
+
+    def record(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        max_tokens: int,
+        content: str,
+        finish_reason: Optional[str],
+        first_token_latency: Optional[float],
+        elapsed: float
+    ) -> None:
+        """记录一次完成的调用（写入失败只打印警告，不影响调用本身）"""
+        if not self.enabled:
+            return
+        entry = {
+            "key": request_key(messages),
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": _strip_images(messages),
+            "content": content,
+            "finish_reason": finish_reason or "stop",
+            "ttft": round(first_token_latency, 4) if first_token_latency is not None else None,
+            "elapsed": round(elapsed, 4),
+            "timestamp": time.time(),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        try:
+            path = Path(settings.llm_record_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with self._lock, open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            print(f"⚠️ [LLMRecorder] 写入录制文件失败: {e}")
+
+
+def load_recordings(path: str) -> Iterator[Dict[str, Any]]:
+    """逐条读取录制文件（跳过损坏的行）"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+# 全局录制实例
+llm_recorder = LLMRecorder()
@@ -0,0 +1,266 @@
+"""
+AI调用遥测
+每次智能体调用（包含其中的重试，以及命中缓存的调用）写入一条 TaskLog：
+模型、阶段、首token延迟、总耗时、输入/输出token数（优先使用供应商返回的 usage，否则估算）、
+重试次数、是否命中缓存、最终错误类型。
+
+- 调用过程中的指标通过 contextvar 在 AgentServiceReal 和 AIService 之间传递，不改动调用签名
+- 写入由后台线程按批提交（独立会话，写入调用方所用的同一个数据库），不占用生成流程的事件循环；
+  队列超过上限时丢弃最早的记录
+"""
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.utils.stats import percentile
+
+
+class CallMetrics:
+    """一次智能体调用的指标（由 AIService 在每次成功的HTTP响应后填充）"""
+
+    def __init__(self):
+        self.model: Optional[str] = None
+        self.ttft: Optional[float] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.usage_reported = False
+        self.http_calls = 0
+        self.retries = 0
+        self.cache_hit = False
+
+    def record_response(
+        self,
+        model: str,
+        ttft: Optional[float],
+        prompt_tokens: int,
+        completion_tokens: int,
+        usage_reported: bool
+    ) -> None:
+        self.model = model
+        self.ttft = ttft
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.usage_reported = usage_reported
+
+
+_current_call: ContextVar[Optional[CallMetrics]] = ContextVar("llm_call_metrics", default=None)
+
+
+def current_call_metrics() -> Optional[CallMetrics]:
+    return _current_call.get()
+
+
+@contextmanager
+def track_call() -> Iterator[CallMetrics]:
+    """在当前上下文中收集一次智能体调用的指标"""
+    metrics = CallMetrics()
+    token = _current_call.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_call.reset(token)
+
+
+class TelemetryWriter:
+    """TaskLog 批量写入器（后台线程）"""
+
+    MAX_QUEUE = 10000
+
+    def __init__(self):
+        self._queue: Deque[Tuple[Any, Dict[str, Any]]] = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"recorded": 0, "written": 0, "dropped": 0, "failed_batches": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.llm_telemetry_enabled
+
+    def record(self, bind: Any, **fields: Any) -> None:
+        """加入写入队列（bind 为调用方会话绑定的引擎，日志写入同一个数据库）"""
+        if not self.enabled or bind is None:
+            return
+        with self._lock:
+            if len(self._queue) >= self.MAX_QUEUE:
+                self._queue.popleft()
+                self.stats["dropped"] += 1
+            self._queue.append((bind, fields))
+            self.stats["recorded"] += 1
+            pending = len(self._queue)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-telemetry", daemon=True)
+                self._thread.start()
+        if pending >= settings.llm_telemetry_batch_size:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(settings.llm_telemetry_flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """写入队列中的全部记录，返回写入条数"""
+        from app.models.ai_config import TaskLog
+
+        with self._flush_lock:
+            with self._lock:
+                items = list(self._queue)
+                self._queue.clear()
+            if not items:
+                return 0
+
+            by_bind: Dict[int, Tuple[Any, List[Dict[str, Any]]]] = {}
+            for bind, fields in items:
+                by_bind.setdefault(id(bind), (bind, []))[1].append(fields)
+
+            written = 0
+            for bind, rows in by_bind.values():
+                session = Session(bind=bind)
+                try:
+                    session.add_all([TaskLog(**fields) for fields in rows])
+                    session.commit()
+                    written += len(rows)
+                except Exception as e:
+                    session.rollback()
+                    self.stats["failed_batches"] += 1
+                    print(f"⚠️ [Telemetry] 写入 {len(rows)} 条AI调用日志失败: {e}")
+                finally:
+                    session.close()
+            self.stats["written"] += written
+            return written
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "pending": len(self._queue), "enabled": self.enabled}
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    value = percentile(values, q)
+    return round(value, 3) if value is not None else None
+
+
+def log_to_dict(log: Any) -> Dict[str, Any]:
+    return {
+        "id": log.id,
+        "agent_id": log.agent_id,
+        "task_type": log.task_type,
+        "run_id": log.run_id,
+        "stage": log.stage,
+        "model": log.model,
+        "status": log.status.value if log.status else None,
+        "execution_time": log.execution_time,
+        "ttft": log.ttft,
+        "prompt_tokens": log.prompt_tokens,
+        "completion_tokens": log.completion_tokens,
+        "retry_count": log.retry_count,
+        "cache_hit": log.cache_hit,
+        "error_class": log.error_class,
+        "error_message": log.error_message,
+        "input_data": log.input_data,
+        "created_at": log.created_at.isoformat() if log.created_at else None,
+    }
+
+
+def query_logs(
+    db: Session,
+    user_id: Optional[int] = None,
+    agent_id: Optional[int] = None,
+    run_id: Optional[str] = None,
+    limit: int = 50
+) -> List[Dict[str, Any]]:
+    """查询调用日志（按时间倒序）"""
+    from app.models.ai_config import TaskLog
+
+    query = db.query(TaskLog)
+    if user_id is not None:
+        query = query.filter(TaskLog.created_by == user_id)
+    if agent_id is not None:
+        query = query.filter(TaskLog.agent_id == agent_id)
+    if run_id:
+        query = query.filter(TaskLog.run_id == run_id)
+    logs = query.order_by(TaskLog.id.desc()).limit(limit).all()
+    return [log_to_dict(log) for log in logs]
+
+
+def aggregate_logs(
+    db: Session,
+    agent_id: Optional[int] = None,
+    run_id: Optional[str] = None,
+    since_hours: float = 24,
+    max_rows: int = 50000
+) -> Dict[str, Any]:
+    """按 (模型, 阶段) 汇总延迟分位数和token数，按任务汇总token和调用数"""
+    from datetime import datetime, timedelta, timezone
+    from app.models.ai_config import TaskLog
+
+    query = db.query(TaskLog).filter(TaskLog.task_type == "llm_call")
+    if agent_id is not None:
+        query = query.filter(TaskLog.agent_id == agent_id)
+    if run_id:
+        query = query.filter(TaskLog.run_id == run_id)
+    elif since_hours:
+        query = query.filter(TaskLog.created_at >= datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=since_hours))
+    logs = query.order_by(TaskLog.id.desc()).limit(max_rows).all()
+
+    groups: Dict[Tuple[str, str], List[Any]] = {}
+    runs: Dict[str, Dict[str, Any]] = {}
+    for log in logs:
+        groups.setdefault((log.model or "", log.stage or ""), []).append(log)
+        if log.run_id:
+            run = runs.setdefault(log.run_id, {
+                "run_id": log.run_id, "calls": 0, "failures": 0, "cache_hits": 0, "retries": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "llm_seconds": 0.0,
+                "started_at": None, "finished_at": None
+            })
+            run["calls"] += 1
+            run["failures"] += int(log.error_class is not None)
+            run["cache_hits"] += int(bool(log.cache_hit))
+            run["retries"] += log.retry_count or 0
+            run["prompt_tokens"] += log.prompt_tokens or 0
+            run["completion_tokens"] += log.completion_tokens or 0
+            run["llm_seconds"] += log.execution_time or 0.0
+            created = log.created_at.isoformat() if log.created_at else None
+            if created and (run["started_at"] is None or created < run["started_at"]):
+                run["started_at"] = created
+            if created and (run["finished_at"] is None or created > run["finished_at"]):
+                run["finished_at"] = created
+
+    by_model_stage = []
+    for (model, stage), items in sorted(groups.items()):
+        called = [l for l in items if not l.cache_hit]
+        latencies = [l.execution_time for l in called if l.execution_time is not None and l.error_class is None]
+        ttfts = [l.ttft for l in called if l.ttft is not None]
+        by_model_stage.append({
+            "model": model,
+            "stage": stage,
+            "calls": len(items),
+            "failures": sum(1 for l in items if l.error_class is not None),
+            "cache_hits": len(items) - len(called),
+            "retries": sum(l.retry_count or 0 for l in items),
+            "latency_p50": _percentile(latencies, 0.5),
+            "latency_p95": _percentile(latencies, 0.95),
+            "ttft_p50": _percentile(ttfts, 0.5),
+            "ttft_p95": _percentile(ttfts, 0.95),
+            "prompt_tokens": sum(l.prompt_tokens or 0 for l in items),
+            "completion_tokens": sum(l.completion_tokens or 0 for l in items),
+        })
+    for run in runs.values():
+        run["llm_seconds"] = round(run["llm_seconds"], 3)
+
+    return {
+        "total_calls": len(logs),
+        "by_model_stage": by_model_stage,
+        "runs": sorted(runs.values(), key=lambda r: r["started_at"] or "", reverse=True),
+    }
+
+
+# 全局遥测写入实例
+llm_telemetry = TelemetryWriter()
@@ -0,0 +1,324 @@
+"""
+一键生成检查点
+任务在 AsyncTaskManager 中只存在于内存，服务重启后正在执行的生成任务会丢失。
+生成流程在每个需求点、设计批次、优化批次完成时把进度写入 generation_checkpoints 表：
+- 阶段：requirement（需求点生成中）/ streaming（测试点 → 用例 → 优化）/ finished
+- 已产出的需求点、测试点、测试用例ID
+- 已完成各自阶段工作的ID：测试点已生成完的需求点、用例已设计完的测试点、已优化（或通过质量门禁）的用例
+- 任务上下文哈希：生成配置和智能体配置，恢复时用于提示配置是否已变化
+
+进度总是在对应的数据保存之后、随同一次或之后的提交写入，不会出现进度已记录而数据未提交的情况。
+反过来不成立：流式执行时各阶段的工作协程共用一个会话，某一批数据可能随其他协程的提交先写入，
+之后才记录它的进度；恢复时 clear_partial_outputs 会删除未完成项的部分产出后重新生成，数据不会重复。
+进度逐条追加到 generation_checkpoint_items 表，每批只写入新增的项。
+服务启动时（或任务存储发现执行任务的进程已退出时）仍为 running 的检查点标记为 interrupted，可从最后完成的项继续执行。
+"""
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+RESUMABLE_STATUSES = ("interrupted", "failed")
+KINDS = ("requirement_points", "test_points", "test_cases")
+
+# 只影响调度不影响生成结果的配置项，不参与上下文哈希
+_SCHEDULING_KEYS = (
+    "pipeline_streaming",
+    "pipeline_test_point_workers",
+    "pipeline_design_workers",
+    "pipeline_optimize_workers",
+    "pipeline_queue_size",
+)
+_AGENT_KEYS = ("model", "temperature", "max_tokens", "system_prompt")
+
+
+def context_hash(context: Any, agent_ids: Dict[str, Optional[int]]) -> str:
+    """任务上下文哈希：生成配置、测试类别/设计方法和各阶段智能体的模型与提示词"""
+    generation = context.generation.model_dump()
+    for key in _SCHEDULING_KEYS:
+        generation.pop(key, None)
+    agents = {}
+    for stage, agent_id in sorted(agent_ids.items()):
+        config = context.agent_configs.get(agent_id) or {}
+        agents[stage] = {key: config.get(key) for key in _AGENT_KEYS}
+    payload = {
+        "generation": generation,
+        "categories": context.categories_text,
+        "design_methods": context.design_methods_text,
+        "agents": agents,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class PipelineCheckpoint:
+    """一次生成任务的检查点，修改后随调用方的下一次提交写入数据库"""
+
+    def __init__(self, db: Any, record: Any):
+        from app.models.generation_checkpoint import GenerationCheckpointItem
+
+        self.db = db
+        self.record = record
+        # 旧版本的检查点把进度整体保存在 JSON 列中
+        self.produced: Dict[str, List[int]] = {k: list((record.produced or {}).get(k, [])) for k in KINDS}
+        self.completed: Dict[str, set] = {k: set((record.completed or {}).get(k, [])) for k in KINDS}
+        if record.id is None:
+            return
+        items = db.query(
+            GenerationCheckpointItem.kind, GenerationCheckpointItem.item_id, GenerationCheckpointItem.completed
+        ).filter(GenerationCheckpointItem.checkpoint_id == record.id).order_by(GenerationCheckpointItem.id).all()
+        for kind, item_id, completed in items:
+            if completed:
+                self.completed[kind].add(item_id)
+            elif item_id not in self.produced[kind]:
+                self.produced[kind].append(item_id)
+
+    @classmethod
+    def start(
+        cls,
+        db: Any,
+        task_id: str,
+        module_id: int,
+        file_id: int,
+        user_id: Optional[int],
+        agent_ids: Dict[str, Optional[int]],
+        params: Optional[Dict[str, Any]] = None,
+        context_hash: Optional[str] = None,
+        project_id: Optional[int] = None
+    ) -> "PipelineCheckpoint":
+        """创建检查点并立即提交"""
+        from app.models.generation_checkpoint import GenerationCheckpoint
+        from app.models.module import Module
+
+        if project_id is None:
+            module = db.query(Module.project_id).filter(Module.id == module_id).first()
+            project_id = module.project_id if module else None
+        record = GenerationCheckpoint(
+            task_id=task_id,
+            status="running",
+            stage="requirement",
+            project_id=project_id,
+            module_id=module_id,
+            requirement_file_id=file_id,
+            user_id=user_id,
+            agent_ids=dict(agent_ids),
+            params=params or {},
+            context_hash=context_hash,
+            progress=0
+        )
+        db.add(record)
+        db.commit()
+        return cls(db, record)
+
+    @classmethod
+    def load(cls, db: Any, task_id: str) -> Optional["PipelineCheckpoint"]:
+        from app.models.generation_checkpoint import GenerationCheckpoint
+
+        record = db.query(GenerationCheckpoint).filter(GenerationCheckpoint.task_id == task_id).first()
+        return cls(db, record) if record else None
+
+    @property
+    def task_id(self) -> str:
+        return self.record.task_id
+
+    def _append(self, kind: str, ids: List[int], completed: bool) -> None:
+        # 只追加新增的项，随调用方的下一次提交写入
+        from app.models.generation_checkpoint import GenerationCheckpointItem
+
+        self.db.add_all(
+            GenerationCheckpointItem(checkpoint_id=self.record.id, kind=kind, item_id=i, completed=completed)
+            for i in ids
+        )
+
+    def set_stage(self, stage: str) -> None:
+        self.record.stage = stage
+
+    def set_progress(self, progress: int) -> None:
+        self.record.progress = progress
+
+    def add_produced(self, kind: str, ids: Iterable[int]) -> None:
+        existing = set(self.produced[kind])
+        new_ids = list(dict.fromkeys(i for i in ids if i not in existing))
+        self.produced[kind].extend(new_ids)
+        self._append(kind, new_ids, completed=False)
+
+    def mark_completed(self, kind: str, ids: Iterable[int]) -> None:
+        new_ids = list(dict.fromkeys(i for i in ids if i not in self.completed[kind]))
+        self.completed[kind].update(new_ids)
+        self._append(kind, new_ids, completed=True)
+
+    def pending(self, kind: str) -> List[int]:
+        """已产出但尚未完成下一步工作的ID（按产出顺序）"""
+        return [i for i in self.produced[kind] if i not in self.completed[kind]]
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        """记录任务结束状态并提交"""
+        self.record.status = status
+        if status == "completed":
+            self.record.stage = "finished"
+            self.record.progress = 100
+        if error:
+            self.record.error = error[:2000]
+        try:
+            self.db.commit()
+        except Exception as e:
+            print(f"⚠️ [Checkpoint] 更新检查点状态失败: {e}")
+            self.db.rollback()
+
+    def summary(self) -> Dict[str, Any]:
+        return checkpoint_summary(self.record)
+
+
+def checkpoint_summary(record: Any) -> Dict[str, Any]:
+    from sqlalchemy import func
+    from sqlalchemy.orm import object_session
+    from app.models.generation_checkpoint import GenerationCheckpointItem
+
+    produced = {k: len(v) for k, v in (record.produced or {}).items()}
+    completed = {k: len(v) for k, v in (record.completed or {}).items()}
+    rows = object_session(record).query(
+        GenerationCheckpointItem.kind,
+        GenerationCheckpointItem.completed,
+        func.count(GenerationCheckpointItem.id)
+    ).filter(GenerationCheckpointItem.checkpoint_id == record.id).group_by(
+        GenerationCheckpointItem.kind, GenerationCheckpointItem.completed
+    ).all()
+    for kind, is_completed, count in rows:
+        counts = completed if is_completed else produced
+        counts[kind] = counts.get(kind, 0) + count
+    return {
+        "task_id": record.task_id,
+        "status": record.status,
+        "stage": record.stage,
+        "project_id": record.project_id,
+        "module_id": record.module_id,
+        "requirement_file_id": record.requirement_file_id,
+        "progress": record.progress,
+        "produced": {k: produced.get(k, 0) for k in KINDS},
+        "completed": {k: completed.get(k, 0) for k in KINDS},
+        "error": record.error,
+        "resumed_by_task_id": record.resumed_by_task_id,
+        "created_at": record.created_at.isoformat() if record.created_at else None,
+        "updated_at": record.updated_at.isoformat() if record.updated_at else None,
+    }
+
+
+def mark_interrupted_runs(db: Any, task_ids: Optional[Sequence[str]] = None) -> List[Any]:
+    """把已不在执行的任务的检查点标记为已中断
+
+    服务启动时调用（检查全部执行中的检查点）；任务存储发现心跳超时的任务时也会调用（只检查这些任务）。
+    多个工作进程共享任务状态时，仍在其他工作进程中执行的任务不会被标记。
+
+    Returns:
+        被标记的检查点
+    """
+    from app.models.generation_checkpoint import GenerationCheckpoint
+    from app.services.async_task_manager import task_manager
+
+    query = db.query(GenerationCheckpoint).filter(GenerationCheckpoint.status == "running")
+    if task_ids is not None:
+        query = query.filter(GenerationCheckpoint.task_id.in_(list(task_ids)))
+    records = [record for record in query.all() if not task_manager.is_task_alive(record.task_id)]
+    for record in records:
+        record.status = "interrupted"
+    if records:
+        db.commit()
+    return records
+
+
+def claim_for_resume(db: Any, checkpoint_task_id: str, new_task_id: str) -> bool:
+    """提交恢复任务前占用检查点（状态改为 resuming），同一检查点不会被恢复两次
+
+    使用条件更新：只有状态仍可恢复时才会更新成功。上一次占用检查点的恢复任务已不在执行
+    （在等待队列中被取消或启动前失败）时，检查点可以重新被占用。
+
+    Returns:
+        是否占用成功
+    """
+    from app.models.generation_checkpoint import GenerationCheckpoint
+    from app.services.async_task_manager import task_manager
+
+    record = db.query(GenerationCheckpoint).filter(GenerationCheckpoint.task_id == checkpoint_task_id).first()
+    if record is None:
+        return False
+    query = db.query(GenerationCheckpoint).filter(GenerationCheckpoint.task_id == checkpoint_task_id)
+    if record.status == "resuming":
+        if record.resumed_by_task_id and task_manager.is_task_alive(record.resumed_by_task_id):
+            return False
+        query = query.filter(
+            GenerationCheckpoint.status == "resuming",
+            GenerationCheckpoint.resumed_by_task_id == record.resumed_by_task_id
+        )
+    else:
+        query = query.filter(GenerationCheckpoint.status.in_(RESUMABLE_STATUSES))
+    claimed = query.update(
+        {GenerationCheckpoint.status: "resuming", GenerationCheckpoint.resumed_by_task_id: new_task_id},
+        synchronize_session="fetch"
+    )
+    db.commit()
+    return claimed > 0
+
+
+def release_claim(db: Any, checkpoint_task_id: str, new_task_id: str) -> None:
+    """恢复任务未能提交时释放检查点"""
+    from app.models.generation_checkpoint import GenerationCheckpoint
+
+    db.query(GenerationCheckpoint).filter(
+        GenerationCheckpoint.task_id == checkpoint_task_id,
+        GenerationCheckpoint.status == "resuming",
+        GenerationCheckpoint.resumed_by_task_id == new_task_id
+    ).update({GenerationCheckpoint.status: "interrupted"}, synchronize_session="fetch")
+    db.commit()
+
+
+def list_resumable(db: Any, project_id: Optional[int] = None) -> List[Any]:
+    """可恢复的检查点（已中断或失败，且尚未被恢复），最新的在前"""
+    from app.models.generation_checkpoint import GenerationCheckpoint
+
+    query = db.query(GenerationCheckpoint).filter(GenerationCheckpoint.status.in_(RESUMABLE_STATUSES))
+    if project_id is not None:
+        query = query.filter(GenerationCheckpoint.project_id == project_id)
+    return query.order_by(GenerationCheckpoint.id.desc()).all()
+
+
+def clear_partial_outputs(db: Any, requirement_point_ids: Sequence[int], test_point_ids: Sequence[int]) -> Dict[str, int]:
+    """删除未完成项的部分产出，恢复时这些项会重新生成
+
+    - 测试点尚未生成完的需求点：删除其AI生成且未被编辑的测试点（及其用例）
+    - 用例尚未设计完的测试点：删除其AI生成且未被编辑的用例
+    """
+    from app.models.testcase import TestCase, TestPoint
+    from app.models.testcase_signature import TestCaseSignature
+
+    stats = {"test_points": 0, "test_cases": 0}
+    stale_tp_ids = list(test_point_ids)
+    if requirement_point_ids:
+        partial_tps = [tp.id for tp in db.query(TestPoint.id).filter(
+            TestPoint.requirement_point_id.in_(list(requirement_point_ids)),
+            TestPoint.created_by_ai == True,
+            TestPoint.edited_by_user == False
+        ).all()]
+        stale_tp_ids.extend(partial_tps)
+    else:
+        partial_tps = []
+
+    if stale_tp_ids:
+        case_ids = [tc.id for tc in db.query(TestCase.id).filter(
+            TestCase.test_point_id.in_(stale_tp_ids),
+            TestCase.created_by_ai == True,
+            TestCase.edited_by_user == False
+        ).all()]
+        if case_ids:
+            db.query(TestCaseSignature).filter(
+                TestCaseSignature.test_case_id.in_(case_ids)
+            ).delete(synchronize_session="fetch")
+            stats["test_cases"] = db.query(TestCase).filter(
+                TestCase.id.in_(case_ids)
+            ).delete(synchronize_session="fetch")
+    if partial_tps:
+        # 被用户编辑过的用例与测试点解除关联后保留
+        db.query(TestCase).filter(TestCase.test_point_id.in_(partial_tps)).update(
+            {TestCase.test_point_id: None}, synchronize_session="fetch"
+        )
+        stats["test_points"] = db.query(TestPoint).filter(
+            TestPoint.id.in_(partial_tps)
+        ).delete(synchronize_session="fetch")
+    return stats
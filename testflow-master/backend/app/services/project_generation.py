@@ -0,0 +1,462 @@
+"""
+项目批量生成
+一键生成只处理单个模块的单个需求文件。项目批量生成任务按选择的模块/需求文件拆分子任务，
+每个需求文件一个子流程（一次带检查点的一键生成）：
+- 同时执行的子流程数由 bulk_parallel_files 控制；子流程以批量优先级提交给任务管理器，
+  与其他任务共享 max_concurrent_tasks 槽位，单次智能体调用和一键生成优先启动
+- 所有子流程共享一个AI调用并发预算（bulk_llm_call_budget）；按模型的限流器和自适应并发窗口是进程级的，
+  子流程之间本来就共享速率限制
+- 汇总各子任务的进度和已完成子任务的结果
+- 失败的子任务可以单独重试：有检查点时从检查点继续，否则重新执行该文件的一键生成
+- 取消批量任务时同时取消执行中和排队中的子任务，尚未提交的子任务不再执行（可通过重试继续）
+- 批量任务的状态快照（子任务状态、结果）随汇总任务的结果写入任务存储：任意工作进程都能查询，
+  已结束的批量任务可在任意工作进程中重试；本进程只保留执行中的批量任务，结束后从内存中移除
+"""
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+SUB_JOB_STATUSES = ("pending", "running", "completed", "failed", "cancelled")
+# 可以重试的子任务状态
+RETRYABLE_STATUSES = ("failed", "cancelled")
+# 汇总到批量任务结果中的子任务计数
+RESULT_COUNTS = ("requirement_points_count", "test_points_count", "test_cases_count", "optimized_count")
+
+
+@dataclass
+class SubJob:
+    """批量任务中的一个需求文件"""
+    file_id: int
+    module_id: int
+    filename: str
+    status: str = "pending"
+    task_id: Optional[str] = None  # 最近一次执行的一键生成任务ID（也是检查点ID）
+    attempts: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    def progress(self) -> int:
+        if self.status in ("completed", "failed", "cancelled"):
+            return 100
+        if self.status == "pending" or not self.task_id:
+            return 0
+        from app.services.async_task_manager import task_manager
+
+        task = task_manager.get_task(self.task_id)
+        return task.progress if task else 0
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SubJob":
+        return cls(**{key: data.get(key) for key in (
+            "file_id", "module_id", "filename", "status", "task_id", "attempts", "result", "error"
+        )})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "file_id": self.file_id,
+            "module_id": self.module_id,
+            "filename": self.filename,
+            "status": self.status,
+            "task_id": self.task_id,
+            "attempts": self.attempts,
+            "progress": self.progress(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+@dataclass
+class ProjectGenerationJob:
+    """项目批量生成任务"""
+    job_id: str
+    project_id: int
+    user_id: int
+    agent_ids: Dict[str, int]
+    incremental: Optional[bool]
+    sub_jobs: List[SubJob]
+    parallel: int
+    call_budget: int
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    cancelled: bool = False
+
+    def __post_init__(self):
+        self._file_slots = asyncio.Semaphore(self.parallel)
+        self._call_slots = asyncio.Semaphore(self.call_budget)
+
+    @property
+    def status(self) -> str:
+        statuses = {sub.status for sub in self.sub_jobs}
+        if statuses & {"pending", "running"}:
+            return "running"
+        if self.cancelled:
+            return "cancelled"
+        if "failed" in statuses:
+            return "partial_failed" if "completed" in statuses else "failed"
+        return "completed"
+
+    def get(self, file_id: int) -> Optional[SubJob]:
+        return next((sub for sub in self.sub_jobs if sub.file_id == file_id), None)
+
+    def progress(self) -> int:
+        """各需求文件进度的平均值"""
+        if not self.sub_jobs:
+            return 100
+        return int(sum(sub.progress() for sub in self.sub_jobs) / len(self.sub_jobs))
+
+    def summary(self) -> Dict[str, Any]:
+        """子任务状态计数和已完成子任务的结果汇总"""
+        by_status = {s: 0 for s in SUB_JOB_STATUSES}
+        totals = {key: 0 for key in RESULT_COUNTS}
+        for sub in self.sub_jobs:
+            by_status[sub.status] += 1
+            for key in RESULT_COUNTS:
+                totals[key] += (sub.result or {}).get(key) or 0
+        return {"files": len(self.sub_jobs), **by_status, **totals}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "project_id": self.project_id,
+            "user_id": self.user_id,
+            "agent_ids": self.agent_ids,
+            "incremental": self.incremental,
+            "status": self.status,
+            "progress": self.progress(),
+            "parallel": self.parallel,
+            "call_budget": self.call_budget,
+            "summary": self.summary(),
+            "sub_jobs": [sub.to_dict() for sub in self.sub_jobs],
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any], task: Any) -> "ProjectGenerationJob":
+        """由任务存储中的状态快照（to_dict）构造
+
+        汇总任务已结束（如执行它的进程退出后被标记为失败）而快照中仍有未结束的子任务时，
+        这些子任务按失败（或已取消）处理，可以重试
+        """
+        from app.services.async_task_manager import AsyncTaskStatus
+
+        job = cls(
+            job_id=data["job_id"],
+            project_id=data["project_id"],
+            user_id=data["user_id"],
+            agent_ids={key: int(value) for key, value in (data.get("agent_ids") or {}).items()},
+            incremental=data.get("incremental"),
+            sub_jobs=[SubJob.from_dict(item) for item in data.get("sub_jobs") or []],
+            parallel=data["parallel"],
+            call_budget=data["call_budget"],
+            created_at=datetime.fromisoformat(data["created_at"]),
+            finished_at=datetime.fromisoformat(data["finished_at"]) if data.get("finished_at") else None,
+            cancelled=task.status == AsyncTaskStatus.CANCELLED or data.get("status") == "cancelled"
+        )
+        if task.status not in (AsyncTaskStatus.PENDING, AsyncTaskStatus.RUNNING):
+            for sub in job.sub_jobs:
+                if sub.status in ("pending", "running"):
+                    sub.status = "cancelled" if job.cancelled else "failed"
+                    sub.error = sub.error or task.error or "批量任务已中断"
+            job.finished_at = job.finished_at or task.completed_at
+        return job
+
+
+class ProjectGenerationService:
+    """创建、执行和重试项目批量生成任务
+
+    本进程执行中的批量任务保存在内存中，状态快照同时写入任务存储（汇总任务的结果）
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, ProjectGenerationJob] = {}
+
+    def create_job(
+        self,
+        db: Any,
+        project_id: int,
+        user_id: int,
+        agent_ids: Dict[str, int],
+        files: Sequence[Any],
+        incremental: Optional[bool] = None
+    ) -> ProjectGenerationJob:
+        """为选中的需求文件创建批量任务（不执行，执行见 run）"""
+        from app.services.async_task_manager import task_manager
+        from app.services.settings_service import SettingsService
+
+        generation = SettingsService.get_generation_config_cached(db)
+        task_manager.load_config_from_db(db)
+        job_id = task_manager.create_task("project_generation", total_batches=len(files))
+        # 批量任务只汇总子任务，不占用执行槽位（子任务各自排队）
+        task_manager.start_task(job_id, hold_slot=False)
+        job = ProjectGenerationJob(
+            job_id=job_id,
+            project_id=project_id,
+            user_id=user_id,
+            agent_ids=dict(agent_ids),
+            incremental=incremental,
+            sub_jobs=[SubJob(file_id=f.id, module_id=f.module_id, filename=f.filename) for f in files],
+            parallel=generation.bulk_parallel_files,
+            call_budget=generation.bulk_llm_call_budget or task_manager.llm_call_concurrency
+        )
+        self._jobs[job_id] = job
+        task_manager.set_result(job_id, job.to_dict())
+        print(f"📦 [ProjectGeneration] 项目 {project_id} 批量生成任务 {job_id}: {len(files)} 个需求文件，"
+              f"并行 {job.parallel} 个，共享AI调用并发 {job.call_budget}")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[ProjectGenerationJob]:
+        """本进程执行中的批量任务，否则由任务存储中的状态快照构造"""
+        from app.services.async_task_manager import task_manager
+
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        task = task_manager.get_task(job_id)
+        if task is None or task.task_type != "project_generation" or not isinstance(task.result, dict):
+            return None
+        return ProjectGenerationJob.from_snapshot(task.result, task)
+
+    def retry(self, job: ProjectGenerationJob, file_ids: Optional[Iterable[int]] = None) -> List[SubJob]:
+        """把失败或已取消的子任务重新置为待执行（不影响其他子任务），返回需要执行的子任务
+
+        已结束的批量任务由本进程重新打开并继续执行
+
+        Raises:
+            Exception: 批量任务正在其他工作进程中执行，或已被其他请求重新打开
+        """
+        from app.services.async_task_manager import task_manager
+
+        selected = set(file_ids) if file_ids is not None else None
+        retried = [
+            sub for sub in job.sub_jobs
+            if sub.status in RETRYABLE_STATUSES and (selected is None or sub.file_id in selected)
+        ]
+        if not retried:
+            return retried
+        if self._is_terminal(job):
+            if not task_manager.reopen_task(job.job_id):
+                raise Exception("批量任务已被其他请求重新执行")
+            self._jobs[job.job_id] = job
+        elif job.job_id not in self._jobs:
+            raise Exception("批量任务正在其他服务进程中执行，请等待结束后再重试")
+        for sub in retried:
+            sub.status = "pending"
+            sub.error = None
+        job.finished_at = None
+        job.cancelled = False
+        self._report(job)
+        return retried
+
+    def cancel(self, job_id: str) -> Optional[ProjectGenerationJob]:
+        """取消批量任务：取消执行中和排队中的子任务，尚未提交的子任务不再执行
+
+        批量任务本身的状态由调用方通过 task_manager.cancel_task 标记；在其他工作进程中执行的批量任务
+        只取消执行中的子任务，其余子任务由执行它的进程在发现批量任务被取消后处理
+        """
+        from app.services.async_task_manager import task_manager
+
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = self.get_job(job_id)
+            if job is not None:
+                for sub in job.sub_jobs:
+                    if sub.status == "running" and sub.task_id:
+                        task_manager.cancel_task(sub.task_id)
+            return job
+        job.cancelled = True
+        for sub in job.sub_jobs:
+            if sub.status == "pending":
+                sub.status = "cancelled"
+            elif sub.status == "running":
+                sub.status = "cancelled"
+                sub.error = "批量任务已取消"
+                if sub.task_id:
+                    task_manager.cancel_task(sub.task_id)
+        if job.status != "running":
+            job.finished_at = datetime.utcnow()
+        task_manager.set_result(job_id, job.to_dict())
+        print(f"🛑 [ProjectGeneration] 批量生成任务 {job_id} 已取消")
+        return job
+
+    async def run(self, job: ProjectGenerationJob, sub_jobs: Optional[Sequence[SubJob]] = None) -> None:
+        """执行子任务（默认执行所有待执行的子任务），全部结束后更新批量任务状态"""
+        pending = [sub for sub in (sub_jobs if sub_jobs is not None else job.sub_jobs) if sub.status == "pending"]
+        await asyncio.gather(*[self._run_sub_job(job, sub) for sub in pending])
+        self._finish(job)
+
+    async def _run_sub_job(self, job: ProjectGenerationJob, sub: SubJob) -> None:
+        from app.services.async_task_manager import TaskPriority, task_manager
+
+        async with job._file_slots:
+            if sub.status != "pending":
+                # 等待执行时批量任务已被取消
+                return
+            previous_task_id = sub.task_id
+            sub.status = "running"
+            sub.attempts += 1
+            sub.error = None
+            try:
+                task_id = task_manager.new_task_id()
+                resume = self._claim_checkpoint(previous_task_id, task_id) if previous_task_id else False
+                try:
+                    sub.task_id = task_manager.submit(
+                        "one_click_generation",
+                        lambda task_id: self._execute_sub_job(job, sub, task_id, previous_task_id if resume else None),
+                        total_batches=100,
+                        priority=TaskPriority.BULK,
+                        task_id=task_id
+                    )
+                except ValueError:
+                    if resume:
+                        self._release_checkpoint(previous_task_id, task_id)
+                    raise
+                task = await task_manager.wait_task(sub.task_id)
+                if sub.status == "running":
+                    # 在等待队列中或执行中被取消
+                    sub.status = "failed"
+                    sub.error = (task.error if task else None) or "任务已取消"
+            except Exception as e:
+                print(f"❌ [ProjectGeneration] 需求文件 {sub.filename} 提交失败: {e}")
+                sub.status = "failed"
+                sub.error = str(e)
+            finally:
+                self._report(job)
+
+    async def _execute_sub_job(
+        self,
+        job: ProjectGenerationJob,
+        sub: SubJob,
+        task_id: str,
+        resume_from: Optional[str]
+    ) -> None:
+        """执行一个需求文件的一键生成；resume_from 为已占用的检查点时从检查点继续"""
+        from app.database import SessionLocal
+        from app.services.agent_service_real import AgentServiceReal
+        from app.services.async_task_manager import task_manager
+
+        db = SessionLocal()
+        try:
+            service = AgentServiceReal(db=db, call_budget=job._call_slots)
+            if resume_from:
+                print(f"♻️  [ProjectGeneration] 需求文件 {sub.filename} 从检查点继续")
+                result = await service.resume_full_generation_pipeline(resume_from, task_id)
+            else:
+                content, image_paths = self._load_file(db, sub.file_id)
+                result = await service.execute_full_generation_pipeline(
+                    requirement_content=content,
+                    file_id=sub.file_id,
+                    module_id=sub.module_id,
+                    user_id=job.user_id,
+                    agent_ids=job.agent_ids,
+                    image_paths=image_paths,
+                    task_id=task_id,
+                    incremental=job.incremental
+                )
+            if result.get("success"):
+                sub.status = "completed"
+                sub.result = result.get("data")
+            else:
+                sub.status = "failed"
+                sub.error = result.get("error")
+        except Exception as e:
+            print(f"❌ [ProjectGeneration] 需求文件 {sub.filename} 生成失败: {e}")
+            task_manager.fail_task(task_id, str(e))
+            sub.status = "failed"
+            sub.error = str(e)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _claim_checkpoint(previous_task_id: str, task_id: str) -> bool:
+        """上一次执行留下可恢复的检查点时占用它（重试从检查点继续）
+
+        检查点正被其他恢复任务占用时抛出异常，避免同一检查点被恢复两次
+        """
+        from app.database import SessionLocal
+        from app.services.pipeline_checkpoint import PipelineCheckpoint, RESUMABLE_STATUSES, claim_for_resume
+
+        db = SessionLocal()
+        try:
+            previous = PipelineCheckpoint.load(db, previous_task_id)
+            if previous is None or previous.record.status not in RESUMABLE_STATUSES + ("resuming",):
+                return False
+            if not claim_for_resume(db, previous_task_id, task_id):
+                raise Exception("检查点正在被其他任务恢复")
+            return True
+        finally:
+            db.close()
+
+    @staticmethod
+    def _release_checkpoint(previous_task_id: str, task_id: str) -> None:
+        from app.database import SessionLocal
+        from app.services.pipeline_checkpoint import release_claim
+
+        db = SessionLocal()
+        try:
+            release_claim(db, previous_task_id, task_id)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _load_file(db: Any, file_id: int):
+        """需求文件内容和图片路径"""
+        from app.models.requirement import RequirementFile
+        from app.models.requirement_image import RequirementImage
+
+        req_file = db.query(RequirementFile).filter(RequirementFile.id == file_id).first()
+        if req_file is None or not req_file.extracted_content:
+            raise Exception("需求文件不存在或内容为空")
+        images = db.query(RequirementImage).filter(
+            RequirementImage.requirement_file_id == file_id
+        ).order_by(RequirementImage.position_index).all()
+        return req_file.extracted_content, [img.image_path for img in images]
+
+    @staticmethod
+    def _is_terminal(job: ProjectGenerationJob) -> bool:
+        """批量任务本身是否已结束（如已被取消）"""
+        from app.services.async_task_manager import AsyncTaskStatus, task_manager
+
+        task = task_manager.get_task(job.job_id)
+        return task is not None and task.status not in (AsyncTaskStatus.PENDING, AsyncTaskStatus.RUNNING)
+
+    @classmethod
+    def _report(cls, job: ProjectGenerationJob) -> None:
+        from app.services.async_task_manager import task_manager
+
+        if cls._is_terminal(job):
+            return
+        summary = job.summary()
+        task_manager.set_result(job.job_id, job.to_dict())
+        task_manager.update_progress(
+            job.job_id, job.progress(),
+            f"需求文件 {summary['completed']}/{summary['files']} 个完成，失败 {summary['failed']} 个，"
+            f"用例 {summary['test_cases_count']} 个"
+        )
+
+    def _finish(self, job: ProjectGenerationJob) -> None:
+        """所有子任务结束后更新批量任务状态并从内存中移除（重试中的子任务仍在执行时不更新，已取消的不覆盖）"""
+        from app.services.async_task_manager import task_manager
+
+        status = job.status
+        if status == "running":
+            return
+        job.finished_at = job.finished_at or datetime.utcnow()
+        summary = job.summary()
+        if not self._is_terminal(job):
+            if status == "completed":
+                task_manager.complete_task(job.job_id, job.to_dict())
+            else:
+                task_manager.set_result(job.job_id, job.to_dict())
+                task_manager.fail_task(job.job_id, f"{summary['failed']} 个需求文件生成失败，可单独重试")
+        else:
+            task_manager.set_result(job.job_id, job.to_dict())
+        # 之后的查询和重试使用任务存储中的状态快照
+        self._jobs.pop(job.job_id, None)
+        print(f"📦 [ProjectGeneration] 批量生成任务 {job.job_id} 结束（{status}）: 完成 {summary['completed']} 个，"
+              f"失败 {summary['failed']} 个，取消 {summary['cancelled']} 个，用例 {summary['test_cases_count']} 个")
+
+
+# 全局项目批量生成服务实例
+project_generation = ProjectGenerationService()
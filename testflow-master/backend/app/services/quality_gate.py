@@ -0,0 +1,185 @@
+"""
+测试用例质量门禁
+用本地规则为生成的测试用例打分（0-100），只有低于阈值的用例才送去AI优化：
+- 步骤数：没有步骤、只有一步或步骤过多
+- 预期结果：整体预期结果和各步骤的预期都为空
+- 标题与步骤重合：步骤只是复述标题，没有给出具体操作
+- 前置条件缺失
+- 重复步骤、空步骤
+
+打分只看用例本身的结构，不调用模型，单个用例耗时在微秒级
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+# 扣分项：问题代码 -> 扣分
+PENALTIES = {
+    "no_steps": 40,
+    "single_step": 20,
+    "too_many_steps": 10,
+    "empty_step": 10,
+    "missing_expected": 30,
+    "missing_expected_result": 10,
+    "step_expected_missing": 10,
+    "empty_title": 20,
+    "title_step_overlap": 15,
+    "missing_preconditions": 10,
+    "duplicate_steps": 15,
+}
+
+MAX_STEPS = 20
+# 步骤中超过该比例的字符二元组出现在标题中，视为复述标题
+OVERLAP_RATIO = 0.6
+
+_NOISE_RE = re.compile(r"[\s\u3000-\u303f\uff00-\uff0f\uff1a-\uff20\"'`~!@#$%^&*()\-_=+\[\]{};:,.<>/?\\|]+")
+_STEP_PREFIX_RE = re.compile(r"^\s*(?:\d+[.、)）]|步骤\s*\d+[:：]?|[-*•])\s*")
+
+
+@dataclass
+class QualityScore:
+    """单个用例的评分结果"""
+    score: int
+    issues: List[str] = field(default_factory=list)
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "\n".join(_text(v) for v in value)
+    return str(value).strip()
+
+
+def _steps(value: Any) -> List[Tuple[str, str]]:
+    """把 test_steps 统一为 [(操作, 预期)]，兼容字符串和字符串列表"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        lines = [_STEP_PREFIX_RE.sub("", line) for line in value.splitlines()]
+        return [(line.strip(), "") for line in lines if line.strip()]
+    steps = []
+    for step in value:
+        if isinstance(step, dict):
+            action = step.get("action") or step.get("操作") or step.get("description") or ""
+            expected = step.get("expected") or step.get("预期结果") or step.get("expected_result") or ""
+            steps.append((_text(action), _text(expected)))
+        else:
+            steps.append((_text(step), ""))
+    return steps
+
+
+def _bigrams(text: str) -> set:
+    text = _NOISE_RE.sub("", text.lower())
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def score_test_case(case: Dict[str, Any]) -> QualityScore:
+    """按规则为标准化后的测试用例打分"""
+    issues: List[str] = []
+    title = _text(case.get("title"))
+    steps = _steps(case.get("test_steps"))
+
+    if not steps:
+        issues.append("no_steps")
+    elif len(steps) == 1:
+        issues.append("single_step")
+    elif len(steps) > MAX_STEPS:
+        issues.append("too_many_steps")
+
+    actions = [action for action, _ in steps]
+    if any(not action for action in actions):
+        issues.append("empty_step")
+    normalized = [_NOISE_RE.sub("", a.lower()) for a in actions if a]
+    if len(set(normalized)) < len(normalized):
+        issues.append("duplicate_steps")
+
+    expected_result = _text(case.get("expected_result"))
+    step_expected = [expected for _, expected in steps if expected]
+    if not expected_result and not step_expected:
+        issues.append("missing_expected")
+    elif not expected_result:
+        issues.append("missing_expected_result")
+    elif steps and len(step_expected) * 2 < len(steps) and len(steps) > 1:
+        # 多数步骤没有预期，无法逐步判断是否通过
+        issues.append("step_expected_missing")
+
+    if not title:
+        issues.append("empty_title")
+    elif actions:
+        title_grams = _bigrams(title)
+        ratios = []
+        for action in actions:
+            grams = _bigrams(action)
+            if grams:
+                ratios.append(len(grams & title_grams) / len(grams))
+        if ratios and sum(ratios) / len(ratios) >= OVERLAP_RATIO:
+            issues.append("title_step_overlap")
+
+    if not _text(case.get("preconditions")):
+        issues.append("missing_preconditions")
+
+    score = 100 - sum(PENALTIES[issue] for issue in issues)
+    return QualityScore(score=max(0, score), issues=issues)
+
+
+class QualityGate:
+    """按阈值把用例分为需要优化和可跳过两组，并累计统计"""
+
+    BUCKETS = ((0, 39), (40, 59), (60, 69), (70, 79), (80, 89), (90, 100))
+
+    def __init__(self, threshold: int = 80, enabled: bool = True):
+        self.threshold = threshold
+        self.enabled = enabled
+        self._scores: List[int] = []
+        self._skipped = 0
+        self._issues: Dict[str, int] = {}
+
+    def split(self, cases: Sequence[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Returns: (需要优化的用例, 跳过优化的用例)"""
+        if not self.enabled:
+            return list(cases), []
+        to_optimize, skipped = [], []
+        for case in cases:
+            result = score_test_case(case)
+            self._scores.append(result.score)
+            for issue in result.issues:
+                self._issues[issue] = self._issues.get(issue, 0) + 1
+            if result.score < self.threshold:
+                to_optimize.append(case)
+            else:
+                skipped.append(case)
+        self._skipped += len(skipped)
+        return to_optimize, skipped
+
+    def get_stats(self) -> Dict[str, Any]:
+        scored = len(self._scores)
+        ordered = sorted(self._scores)
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "scored": scored,
+            "skipped": self._skipped,
+            "routed": scored - self._skipped,
+            "skip_rate": round(self._skipped / scored, 4) if scored else 0.0,
+            "mean_score": round(sum(ordered) / scored, 1) if scored else None,
+            "median_score": ordered[scored // 2] if scored else None,
+            "min_score": ordered[0] if scored else None,
+            "score_distribution": {
+                f"{low}-{high}": sum(1 for s in ordered if low <= s <= high) for low, high in self.BUCKETS
+            },
+            "issues": dict(sorted(self._issues.items(), key=lambda kv: -kv[1])),
+        }
+
+
+def create_quality_gate(generation_config: Optional[Any] = None) -> QualityGate:
+    """按生成配置创建门禁（未提供配置时使用默认阈值）"""
+    if generation_config is None:
+        return QualityGate()
+    return QualityGate(
+        threshold=generation_config.quality_gate_threshold,
+        enabled=generation_config.quality_gate_enabled
+    )
@@ -0,0 +1,281 @@
+"""
+AI模型限流器
+进程内按AI模型配置（AIModel 记录，见 model_key）共享的限流器，所有任务的AI调用都经过这里：
+- RPM：每分钟请求数（令牌桶）
+- TPM：每分钟token数（令牌桶，调用前按预估输入预扣，调用后补扣输出）
+- 最大并发：同一模型同时在途的请求数（与自适应并发窗口取较小值）
+
+排队的调用按到达顺序（FIFO）依次获得额度，不会因为额度不足直接失败；
+供应商返回429时整个模型暂停 Retry-After 秒，所有排队调用一起等待，避免盲目重试。
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.services.batch_planner import estimate_tokens
+from app.services.concurrency_controller import concurrency_controller
+
+
+# 单张图片按高清模式的典型token数估算
+IMAGE_TOKENS = 765
+
+
+def model_key(ai_model: Any) -> str:
+    """限流器、自适应并发窗口和熔断器使用的模型键
+
+    同一 model_id 可能配置在不同的供应商（base_url、API密钥）下，额度和健康状态各自独立，
+    因此按 AIModel 记录区分，而不是按 model_id
+    """
+    return f"{ai_model.model_id}#{ai_model.id}"
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """估算消息列表的输入token数（图片按固定值估算，不计入base64长度）"""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += estimate_tokens(part.get("text", ""))
+                else:
+                    total += IMAGE_TOKENS
+        total += 4  # 每条消息的角色和分隔符开销
+    return total
+
+
+class _TokenBucket:
+    """令牌桶（容量 = 每分钟额度，按秒匀速补充）"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.refill_rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """获取指定额度需要等待的秒数（超过容量的请求按容量计算，避免永远等待）"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_rate
+
+    def consume(self, amount: float) -> None:
+        """扣除额度（允许为负，后续请求会相应等待更久）"""
+        self.tokens -= amount
+
+
+class ModelRateLimiter:
+    """单个模型的限流器"""
+
+    def __init__(
+        self,
+        key: str,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_in_flight: Optional[int] = None
+    ):
+        self.key = key
+        self._rpm: Optional[_TokenBucket] = None
+        self._tpm: Optional[_TokenBucket] = None
+        self.max_in_flight: Optional[int] = None
+
+        self.in_flight = 0
+        self.waiting = 0
+        self._paused_until = 0.0
+        self._loop = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._slot_freed: Optional[asyncio.Event] = None
+        self.configure(rpm, tpm, max_in_flight)
+
+        # 统计
+        self.total_requests = 0
+        self.total_wait_seconds = 0.0
+        self.rate_limited_count = 0
+
+    def configure(self, rpm: Optional[int], tpm: Optional[int], max_in_flight: Optional[int]) -> None:
+        """更新限额（0或None表示不限制），已消耗的额度按新容量截断"""
+        rpm_bucket = _TokenBucket(rpm) if rpm else None
+        if rpm_bucket and self._rpm:
+            rpm_bucket.tokens = min(self._rpm.tokens, rpm_bucket.capacity)
+        tpm_bucket = _TokenBucket(tpm) if tpm else None
+        if tpm_bucket and self._tpm:
+            tpm_bucket.tokens = min(self._tpm.tokens, tpm_bucket.capacity)
+        self._rpm, self._tpm = rpm_bucket, tpm_bucket
+        self.max_in_flight = max_in_flight or None
+        if self._slot_freed is not None:
+            self._slot_freed.set()
+
+    @property
+    def in_flight_limit(self) -> Optional[int]:
+        """当前生效的并发上限：模型配置的上限与自适应窗口取较小值"""
+        limits = [v for v in (self.max_in_flight, concurrency_controller.window_for(self.key)) if v]
+        return min(limits) if limits else None
+
+    @property
+    def limited(self) -> bool:
+        """是否配置了任何限制"""
+        return bool(
+            self._rpm or self._tpm or self.in_flight_limit
+            or self._paused_until > time.monotonic()
+        )
+
+    def _ensure_primitives(self) -> None:
+        """asyncio原语绑定事件循环，循环变化时（如基准测试多次 asyncio.run）重新创建"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._slot_freed = asyncio.Event()
+
+    def pause(self, seconds: float) -> None:
+        """暂停该模型的所有请求（供应商返回429时调用）"""
+        self.rate_limited_count += 1
+        until = time.monotonic() + max(0.0, seconds)
+        if until > self._paused_until:
+            self._paused_until = until
+            print(f"🚦 [RateLimiter] 模型 {self.key} 被限流，暂停 {seconds:.1f} 秒")
+
+    async def acquire(self, tokens: int) -> None:
+        """获取一次调用的额度（FIFO排队，直到请求数、token数和并发数都满足）"""
+        self.total_requests += 1
+        if not self.limited:
+            self.in_flight += 1
+            return
+
+        self._ensure_primitives()
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            # asyncio.Lock 按等待顺序唤醒：只有队首的调用在等待额度，后到的调用不会插队
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    delay = self._paused_until - now
+                    if self._rpm:
+                        delay = max(delay, self._rpm.wait_time(1, now))
+                    if self._tpm:
+                        delay = max(delay, self._tpm.wait_time(tokens, now))
+
+                    limit = self.in_flight_limit
+                    if limit and self.in_flight >= limit:
+                        # 等待有调用结束（同时兼顾额度恢复时间）
+                        self._slot_freed.clear()
+                        try:
+                            await asyncio.wait_for(self._slot_freed.wait(), timeout=delay if delay > 0 else None)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        continue
+                    break
+
+                if self._rpm:
+                    self._rpm.consume(1)
+                if self._tpm:
+                    self._tpm.consume(tokens)
+                self.in_flight += 1
+        finally:
+            self.waiting -= 1
+            self.total_wait_seconds += time.monotonic() - start
+
+    def release(self, extra_tokens: int = 0) -> None:
+        """释放调用占用的并发额度，并补扣输出token"""
+        self.in_flight = max(0, self.in_flight - 1)
+        if extra_tokens and self._tpm:
+            self._tpm.consume(extra_tokens)
+        if self._slot_freed is not None:
+            self._slot_freed.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "model": self.key,
+            "rpm_limit": int(self._rpm.capacity) if self._rpm else None,
+            "tpm_limit": int(self._tpm.capacity) if self._tpm else None,
+            "max_in_flight": self.max_in_flight,
+            "in_flight_limit": self.in_flight_limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "paused_seconds": round(max(0.0, self._paused_until - now), 2),
+            "total_requests": self.total_requests,
+            "avg_wait_seconds": round(self.total_wait_seconds / self.total_requests, 3) if self.total_requests else 0.0,
+            "rate_limited_count": self.rate_limited_count,
+        }
+
+
+class RatePermit:
+    """一次调用的额度凭证，调用结束后记录实际输出token"""
+
+    def __init__(self, limiter: ModelRateLimiter):
+        self.limiter = limiter
+        self.output_tokens = 0
+
+    def record_output(self, content: str) -> None:
+        self.output_tokens = estimate_tokens(content)
+
+
+class RateLimiterRegistry:
+    """按模型键（model_key）管理限流器"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ModelRateLimiter] = {}
+
+    def get(self, model: str) -> ModelRateLimiter:
+        """获取（或创建不限流的）模型限流器"""
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = ModelRateLimiter(model)
+            self._limiters[model] = limiter
+        return limiter
+
+    def configure(
+        self,
+        model: str,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_in_flight: Optional[int] = None
+    ) -> None:
+        """设置模型限额（限额未变化时不重置令牌桶）"""
+        limiter = self.get(model)
+        current = limiter.get_stats()
+        if (current["rpm_limit"], current["tpm_limit"], current["max_in_flight"]) != (rpm or None, tpm or None, max_in_flight or None):
+            limiter.configure(rpm, tpm, max_in_flight)
+
+    def configure_from_models(self, models: Iterable[Any]) -> None:
+        """从 AIModel 记录加载限额"""
+        for model in models:
+            self.configure(model_key(model), model.rpm_limit, model.tpm_limit, model.max_in_flight)
+
+    @asynccontextmanager
+    async def limit(self, model: str, input_tokens: int):
+        """限流上下文：进入时排队获取额度，退出时释放并发并补扣输出token
+
+        Example:
+            async with rate_limiter.limit("gpt-4o", 1200) as permit:
+                content = await do_request()
+                permit.record_output(content)
+        """
+        limiter = self.get(model)
+        await limiter.acquire(input_tokens)
+        permit = RatePermit(limiter)
+        try:
+            yield permit
+        finally:
+            limiter.release(permit.output_tokens)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        return [limiter.get_stats() for limiter in self._limiters.values()]
+
+
+# 全局限流器实例
+rate_limiter = RateLimiterRegistry()
@@ -0,0 +1,295 @@
+"""
+需求文档检索索引（jieba 分词 + BM25）
+- 文档提取后按标题切分为分段，分词结果持久化到 requirement_segments 表
+- 按模块在内存中构建 BM25 索引（文档内容变化时自动重建）
+- 用例设计、测试点生成阶段按测试点/需求点检索最相关的 top-k 分段，
+  提示词大小不再随需求文档长度增长
+"""
+import hashlib
+import logging
+import math
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import jieba
+
+from app.services.batch_planner import estimate_tokens
+
+jieba.setLogLevel(logging.WARNING)
+
+
+# 标题行：Markdown标题、"1.2 xxx"、"一、xxx"、"第一章 xxx"、多文档拼接时的文件标记
+_HEADING_RE = re.compile(
+    r"^\s*(#{1,6}\s+\S.*"
+    r"|\d+(\.\d+)*[\.、\s]\s*\S.{0,60}"
+    r"|[一二三四五六七八九十百]+[、.．]\s*\S.{0,60}"
+    r"|第[一二三四五六七八九十百\d]+[章节条部分篇]\s*.{0,60}"
+    r"|【需求文档：.+】)\s*$"
+)
+# 有检索意义的词：包含中文、字母或至少两位数字
+_TERM_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaffA-Za-z]|\d{2,}")
+_STOPWORDS = frozenset(
+    "的 了 和 与 或 及 是 在 为 对 等 中 将 把 被 由 从 到 以 于 可 应 需 该 其 并 且 则 如 若 时 后 前 "
+    "进行 可以 需要 应该 能够 支持 包括 包含 相关 以及 通过 如果 系统 用户 功能 验证 测试 "
+    "the a an of to and or in on for is are be with".split()
+)
+
+# 单个分段的token上限，超过时按段落切块（块继承章节标题）
+MAX_SEGMENT_TOKENS = 800
+
+
+def tokenize(text: str) -> List[str]:
+    """分词（搜索引擎模式），去掉标点、停用词，英文转小写"""
+    terms = []
+    for word in jieba.lcut_for_search(text or ""):
+        word = word.strip().lower()
+        if word and word not in _STOPWORDS and _TERM_RE.search(word):
+            terms.append(word)
+    return terms
+
+
+def term_counts(text: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for term in tokenize(text):
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+class Segment:
+    """文档分段"""
+
+    def __init__(
+        self,
+        order: int,
+        heading: str,
+        text: str,
+        terms: Optional[Dict[str, int]] = None,
+        tokens: Optional[int] = None,
+        file_id: Optional[int] = None
+    ):
+        self.order = order
+        self.heading = heading
+        self.text = text
+        self.tokens = estimate_tokens(text) if tokens is None else tokens
+        self.terms = term_counts(text) if terms is None else terms
+        self.length = sum(self.terms.values())
+        self.file_id = file_id
+
+
+def split_sections(content: str, max_segment_tokens: int = MAX_SEGMENT_TOKENS) -> List[Tuple[str, str]]:
+    """按标题行切分文档，过长的章节按段落继续切块
+
+    Returns:
+        [(标题, 分段文本), ...]，按原文顺序
+    """
+    raw: List[List[str]] = []
+    headings: List[str] = []
+    current: List[str] = []
+    has_body = False  # 连续的标题行（如文件标记 + 一级标题）合并到同一章节
+    heading = ""
+    for line in (content or "").splitlines():
+        is_heading = bool(_HEADING_RE.match(line))
+        if is_heading and has_body:
+            raw.append(current)
+            headings.append(heading)
+            current, has_body = [], False
+        if is_heading:
+            heading = line.strip()
+        elif line.strip():
+            has_body = True
+        current.append(line)
+    if current and any(l.strip() for l in current):
+        raw.append(current)
+        headings.append(heading)
+
+    sections: List[Tuple[str, str]] = []
+    for lines, head in zip(raw, headings):
+        text = "\n".join(lines).strip()
+        if estimate_tokens(text) <= max_segment_tokens:
+            sections.append((head, text))
+            continue
+        chunk: List[str] = []
+        chunk_tokens = 0
+        for para in re.split(r"\n\s*\n", text):
+            para_tokens = estimate_tokens(para)
+            if chunk and chunk_tokens + para_tokens > max_segment_tokens:
+                sections.append((head, _with_heading(head, "\n\n".join(chunk))))
+                chunk, chunk_tokens = [], 0
+            chunk.append(para)
+            chunk_tokens += para_tokens
+        if chunk:
+            sections.append((head, _with_heading(head, "\n\n".join(chunk))))
+    return sections
+
+
+def _with_heading(head: str, body: str) -> str:
+    if head and not body.startswith(head):
+        return f"{head}（续）\n{body}"
+    return body
+
+
+def build_segments(content: str) -> List[Segment]:
+    """切分文档并分词"""
+    return [Segment(i, head, text) for i, (head, text) in enumerate(split_sections(content))]
+
+
+class BM25Index:
+    """BM25 检索索引
+
+    Example:
+        >>> index = BM25Index(build_segments(content))
+        >>> [seg.heading for _, seg in index.search("密码错误锁定", top_k=3)]
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, segments: Sequence[Segment]):
+        self.segments = list(segments)
+        n = len(self.segments)
+        self.avg_length = (sum(s.length for s in self.segments) / n) if n else 0.0
+        df: Dict[str, int] = {}
+        for segment in self.segments:
+            for term in segment.terms:
+                df[term] = df.get(term, 0) + 1
+        self._idf = {t: math.log(1 + (n - d + 0.5) / (d + 0.5)) for t, d in df.items()}
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(s.tokens for s in self.segments)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[float, Segment]]:
+        """检索与查询最相关的分段（按得分从高到低，不含零分分段）"""
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.segments:
+            return []
+        scored = []
+        for segment in self.segments:
+            score = 0.0
+            norm = self.K1 * (1 - self.B + self.B * segment.length / (self.avg_length or 1.0))
+            for term in query_terms:
+                tf = segment.terms.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.K1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((score, segment))
+        scored.sort(key=lambda x: -x[0])
+        return scored[:top_k]
+
+    def retrieve(self, queries: Sequence[str], top_k: int, max_tokens: int) -> List[Segment]:
+        """为多个查询分别取 top-k 分段，合并后按得分装入token预算，按原文顺序返回"""
+        best: Dict[int, Tuple[float, Segment]] = {}
+        for query in queries:
+            for score, segment in self.search(query, top_k):
+                key = id(segment)
+                if key not in best or best[key][0] < score:
+                    best[key] = (score, segment)
+        selected: List[Segment] = []
+        used = 0
+        for _, segment in sorted(best.values(), key=lambda x: -x[0]):
+            if used + segment.tokens > max_tokens:
+                continue
+            selected.append(segment)
+            used += segment.tokens
+        selected.sort(key=lambda s: (s.file_id or 0, s.order))
+        return selected
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+
+
+class RequirementIndexService:
+    """需求文档分段持久化和模块级索引缓存"""
+
+    def __init__(self):
+        self._indexes: Dict[int, Tuple[Tuple, BM25Index]] = {}
+        self._lock = threading.Lock()
+
+    def index_file(self, db: Any, req_file: Any, commit: bool = True) -> int:
+        """切分并保存需求文件的分段（已存在的分段会被替换），返回分段数"""
+        from app.models.requirement_segment import RequirementSegment
+
+        db.query(RequirementSegment).filter(
+            RequirementSegment.requirement_file_id == req_file.id
+        ).delete(synchronize_session=False)
+
+        content = req_file.extracted_content or ""
+        digest = content_hash(content)
+        segments = build_segments(f"【需求文档：{req_file.filename}】\n{content}") if content else []
+        for segment in segments:
+            db.add(RequirementSegment(
+                requirement_file_id=req_file.id,
+                segment_index=segment.order,
+                heading=(segment.heading or None) and segment.heading[:500],
+                content=segment.text,
+                token_count=segment.tokens,
+                terms=segment.terms,
+                content_hash=digest
+            ))
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+        if req_file.module_id is not None:
+            self.invalidate(req_file.module_id)
+        print(f"🔎 [RequirementIndex] 文件 {req_file.filename} 已切分为 {len(segments)} 个分段")
+        return len(segments)
+
+    def invalidate(self, module_id: int) -> None:
+        with self._lock:
+            self._indexes.pop(module_id, None)
+
+    def get_module_index(self, db: Any, module_id: int) -> Optional[BM25Index]:
+        """获取模块的BM25索引（未分段或内容已变化的文件会先重新分段）"""
+        from app.models.requirement import RequirementFile
+        from app.models.requirement_segment import RequirementSegment
+
+        files = db.query(RequirementFile).filter(
+            RequirementFile.module_id == module_id,
+            RequirementFile.is_extracted == True
+        ).order_by(RequirementFile.id).all()
+        files = [f for f in files if f.extracted_content]
+        if not files:
+            return None
+
+        hashes = {f.id: content_hash(f.extracted_content) for f in files}
+        signature = tuple(sorted(hashes.items()))
+        cached = self._indexes.get(module_id)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        rows = db.query(RequirementSegment).filter(
+            RequirementSegment.requirement_file_id.in_(list(hashes))
+        ).order_by(RequirementSegment.requirement_file_id, RequirementSegment.segment_index).all()
+        by_file: Dict[int, List[Any]] = {}
+        for row in rows:
+            by_file.setdefault(row.requirement_file_id, []).append(row)
+
+        segments: List[Segment] = []
+        for f in files:
+            file_rows = by_file.get(f.id, [])
+            if not file_rows or file_rows[0].content_hash != hashes[f.id]:
+                # 旧数据或内容已修改：重新分段（不提交，交给调用方的会话）
+                self.index_file(db, f, commit=False)
+                file_rows = db.query(RequirementSegment).filter(
+                    RequirementSegment.requirement_file_id == f.id
+                ).order_by(RequirementSegment.segment_index).all()
+            segments.extend(
+                Segment(r.segment_index, r.heading or "", r.content, terms=r.terms, tokens=r.token_count, file_id=f.id)
+                for r in file_rows
+            )
+
+        index = BM25Index(segments)
+        with self._lock:
+            self._indexes[module_id] = (signature, index)
+        print(f"🔎 [RequirementIndex] 模块 {module_id} 索引: {len(files)} 个文件, {len(segments)} 个分段")
+        return index
+
+
+# 全局需求文档索引实例
+requirement_index = RequirementIndexService()
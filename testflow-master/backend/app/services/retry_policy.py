@@ -0,0 +1,201 @@
+"""
+AI调用重试策略
+按错误类型决定是否重试、重试几次以及退避时间：
+- network / server_error：指数退避 + 随机抖动
+- timeout：单次调用已经很耗时，最多重试少量次数
+- rate_limited（429）：按 Retry-After 等待（限流器同时暂停该模型的所有调用）
+- client_error（其他4xx）：请求本身有问题，重试无意义
+- json_parse：模型输出格式错误，换一次采样通常可以恢复，只重试一次
+- truncated：相同请求重试仍会截断，交给调用方缩小批次
+
+每个任务（AgentServiceReal 实例）共享一份重试预算（总重试次数、连续失败的持续时间），
+避免单个任务在供应商故障时无限拖长；每次失败的尝试都会记录下来用于统计。
+持续时间按墙钟时间从本轮第一次失败算起，并行调用的失败不会重复计入，任一调用成功后重新计时。
+"""
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.core.ai_client import (
+    AIRequestError, AIResponseParseError, AIResponseTruncatedError, AITimeoutError
+)
+
+
+class ErrorClass(str, Enum):
+    """AI调用错误类型"""
+    NETWORK = "network"
+    TIMEOUT = "timeout"
+    RATE_LIMITED = "rate_limited"
+    SERVER_ERROR = "server_error"
+    CLIENT_ERROR = "client_error"
+    JSON_PARSE = "json_parse"
+    TRUNCATED = "truncated"
+    UNKNOWN = "unknown"
+
+
+def classify_error(error: BaseException) -> ErrorClass:
+    """判断错误类型"""
+    if isinstance(error, AIResponseTruncatedError):
+        return ErrorClass.TRUNCATED
+    if isinstance(error, AIResponseParseError):
+        return ErrorClass.JSON_PARSE
+    if isinstance(error, (AITimeoutError, asyncio.TimeoutError, httpx.TimeoutException)):
+        return ErrorClass.TIMEOUT
+    if isinstance(error, AIRequestError):
+        if error.status_code == 429:
+            return ErrorClass.RATE_LIMITED
+        if error.status_code >= 500 or error.status_code == 408:
+            return ErrorClass.SERVER_ERROR
+        return ErrorClass.CLIENT_ERROR
+    if isinstance(error, httpx.TransportError):
+        return ErrorClass.NETWORK
+    return ErrorClass.UNKNOWN
+
+
+@dataclass
+class RetryPolicy:
+    """单类错误的重试策略
+
+    max_retries 为 None 时使用系统设置中的 retry_count
+    """
+    retryable: bool = True
+    max_retries: Optional[int] = None
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+
+    def backoff(self, retry_index: int, retry_after: Optional[float] = None) -> float:
+        """第 retry_index 次重试前的等待时间（full jitter；有 Retry-After 时不早于它）"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry_index)))
+        if retry_after is not None:
+            # 在 Retry-After 之后加少量抖动，避免所有排队调用同时恢复
+            delay = retry_after + random.uniform(0, min(1.0, retry_after * 0.1 + 0.1))
+        return delay
+
+
+DEFAULT_POLICIES: Dict[ErrorClass, RetryPolicy] = {
+    ErrorClass.NETWORK: RetryPolicy(base_delay=1.0),
+    ErrorClass.TIMEOUT: RetryPolicy(max_retries=1, base_delay=2.0),
+    ErrorClass.RATE_LIMITED: RetryPolicy(base_delay=2.0, max_delay=60.0),
+    ErrorClass.SERVER_ERROR: RetryPolicy(base_delay=1.0),
+    ErrorClass.CLIENT_ERROR: RetryPolicy(retryable=False),
+    ErrorClass.JSON_PARSE: RetryPolicy(max_retries=1, base_delay=0.5, max_delay=2.0),
+    ErrorClass.TRUNCATED: RetryPolicy(retryable=False),
+    ErrorClass.UNKNOWN: RetryPolicy(base_delay=1.0),
+}
+
+
+@dataclass
+class RetryAttempt:
+    """一次失败的调用尝试"""
+    label: str
+    model: str
+    attempt: int
+    error_class: str
+    error: str
+    elapsed: float
+    delay: float
+    retried: bool
+    timestamp: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "model": self.model,
+            "attempt": self.attempt,
+            "error_class": self.error_class,
+            "error": self.error,
+            "elapsed": round(self.elapsed, 3),
+            "delay": round(self.delay, 3),
+            "retried": self.retried,
+            "timestamp": self.timestamp,
+        }
+
+
+class RetryBudget:
+    """任务级重试预算：总重试次数和连续失败的持续时间（从本轮第一次失败算起，含退避等待）"""
+
+    MAX_RECORDED_ATTEMPTS = 200
+
+    def __init__(self, max_retries: int = 30, max_seconds: float = 300.0):
+        self.max_retries = max_retries
+        self.max_seconds = max_seconds
+        self.retries = 0
+        self.failing_since: Optional[float] = None
+        self.attempts: List[RetryAttempt] = []
+
+    def failing_seconds(self) -> float:
+        """本轮连续失败已持续的时间"""
+        return 0.0 if self.failing_since is None else time.monotonic() - self.failing_since
+
+    def can_retry(self, delay: float) -> bool:
+        """是否还有预算再重试一次（退避等待结束时仍不能超过持续时间上限）"""
+        return self.retries < self.max_retries and self.failing_seconds() + delay <= self.max_seconds
+
+    def record(self, attempt: RetryAttempt) -> None:
+        if self.failing_since is None:
+            self.failing_since = time.monotonic()
+        if attempt.retried:
+            self.retries += 1
+        if len(self.attempts) < self.MAX_RECORDED_ATTEMPTS:
+            self.attempts.append(attempt)
+
+    def record_success(self) -> None:
+        """调用成功，连续失败重新计时"""
+        self.failing_since = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries,
+            "max_retries": self.max_retries,
+            "failing_seconds": round(self.failing_seconds(), 2),
+            "max_seconds": self.max_seconds,
+            "failed_attempts": len(self.attempts),
+        }
+
+
+class RetryStats:
+    """进程内的重试统计（按错误类型汇总）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures: Dict[str, int] = {}
+        self._retries: Dict[str, int] = {}
+        self.recovered = 0
+        self.gave_up = 0
+        self.budget_exhausted = 0
+
+    def record_attempt(self, attempt: RetryAttempt) -> None:
+        with self._lock:
+            self._failures[attempt.error_class] = self._failures.get(attempt.error_class, 0) + 1
+            if attempt.retried:
+                self._retries[attempt.error_class] = self._retries.get(attempt.error_class, 0) + 1
+
+    def record_recovered(self) -> None:
+        with self._lock:
+            self.recovered += 1
+
+    def record_gave_up(self, budget_exhausted: bool) -> None:
+        with self._lock:
+            self.gave_up += 1
+            if budget_exhausted:
+                self.budget_exhausted += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "failures_by_class": dict(self._failures),
+                "retries_by_class": dict(self._retries),
+                "recovered": self.recovered,
+                "gave_up": self.gave_up,
+                "budget_exhausted": self.budget_exhausted,
+            }
+
+
+# 全局重试统计实例
+retry_stats = RetryStats()
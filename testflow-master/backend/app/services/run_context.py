@@ -0,0 +1,141 @@
+"""
+任务运行上下文
+每个生成任务开始时构建一次，之后各阶段、各批次共用，不再重复查询数据库：
+- 已解析的智能体配置（模型、调用端点、系统提示词）
+- 渲染好的测试类别 / 设计方法文本
+- 并发配置和生成配置
+- 模块的需求文档内容
+
+系统设置通过进程内的 settings_cache 读取（设置写入后或超过 settings_cache_ttl 后失效）；
+上下文构建后不再变化，任务执行期间修改的设置从下一个任务开始生效
+"""
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional
+
+from sqlalchemy.orm import Session
+
+from app.schemas.settings import ConcurrencyConfig, GenerationConfig
+from app.services.settings_service import SettingsService, settings_cache
+
+
+DEFAULT_CATEGORIES_TEXT = "- functional: 功能测试\n- performance: 性能测试\n- security: 安全测试"
+DEFAULT_DESIGN_METHODS_TEXT = "- equivalence_partitioning: 等价类划分法\n- boundary_value: 边界值分析法\n- scenario: 场景法"
+
+
+@dataclass(frozen=True)
+class RunContext:
+    """一次生成任务的只读上下文"""
+    run_id: Optional[str]
+    user_id: Optional[int]
+    concurrency: ConcurrencyConfig
+    generation: GenerationConfig
+    categories_text: str
+    design_methods_text: str
+    agent_configs: Mapping[int, Mapping[str, Any]] = field(default_factory=lambda: MappingProxyType({}))
+    module_id: Optional[int] = None
+    requirement_content: Optional[str] = None  # 模块需求文档内容（未指定模块时为 None）
+
+    def covers(self, run_id: Optional[str], agent_ids: Iterable[Optional[int]], module_id: Optional[int]) -> bool:
+        """是否可以直接用于指定的任务（同一任务的嵌套阶段复用上下文）"""
+        if run_id is None or run_id != self.run_id:
+            return False
+        if module_id is not None and module_id != self.module_id:
+            return False
+        return all(agent_id in self.agent_configs for agent_id in agent_ids if agent_id is not None)
+
+
+def get_categories_text(db: Optional[Session]) -> str:
+    """启用的测试类别文本（进程内缓存）"""
+    if db is None:
+        return DEFAULT_CATEGORIES_TEXT
+
+    def load() -> str:
+        categories = SettingsService.get_test_categories(db, active_only=True)
+        if not categories:
+            return DEFAULT_CATEGORIES_TEXT
+        return "\n".join([f"- {c.code}: {c.name}" for c in categories])
+
+    return settings_cache.get("test_categories_text", load)
+
+
+def get_design_methods_text(db: Optional[Session]) -> str:
+    """启用的测试设计方法文本（包含code和name，便于AI返回正确的code，进程内缓存）"""
+    if db is None:
+        return DEFAULT_DESIGN_METHODS_TEXT
+
+    def load() -> str:
+        methods = SettingsService.get_design_methods(db, active_only=True)
+        if not methods:
+            return DEFAULT_DESIGN_METHODS_TEXT
+        return "\n".join([f"- {m.code}: {m.name}" for m in methods])
+
+    return settings_cache.get("design_methods_text", load)
+
+
+def load_module_requirement_content(db: Session, module_id: int) -> str:
+    """拼接模块下所有已提取的需求文档内容"""
+    from app.models.requirement import RequirementFile
+
+    try:
+        requirement_files = db.query(RequirementFile).filter(
+            RequirementFile.module_id == module_id,
+            RequirementFile.is_extracted == True
+        ).all()
+    except Exception as e:
+        print(f"⚠️ 查询需求文档失败: {e}")
+        return ""
+
+    if not requirement_files:
+        print(f"⚠️ 模块 {module_id} 没有找到需求文档")
+        return ""
+    content_parts = []
+    for file in requirement_files:
+        if file.extracted_content:
+            content_parts.append(f"【需求文档：{file.filename}】\n{file.extracted_content}")
+    print(f"📄 已加载 {len(requirement_files)} 个需求文档作为上下文")
+    return "\n\n---\n\n".join(content_parts)
+
+
+def build_run_context(
+    db: Optional[Session],
+    run_id: Optional[str],
+    user_id: Optional[int],
+    agent_ids: Iterable[Optional[int]],
+    resolve_agent: Callable[[int], Dict[str, Any]],
+    module_id: Optional[int] = None
+) -> RunContext:
+    """构建任务上下文
+
+    Args:
+        resolve_agent: 解析智能体配置的函数；解析失败的智能体不放入上下文，
+            使用该智能体的阶段执行时会重新解析并报告同样的错误
+    """
+    if db is not None:
+        concurrency = SettingsService.get_concurrency_config_cached(db)
+        generation = SettingsService.get_generation_config_cached(db)
+    else:
+        concurrency, generation = ConcurrencyConfig(), GenerationConfig()
+
+    agent_configs: Dict[int, Mapping[str, Any]] = {}
+    for agent_id in dict.fromkeys(a for a in agent_ids if a is not None):
+        try:
+            agent_configs[agent_id] = MappingProxyType(resolve_agent(agent_id))
+        except Exception as e:
+            print(f"⚠️ [RunContext] 智能体 {agent_id} 配置解析失败: {e}")
+
+    requirement_content = None
+    if db is not None and module_id is not None:
+        requirement_content = load_module_requirement_content(db, module_id)
+
+    return RunContext(
+        run_id=run_id,
+        user_id=user_id,
+        concurrency=concurrency,
+        generation=generation,
+        categories_text=get_categories_text(db),
+        design_methods_text=get_design_methods_text(db),
+        agent_configs=MappingProxyType(agent_configs),
+        module_id=module_id,
+        requirement_content=requirement_content
+    )
@@ -1,17 +1,20 @@
 """
 系统设置服务层
-提供测试分类、测试设计方法和并发配置的CRUD操作
+提供测试分类、测试设计方法、并发配置和生成配置的CRUD操作
 """
-from typing import List, Optional
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException
 
+from app.config import settings
 from app.models.settings import TestCategory, TestDesignMethod, SystemConfig
 from app.schemas.settings import (
     TestCategoryCreate, TestCategoryUpdate, TestCategoryResponse,
     TestDesignMethodCreate, TestDesignMethodUpdate, TestDesignMethodResponse,
-    ConcurrencyConfig
+    ConcurrencyConfig, GenerationConfig
 )
 
 
@@ -52,6 +55,70 @@ DEFAULT_DESIGN_METHODS = [
 # 并发配置键
 CONCURRENCY_CONFIG_KEY = "concurrency_config"
 
+# 生成配置键
+GENERATION_CONFIG_KEY = "generation_config"
+GENERATION_CONFIG_DESCRIPTION = "测试用例生成配置（批次规划、需求上下文、流水线、质量门禁、去重、增量生成、批量生成）"
+
+
+class SettingsCache:
+    """进程内系统设置缓存
+    
+    生成任务在每次请求、每个阶段都会读取系统设置；设置只在管理接口中修改，
+    因此缓存到进程内，由 SettingsService 的写入方法在提交后调用 invalidate() 失效。
+    invalidate() 只作用于执行写入的工作进程，缓存内容超过 settings_cache_ttl 后整体失效，
+    其他进程修改的设置最迟在该时间后生效
+    
+    Args:
+        ttl: 缓存有效期（秒），默认使用 settings.settings_cache_ttl，0表示不过期
+    """
+    
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self._values: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._loaded_at: Optional[float] = None  # 当前缓存内容中最早一项的加载时间
+    
+    @property
+    def version(self) -> int:
+        """每次失效（包括过期）加1，读取方可据此判断是否需要重新读取设置"""
+        with self._lock:
+            self._expire()
+            return self._version
+    
+    def _expire(self) -> None:
+        ttl = settings.settings_cache_ttl if self.ttl is None else self.ttl
+        if ttl and self._loaded_at is not None and time.monotonic() - self._loaded_at >= ttl:
+            self._values.clear()
+            self._loaded_at = None
+            self._version += 1
+    
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        """读取缓存，未命中时调用 loader 加载"""
+        with self._lock:
+            self._expire()
+            if key in self._values:
+                return self._values[key]
+            version = self._version
+        value = loader()
+        with self._lock:
+            # 加载期间设置被修改时不写入旧值
+            if version == self._version:
+                self._values[key] = value
+                if self._loaded_at is None:
+                    self._loaded_at = time.monotonic()
+        return value
+    
+    def invalidate(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self._loaded_at = None
+            self._version += 1
+
+
+# 全局设置缓存实例
+settings_cache = SettingsCache()
+
 
 class SettingsService:
     """系统设置服务类"""
@@ -118,6 +185,7 @@ class SettingsService:
         try:
             db.add(category)
             db.commit()
+            settings_cache.invalidate()
             db.refresh(category)
             return category
         except IntegrityError:
@@ -162,6 +230,7 @@ class SettingsService:
         
         try:
             db.commit()
+            settings_cache.invalidate()
             db.refresh(category)
             return category
         except IntegrityError:
@@ -195,6 +264,7 @@ class SettingsService:
         # 非默认数据真实删除
         db.delete(category)
         db.commit()
+        settings_cache.invalidate()
         return True
     
     @staticmethod
@@ -234,6 +304,7 @@ class SettingsService:
                 category.is_active = default_config_map.get(category.code, True)
         
         db.commit()
+        settings_cache.invalidate()
         return SettingsService.get_test_categories(db)
     
     # ============== Test Design Methods ==============
@@ -298,6 +369,7 @@ class SettingsService:
         try:
             db.add(method)
             db.commit()
+            settings_cache.invalidate()
             db.refresh(method)
             return method
         except IntegrityError:
@@ -342,6 +414,7 @@ class SettingsService:
         
         try:
             db.commit()
+            settings_cache.invalidate()
             db.refresh(method)
             return method
         except IntegrityError:
@@ -375,6 +448,7 @@ class SettingsService:
         # 非默认数据真实删除
         db.delete(method)
         db.commit()
+        settings_cache.invalidate()
         return True
     
     @staticmethod
@@ -413,6 +487,7 @@ class SettingsService:
                 method.is_active = True
         
         db.commit()
+        settings_cache.invalidate()
         return SettingsService.get_design_methods(db)
     
     # ============== Concurrency Config ==============
@@ -465,6 +540,75 @@ class SettingsService:
             db.add(new_config)
         
         db.commit()
+        settings_cache.invalidate()
+        return config
+    
+    # ============== Generation Config ==============
+    
+    @staticmethod
+    def get_generation_config(db: Session) -> GenerationConfig:
+        """获取生成配置
+        
+        Args:
+            db: 数据库会话
+            
+        Returns:
+            生成配置对象，如果不存在返回默认配置
+        """
+        config = db.query(SystemConfig).filter(
+            SystemConfig.config_key == GENERATION_CONFIG_KEY
+        ).first()
+        
+        if config:
+            return GenerationConfig(**config.config_value)
+        
+        # 返回默认配置
+        return GenerationConfig()
+    
+    @staticmethod
+    def get_concurrency_config_cached(db: Session) -> ConcurrencyConfig:
+        """获取并发配置（进程内缓存，返回副本）"""
+        return settings_cache.get(
+            CONCURRENCY_CONFIG_KEY, lambda: SettingsService.get_concurrency_config(db)
+        ).model_copy()
+    
+    @staticmethod
+    def get_generation_config_cached(db: Session) -> GenerationConfig:
+        """获取生成配置（进程内缓存，返回副本）"""
+        return settings_cache.get(
+            GENERATION_CONFIG_KEY, lambda: SettingsService.get_generation_config(db)
+        ).model_copy()
+    
+    @staticmethod
+    def update_generation_config(db: Session, config: GenerationConfig) -> GenerationConfig:
+        """更新生成配置
+        
+        Args:
+            db: 数据库会话
+            config: 新的生成配置
+            
+        Returns:
+            更新后的生成配置
+        """
+        existing = db.query(SystemConfig).filter(
+            SystemConfig.config_key == GENERATION_CONFIG_KEY
+        ).first()
+        
+        config_value = config.model_dump()
+        
+        if existing:
+            existing.config_value = config_value
+            existing.description = GENERATION_CONFIG_DESCRIPTION
+        else:
+            new_config = SystemConfig(
+                config_key=GENERATION_CONFIG_KEY,
+                config_value=config_value,
+                description=GENERATION_CONFIG_DESCRIPTION
+            )
+            db.add(new_config)
+        
+        db.commit()
+        settings_cache.invalidate()
         return config
     
     # ============== Initialization ==============
@@ -527,7 +671,21 @@ class SettingsService:
             )
             db.add(new_config)
         
+        # 初始化默认生成配置
+        existing_generation = db.query(SystemConfig).filter(
+            SystemConfig.config_key == GENERATION_CONFIG_KEY
+        ).first()
+        
+        if not existing_generation:
+            new_config = SystemConfig(
+                config_key=GENERATION_CONFIG_KEY,
+                config_value=GenerationConfig().model_dump(),
+                description=GENERATION_CONFIG_DESCRIPTION
+            )
+            db.add(new_config)
+        
         db.commit()
+        settings_cache.invalidate()
 
 
 # 导出服务实例
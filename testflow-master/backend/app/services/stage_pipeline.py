@@ -0,0 +1,116 @@
+"""
+流式阶段流水线
+每个阶段由一个有界队列和固定数量的工作协程组成，处理函数把产出直接放入下一阶段的队列：
+- 某个需求点的测试点生成完后立即进入用例设计，设计完的批次立即进入优化，
+  整体耗时接近最长的一条链路，而不是各阶段最慢任务之和
+- 队列有界：下游处理不过来时上游在 put 处等待（背压），不会一次性积压全部中间结果
+- 处理函数抛出的异常只记录日志和统计，不中断流水线
+- 上一阶段的全部工作协程退出后才关闭下一阶段，保证不会丢失在途的产出
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+_STOP = object()
+
+
+class Stage:
+    """流水线中的一个阶段"""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int = 1,
+        queue_size: int = 16
+    ):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._origin = time.perf_counter()
+        self.stats: Dict[str, Any] = {
+            "processed": 0,
+            "failed": 0,
+            "busy_seconds": 0.0,
+            "max_queue": 0,
+            "first_started": None,  # 相对流水线开始的秒数
+            "first_done": None,
+            "last_done": None,
+        }
+
+    async def put(self, item: Any) -> None:
+        """放入一个待处理项（队列已满时等待）"""
+        await self.queue.put(item)
+        self.stats["max_queue"] = max(self.stats["max_queue"], self.queue.qsize())
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            started = time.perf_counter()
+            if self.stats["first_started"] is None:
+                self.stats["first_started"] = started - self._origin
+            try:
+                await self.handler(item)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"❌ [Pipeline] 阶段 {self.name} 处理失败: {e}")
+            finally:
+                now = time.perf_counter()
+                self.stats["busy_seconds"] += now - started
+                if self.stats["first_done"] is None:
+                    self.stats["first_done"] = now - self._origin
+                self.stats["last_done"] = now - self._origin
+
+    async def run(self) -> None:
+        await asyncio.gather(*[self._worker() for _ in range(self.workers)])
+
+    async def close(self) -> None:
+        """通知所有工作协程在处理完已入队的项后退出"""
+        for _ in range(self.workers):
+            await self.queue.put(_STOP)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["workers"] = self.workers
+        stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+        for key in ("first_started", "first_done", "last_done"):
+            if stats[key] is not None:
+                stats[key] = round(stats[key], 3)
+        return stats
+
+
+async def run_stages(
+    stages: List[Stage],
+    items: Iterable[Any],
+    seeds: Optional[Dict[str, Iterable[Any]]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """把 items 送入第一个阶段并运行整条流水线，全部处理完后返回各阶段统计
+
+    处理函数通过闭包持有下一阶段，调用其 put() 传递产出
+
+    Args:
+        seeds: 阶段名 -> 直接放入该阶段的项（从检查点恢复时，上次已完成前序阶段的项）
+    """
+    origin = time.perf_counter()
+    for stage in stages:
+        stage._origin = origin
+    runners = [asyncio.create_task(stage.run()) for stage in stages]
+    try:
+        for stage in stages:
+            for item in (seeds or {}).get(stage.name, ()):
+                await stage.put(item)
+        for item in items:
+            await stages[0].put(item)
+        for stage, runner in zip(stages, runners):
+            await stage.close()
+            await runner
+    except BaseException:
+        for runner in runners:
+            runner.cancel()
+        raise
+    return {stage.name: stage.get_stats() for stage in stages}
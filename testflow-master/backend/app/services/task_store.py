@@ -0,0 +1,262 @@
+"""
+异步任务状态存储
+AsyncTaskManager 的任务只保存在进程内时，多个 uvicorn 工作进程之间查询不到彼此的任务（轮询请求落到
+其他进程时返回404），服务重启后任务状态全部丢失。任务状态写入存储后：
+- 任意工作进程都能查询任务的状态、进度、消息和结果
+- 进度更新由任务管理器批量写入（task_store_flush_interval），任务创建时立即写入
+- 取消请求写入存储，执行任务的工作进程在下次写入时发现并取消本地任务
+- 执行中的任务定期更新心跳，所在进程退出后心跳超时的任务由其他进程标记为失败
+
+后端：
+- memory：只保存在进程内（单进程部署，与之前的行为相同）
+- database：写入主数据库的 async_tasks 表，或 task_store_url 指定的独立数据库（如本地SQLite文件）
+"""
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import create_engine, delete, select, update
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+
+ACTIVE_STATUSES = ("pending", "running")
+TERMINAL_STATUSES = ("completed", "failed", "cancelled", "timeout")
+# 写入存储的任务字段
+FIELDS = (
+    "task_type", "status", "progress", "total_batches", "completed_batches",
+    "message", "error", "result", "created_at", "started_at", "completed_at",
+)
+STALE_ERROR = "执行任务的服务进程已退出，任务已中断"
+
+
+class TaskStore:
+    """任务状态存储接口
+
+    默认实现不做任何持久化，任务状态只保存在 AsyncTaskManager 中
+    """
+
+    durable = False
+
+    def save(self, worker_id: str, rows: Sequence[Dict[str, Any]]) -> List[str]:
+        """写入任务状态
+
+        执行中的任务不会覆盖其他进程写入的取消状态
+
+        Returns:
+            已被其他进程取消的任务ID
+        """
+        return []
+
+    def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务状态（包括 worker_id 和 heartbeat_at），不存在时返回None"""
+        return None
+
+    def request_cancel(self, task_id: str) -> bool:
+        """取消其他进程中的任务，任务已结束时返回False"""
+        return False
+
+    def reopen(self, worker_id: str, task_id: str) -> bool:
+        """把已结束的任务重新置为运行中并归属于本进程（多个进程同时重新打开时只有一个成功）
+
+        Returns:
+            是否成功，任务不存在或未结束时返回False
+        """
+        return True
+
+    def heartbeat(self, worker_id: str, task_ids: Sequence[str]) -> None:
+        """更新本进程执行中任务的心跳"""
+
+    def expire_stale(self, stale_before: datetime) -> List[str]:
+        """心跳早于 stale_before 的未结束任务标记为失败，返回这些任务ID"""
+        return []
+
+    def release(self, worker_id: str, error: str) -> int:
+        """进程退出时把本进程未结束的任务标记为失败，返回任务数"""
+        return 0
+
+    def purge(self, completed_before: datetime) -> int:
+        """删除结束时间早于 completed_before 的任务，返回删除数"""
+        return 0
+
+
+class MemoryTaskStore(TaskStore):
+    """进程内存储：任务状态只保存在 AsyncTaskManager 中"""
+
+
+class DatabaseTaskStore(TaskStore):
+    """数据库存储：写入 async_tasks 表
+
+    Args:
+        url: 独立的数据库地址，为空时使用主数据库
+    """
+
+    durable = True
+
+    def __init__(self, url: Optional[str] = None):
+        self.url = url
+        self._session_factory = None
+        self._lock = threading.Lock()
+
+    def _session(self):
+        """延迟创建会话工厂并建表"""
+        from app.models.async_task import AsyncTaskRecord
+
+        with self._lock:
+            if self._session_factory is None:
+                if self.url:
+                    engine = create_engine(
+                        self.url,
+                        connect_args={"check_same_thread": False} if "sqlite" in self.url else {}
+                    )
+                    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                else:
+                    from app.database import SessionLocal, engine
+                    factory = SessionLocal
+                AsyncTaskRecord.__table__.create(bind=engine, checkfirst=True)
+                self._session_factory = factory
+        return self._session_factory()
+
+    def save(self, worker_id: str, rows: Sequence[Dict[str, Any]]) -> List[str]:
+        from app.models.async_task import AsyncTaskRecord
+
+        cancelled = []
+        now = datetime.utcnow()
+        session = self._session()
+        try:
+            for row in rows:
+                values = {key: row.get(key) for key in FIELDS}
+                values.update(worker_id=worker_id, heartbeat_at=now)
+                stmt = update(AsyncTaskRecord).where(AsyncTaskRecord.task_id == row["task_id"])
+                if row["status"] in ACTIVE_STATUSES:
+                    stmt = stmt.where(AsyncTaskRecord.status != "cancelled")
+                if session.execute(stmt.values(**values)).rowcount:
+                    continue
+                exists = session.execute(
+                    select(AsyncTaskRecord.id).where(AsyncTaskRecord.task_id == row["task_id"])
+                ).first()
+                if exists:
+                    cancelled.append(row["task_id"])
+                else:
+                    session.add(AsyncTaskRecord(task_id=row["task_id"], **values))
+            session.commit()
+            return cancelled
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        from app.models.async_task import AsyncTaskRecord
+
+        session = self._session()
+        try:
+            record = session.query(AsyncTaskRecord).filter(AsyncTaskRecord.task_id == task_id).first()
+            if record is None:
+                return None
+            data = {key: getattr(record, key) for key in FIELDS}
+            data.update(task_id=record.task_id, worker_id=record.worker_id, heartbeat_at=record.heartbeat_at)
+            return data
+        finally:
+            session.close()
+
+    def request_cancel(self, task_id: str) -> bool:
+        from app.models.async_task import AsyncTaskRecord
+
+        return self._execute(
+            update(AsyncTaskRecord).where(
+                AsyncTaskRecord.task_id == task_id,
+                AsyncTaskRecord.status.in_(ACTIVE_STATUSES)
+            ).values(status="cancelled", completed_at=datetime.utcnow())
+        ) > 0
+
+    def reopen(self, worker_id: str, task_id: str) -> bool:
+        from app.models.async_task import AsyncTaskRecord
+
+        return self._execute(
+            update(AsyncTaskRecord).where(
+                AsyncTaskRecord.task_id == task_id,
+                AsyncTaskRecord.status.in_(TERMINAL_STATUSES)
+            ).values(
+                status="running", error=None, completed_at=None,
+                worker_id=worker_id, heartbeat_at=datetime.utcnow()
+            )
+        ) > 0
+
+    def heartbeat(self, worker_id: str, task_ids: Sequence[str]) -> None:
+        from app.models.async_task import AsyncTaskRecord
+
+        if task_ids:
+            self._execute(
+                update(AsyncTaskRecord).where(
+                    AsyncTaskRecord.task_id.in_(list(task_ids)),
+                    AsyncTaskRecord.worker_id == worker_id
+                ).values(heartbeat_at=datetime.utcnow())
+            )
+
+    def expire_stale(self, stale_before: datetime) -> List[str]:
+        from app.models.async_task import AsyncTaskRecord
+
+        session = self._session()
+        try:
+            task_ids = list(session.execute(
+                select(AsyncTaskRecord.task_id).where(
+                    AsyncTaskRecord.status.in_(ACTIVE_STATUSES),
+                    AsyncTaskRecord.heartbeat_at < stale_before
+                )
+            ).scalars())
+            if task_ids:
+                session.execute(
+                    update(AsyncTaskRecord).where(
+                        AsyncTaskRecord.task_id.in_(task_ids),
+                        AsyncTaskRecord.status.in_(ACTIVE_STATUSES)
+                    ).values(status="failed", error=STALE_ERROR, completed_at=datetime.utcnow())
+                )
+                session.commit()
+            return task_ids
+        finally:
+            session.close()
+
+    def release(self, worker_id: str, error: str) -> int:
+        from app.models.async_task import AsyncTaskRecord
+
+        return self._execute(
+            update(AsyncTaskRecord).where(
+                AsyncTaskRecord.worker_id == worker_id,
+                AsyncTaskRecord.status.in_(ACTIVE_STATUSES)
+            ).values(status="failed", error=error, completed_at=datetime.utcnow())
+        )
+
+    def purge(self, completed_before: datetime) -> int:
+        from app.models.async_task import AsyncTaskRecord
+
+        return self._execute(
+            delete(AsyncTaskRecord).where(
+                AsyncTaskRecord.status.in_(TERMINAL_STATUSES),
+                AsyncTaskRecord.completed_at < completed_before
+            )
+        )
+
+    def _execute(self, stmt: Any) -> int:
+        """执行一条更新/删除语句并提交，返回影响行数"""
+        session = self._session()
+        try:
+            count = session.execute(stmt).rowcount
+            session.commit()
+            return count
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+def create_task_store() -> TaskStore:
+    """按配置创建任务状态存储"""
+    backend = settings.task_store_backend
+    if backend == "database":
+        return DatabaseTaskStore(settings.task_store_url)
+    if backend != "memory":
+        print(f"⚠️ [TaskStore] 未知的任务存储类型 {backend!r}，任务状态只保存在进程内")
+    return MemoryTaskStore()
@@ -0,0 +1,325 @@
+"""
+测试用例近似重复检测（jieba 分词 + SimHash）
+- 用例文本（标题、前置条件、步骤、预期结果）分词后取词和相邻词对作为特征，计算64位 SimHash
+- 指纹持久化到 test_case_signatures 表，并拆成4个16位分段建索引：
+  汉明距离不超过3的两个指纹至少有一个分段完全相同，检查新用例时只需比较分段命中的候选，
+  不随项目用例数线性增长
+- 生成的用例保存时增量检查（标记或合并），项目级扫描按需执行
+"""
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import or_, select, union
+
+from app.services.requirement_index import tokenize
+
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# 分段数决定了能保证召回的最大汉明距离
+MAX_DISTANCE = BANDS - 1
+
+
+def case_text(case: Any) -> str:
+    """用于指纹计算的用例文本（支持 TestCase 对象和字典）"""
+    get = case.get if isinstance(case, dict) else lambda key: getattr(case, key, None)
+    parts = [get("title"), get("preconditions")]
+    steps = get("test_steps") or []
+    if isinstance(steps, str):
+        parts.append(steps)
+    else:
+        for step in steps:
+            if isinstance(step, dict):
+                parts.extend([step.get("action"), step.get("expected")])
+            else:
+                parts.append(step)
+    parts.append(get("expected_result"))
+    return "\n".join(str(p) for p in parts if p)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text: str) -> int:
+    """64位 SimHash：词权重1，相邻词对（保留词序信息）权重2"""
+    terms = tokenize(text)
+    features: Dict[str, int] = {}
+    for term in terms:
+        features[term] = features.get(term, 0) + 1
+    for a, b in zip(terms, terms[1:]):
+        key = f"{a} {b}"
+        features[key] = features.get(key, 0) + 2
+
+    vector = [0] * 64
+    for feature, weight in features.items():
+        h = _feature_hash(feature)
+        for bit in range(64):
+            vector[bit] += weight if (h >> bit) & 1 else -weight
+    value = 0
+    for bit in range(64):
+        if vector[bit] > 0:
+            value |= 1 << bit
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def bands(value: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+def to_signed(value: int) -> int:
+    """转换为有符号64位整数（数据库 BIGINT 存储）"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TestCaseDedupService:
+    """用例指纹的持久化、增量检查和项目级扫描"""
+
+    @staticmethod
+    def _project_ids(db: Any, module_ids: Iterable[Optional[int]]) -> Dict[int, Optional[int]]:
+        from app.models.module import Module
+
+        ids = [m for m in set(module_ids) if m is not None]
+        if not ids:
+            return {}
+        return {m.id: m.project_id for m in db.query(Module.id, Module.project_id).filter(Module.id.in_(ids)).all()}
+
+
+    def find_duplicate(
+        self,
+        db: Any,
+        value: int,
+        project_id: Optional[int],
+        module_id: Optional[int],
+        max_distance: int = MAX_DISTANCE
+    ) -> Optional[Tuple[int, int]]:
+        """在项目（无项目时为模块）内查找最相近的已有用例
+
+        Returns:
+            (用例ID, 汉明距离)；没有距离不超过 max_distance 的用例时返回 None
+        """
+        from app.models.testcase_signature import TestCaseSignature
+
+        if project_id is None and module_id is None:
+            return None
+        band_values = bands(value)
+        if project_id is not None:
+            scope = TestCaseSignature.project_id == project_id
+        else:
+            scope = TestCaseSignature.module_id == module_id
+        # 每个分段单独查询（各自命中 项目+分段 联合索引），再合并结果
+        statement = union(*[
+            select(TestCaseSignature.test_case_id, TestCaseSignature.simhash).where(
+                scope, getattr(TestCaseSignature, f"band{i}") == band_values[i]
+            )
+            for i in range(BANDS)
+        ])
+        with db.no_autoflush:
+            rows = db.execute(statement).all()
+        best = None
+        for case_id, stored in rows:
+            distance = hamming(value, to_unsigned(stored))
+            if distance <= max_distance and (best is None or (distance, case_id) < (best[1], best[0])):
+                best = (case_id, distance)
+        return best
+
+    def index_cases(self, db: Any, cases: Sequence[Any], max_distance: int = MAX_DISTANCE) -> List[Tuple[Any, int, int]]:
+        """为已 flush 的新用例写入指纹并检查近似重复（同一批用例之间也会互相比较）
+
+        Returns:
+            [(用例, 重复的较早用例ID, 汉明距离)]
+        """
+        from app.models.testcase_signature import TestCaseSignature
+
+        max_distance = min(max_distance, MAX_DISTANCE)
+        project_ids = self._project_ids(db, (c.module_id for c in cases))
+        # 用例ID可能被复用（数据库未启用外键级联时残留的旧指纹），先清理
+        db.query(TestCaseSignature).filter(
+            TestCaseSignature.test_case_id.in_([c.id for c in cases])
+        ).delete(synchronize_session=False)
+        # 本批未入库的指纹：(范围, 分段序号, 分段值) -> [(用例ID, 指纹)]
+        pending: Dict[Tuple[Any, int, int], List[Tuple[int, int]]] = {}
+        duplicates = []
+        for case in cases:
+            text = case_text(case)
+            value = simhash(text)
+            project_id = case.project_id or project_ids.get(case.module_id)
+            scope = ("project", project_id) if project_id is not None else ("module", case.module_id)
+            band_values = bands(value)
+
+            found = self.find_duplicate(db, value, project_id, case.module_id, max_distance)
+            for i in range(BANDS):
+                for other_id, other_value in pending.get((scope, i, band_values[i]), []):
+                    distance = hamming(value, other_value)
+                    if distance <= max_distance and (found is None or distance < found[1]):
+                        found = (other_id, distance)
+            for i in range(BANDS):
+                pending.setdefault((scope, i, band_values[i]), []).append((case.id, value))
+
+            db.add(TestCaseSignature(
+                test_case_id=case.id,
+                project_id=project_id,
+                module_id=case.module_id,
+                simhash=to_signed(value),
+                **{f"band{i}": b for i, b in enumerate(band_values)},
+                content_hash=content_hash(text),
+                duplicate_of_id=found[0] if found else None,
+                distance=found[1] if found else None
+            ))
+            if found:
+                duplicates.append((case, found[0], found[1]))
+        db.flush()
+        return duplicates
+
+    def check_new_cases(self, db: Any, cases: Sequence[Any], generation_config: Any) -> List[int]:
+        """保存生成的用例时调用：写入指纹，按配置标记或合并近似重复的用例
+
+        Returns:
+            被合并（删除）的用例ID
+        """
+        if not cases or not generation_config.dedup_enabled:
+            return []
+        try:
+            duplicates = self.index_cases(db, cases, generation_config.dedup_max_distance)
+        except Exception as e:
+            print(f"⚠️ [Dedup] 近似重复检查失败: {e}")
+            return []
+        if not duplicates:
+            return []
+
+        merged = []
+        if generation_config.dedup_action == "merge":
+            from app.models.testcase_signature import TestCaseSignature
+
+            merged = [case.id for case, _, _ in duplicates]
+            db.query(TestCaseSignature).filter(
+                TestCaseSignature.test_case_id.in_(merged)
+            ).delete(synchronize_session=False)
+            for case, _, _ in duplicates:
+                db.delete(case)
+            db.flush()
+            print(f"🧬 [Dedup] {len(cases)} 个新用例中 {len(merged)} 个与已有用例近似重复，已合并")
+        else:
+            print(f"🧬 [Dedup] {len(cases)} 个新用例中 {len(duplicates)} 个与已有用例近似重复，已标记")
+        return merged
+
+    def scan_project(
+        self,
+        db: Any,
+        project_id: int,
+        max_distance: int = MAX_DISTANCE,
+        merge: bool = False
+    ) -> Dict[str, Any]:
+        """扫描项目的全部用例：补齐缺失或过期的指纹，重新计算重复标记，可选合并
+
+        合并时保留每组中最早的用例，只删除AI生成且未被用户编辑过的重复用例
+        """
+        from app.models.module import Module
+        from app.models.testcase import TestCase
+        from app.models.testcase_signature import TestCaseSignature
+
+        max_distance = min(max_distance, MAX_DISTANCE)
+        module_ids = [m.id for m in db.query(Module.id).filter(Module.project_id == project_id).all()]
+        conditions = [TestCase.project_id == project_id]
+        if module_ids:
+            conditions.append(TestCase.module_id.in_(module_ids))
+        cases = db.query(TestCase).filter(or_(*conditions)).order_by(TestCase.id).all()
+        signatures = {
+            s.test_case_id: s for s in db.query(TestCaseSignature).filter(
+                TestCaseSignature.test_case_id.in_([c.id for c in cases])
+            ).all()
+        } if cases else {}
+
+        reindexed = 0
+        buckets: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+        groups: Dict[int, List[int]] = {}
+        roots: Dict[int, int] = {}  # 重复用例 -> 所在组保留的用例
+        values: Dict[int, int] = {}
+        to_merge = []
+        for case in cases:
+            text = case_text(case)
+            digest = content_hash(text)
+            sig = signatures.get(case.id)
+            if sig is None or sig.content_hash != digest:
+                value = simhash(text)
+                if sig is None:
+                    sig = TestCaseSignature(test_case_id=case.id)
+                    db.add(sig)
+                    signatures[case.id] = sig
+                sig.simhash = to_signed(value)
+                for i, b in enumerate(bands(value)):
+                    setattr(sig, f"band{i}", b)
+                sig.content_hash = digest
+                reindexed += 1
+            else:
+                value = to_unsigned(sig.simhash)
+            sig.project_id = project_id
+            sig.module_id = case.module_id
+            values[case.id] = value
+
+            # 只与更早的用例比较，重复标记总是指向较早的用例
+            best = None
+            seen = set()
+            band_values = bands(value)
+            for i in range(BANDS):
+                for other_id, other_value in buckets.get((i, band_values[i]), []):
+                    if other_id in seen:
+                        continue
+                    seen.add(other_id)
+                    distance = hamming(value, other_value)
+                    if distance <= max_distance and (best is None or (distance, other_id) < (best[1], best[0])):
+                        best = (other_id, distance)
+            for i in range(BANDS):
+                buckets.setdefault((i, band_values[i]), []).append((case.id, value))
+
+            sig.duplicate_of_id = best[0] if best else None
+            sig.distance = best[1] if best else None
+            if best:
+                root = roots.get(best[0], best[0])
+                roots[case.id] = root
+                groups.setdefault(root, []).append(case.id)
+                if merge and case.created_by_ai and not case.edited_by_user:
+                    to_merge.append((case, sig))
+
+        # 保留下来的用例可能指向被合并的中间用例，改为指向所在组保留的用例
+        merged_ids = {case.id for case, _ in to_merge}
+        for case in cases:
+            sig = signatures.get(case.id) if case.id not in merged_ids else None
+            if sig is not None and sig.duplicate_of_id in merged_ids:
+                root = roots[case.id]
+                sig.duplicate_of_id = root
+                sig.distance = hamming(values[case.id], values[root])
+        for case, sig in to_merge:
+            db.delete(sig)
+            db.delete(case)
+        db.commit()
+
+        duplicates = sum(len(v) for v in groups.values())
+        print(f"🧬 [Dedup] 项目 {project_id}: 扫描 {len(cases)} 个用例，更新指纹 {reindexed} 个，"
+              f"近似重复 {duplicates} 个，合并 {len(to_merge)} 个")
+        return {
+            "project_id": project_id,
+            "scanned": len(cases),
+            "reindexed": reindexed,
+            "duplicates": duplicates,
+            "merged": len(to_merge),
+            "merged_ids": [c.id for c, _ in to_merge],
+            "groups": [{"keep_id": keep, "duplicate_ids": ids} for keep, ids in groups.items()]
+        }
+
+
+# 全局用例去重实例
+test_case_dedup = TestCaseDedupService()
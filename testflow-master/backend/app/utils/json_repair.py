@@ -0,0 +1,250 @@
+"""
+容错JSON解析
+模型输出的JSON常见缺陷：尾随逗号、字符串中未转义的换行/引号、单引号字符串、
+Python 字面量（True/False/None）、注释、漏写的逗号，以及输出被截断导致的未闭合结构。
+
+- repair_json：修复上述缺陷，截断时丢弃最后一个不完整的值并补齐括号
+- salvage_items：从截断的输出中取出 test_cases 等数组里所有已完整输出的元素
+- parse_tolerant：先修复；若输出被截断，只返回完整元素（不完整的最后一个元素交给调用方重新生成）
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+_CLOSERS = {"{": "}", "[": "]"}
+_LITERALS = {"True": "true", "False": "false", "None": "null", "true": "true", "false": "false", "null": "null"}
+
+
+def _strip_wrapping(text: str) -> str:
+    """去掉根JSON之前的内容（说明文字、```json 标记）"""
+    start = -1
+    for i, ch in enumerate(text):
+        if ch in "{[":
+            start = i
+            break
+    return text[start:] if start >= 0 else text
+
+
+def _next_non_space(s: str, i: int) -> str:
+    n = len(s)
+    while i < n and s[i] in " \t\r\n":
+        i += 1
+    return s[i] if i < n else ""
+
+
+def _normalize(s: str) -> Tuple[str, bool]:
+    """逐字符修复，返回 (修复后的文本, 是否在根结构闭合前就结束了)"""
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    quote = '"'
+    i, n = 0, len(s)
+
+    def drop_trailing_comma() -> None:
+        j = len(out) - 1
+        while j >= 0 and out[j] in (" ", "\t", "\r", "\n"):
+            j -= 1
+        if j >= 0 and out[j] == ",":
+            del out[j]
+
+    def maybe_missing_comma(pos: int) -> None:
+        # 一个值结束后紧跟下一个值（漏写逗号）
+        nxt = _next_non_space(s, pos)
+        if stack and nxt and (nxt in "\"'{[" or nxt.isdigit() or nxt == "-"):
+            out.append(",")
+
+    while i < n:
+        ch = s[i]
+        if in_string:
+            if ch == "\\":
+                nxt = s[i + 1] if i + 1 < n else ""
+                if nxt == "'":
+                    out.append("'")
+                    i += 2
+                elif nxt and nxt in '"\\/bfnrtu':
+                    out.append(ch + nxt)
+                    i += 2
+                elif not nxt:
+                    i += 1  # 截断在转义符上
+                else:
+                    out.append("\\\\")
+                    i += 1
+                continue
+            if ch == quote:
+                nxt = _next_non_space(s, i + 1)
+                if nxt in ("", ",", ":", "}", "]") or nxt in "\"'{[":
+                    out.append('"')
+                    in_string = False
+                    i += 1
+                    if nxt and nxt in "\"'{[":
+                        maybe_missing_comma(i)
+                    continue
+                # 后面不是结构字符：视为字符串内容中未转义的引号
+                out.append('\\"' if ch == '"' else ch)
+                i += 1
+                continue
+            if ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\r":
+                out.append("\\r")
+            elif ch == "\t":
+                out.append("\\t")
+            elif ord(ch) >= 0x20:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in "\"'":
+            in_string = True
+            quote = ch
+            out.append('"')
+            i += 1
+        elif ch in "{[":
+            stack.append(ch)
+            out.append(ch)
+            i += 1
+        elif ch in "}]":
+            drop_trailing_comma()
+            if stack and _CLOSERS[stack[-1]] == ch:
+                stack.pop()
+                out.append(ch)
+            elif stack:
+                # 括号不匹配：按栈顶补齐
+                out.append(_CLOSERS[stack.pop()])
+            i += 1
+            if not stack:
+                return "".join(out), False
+            maybe_missing_comma(i)
+        elif ch == "/" and i + 1 < n and s[i + 1] in "/*":
+            # 注释
+            if s[i + 1] == "/":
+                end = s.find("\n", i)
+                i = n if end < 0 else end
+            else:
+                end = s.find("*/", i + 2)
+                i = n if end < 0 else end + 2
+        elif ch.isalpha() or ch == "_" or ch.isdigit() or ch in "-+.":
+            j = i
+            while j < n and (s[j].isalnum() or s[j] in "_-+.") and s[j] not in ",:}]":
+                j += 1
+            word = s[i:j]
+            if word in _LITERALS:
+                out.append(_LITERALS[word])
+            elif _is_number(word):
+                out.append(word)
+            elif j >= n:
+                pass  # 截断在字面量中间，交给后续的裁剪处理
+            else:
+                # 未加引号的键或值
+                out.append(json.dumps(word, ensure_ascii=False))
+            i = j
+            if j < n:
+                maybe_missing_comma(i)
+        else:
+            out.append(ch)
+            i += 1
+
+    if in_string:
+        out.append('"')
+    return "".join(out), bool(stack)
+
+
+def _is_number(word: str) -> bool:
+    try:
+        float(word)
+        return True
+    except ValueError:
+        return False
+
+
+def _scan(text: str) -> Tuple[List[str], List[int]]:
+    """返回未闭合的容器栈，以及所有可作为裁剪点的位置（字符串外的 , { [）"""
+    stack: List[str] = []
+    cut_points: List[int] = []
+    in_string = escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+            cut_points.append(i)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+        elif ch == ",":
+            cut_points.append(i)
+    return stack, cut_points
+
+
+def _close(text: str) -> str:
+    stack, _ = _scan(text)
+    return text.rstrip().rstrip(",") + "".join(_CLOSERS[c] for c in reversed(stack))
+
+
+def repair_json(text: str) -> Tuple[str, bool]:
+    """修复常见的JSON缺陷
+
+    Returns:
+        (修复后的JSON文本, 原文是否被截断)；无法修复时返回的文本仍可能解析失败
+    """
+    normalized, truncated = _normalize(_strip_wrapping(text or ""))
+    if not truncated:
+        return normalized, False
+
+    # 截断：从末尾逐步裁掉不完整的值，直到补齐括号后可以解析
+    candidate = normalized
+    for _ in range(64):
+        closed = _close(candidate)
+        try:
+            json.loads(closed)
+            return closed, True
+        except json.JSONDecodeError:
+            pass
+        _, cut_points = _scan(candidate)
+        if not cut_points:
+            break
+        cut = cut_points[-1]
+        # 在 , 处裁剪时去掉逗号；在 { [ 处裁剪时保留括号本身（得到空容器）
+        candidate = candidate[:cut] if candidate[cut] == "," else candidate[:cut + 1]
+    return _close(candidate), True
+
+
+def salvage_items(text: str, keys: Optional[Iterable[str]] = None) -> Dict[str, List[Any]]:
+    """取出指定数组中所有已完整输出的元素（按输出顺序）"""
+    from app.utils.json_stream import DEFAULT_STREAM_KEYS, StreamingJSONArrayParser
+
+    parser = StreamingJSONArrayParser(keys or DEFAULT_STREAM_KEYS)
+    items: Dict[str, List[Any]] = {}
+    for key, _, item in parser.feed(text or ""):
+        items.setdefault(key, []).append(item)
+    return items
+
+
+def parse_tolerant(text: str, keys: Optional[Iterable[str]] = None) -> Tuple[Any, bool]:
+    """容错解析
+
+    Returns:
+        (解析结果, 是否不完整)；输出被截断时结果只包含 keys 数组中的完整元素，
+        还没有任何完整元素时各数组为空，由调用方重新请求
+
+    Raises:
+        json.JSONDecodeError: 修复后仍无法解析
+    """
+    from app.utils.json_stream import DEFAULT_STREAM_KEYS
+
+    keys = tuple(keys) if keys else DEFAULT_STREAM_KEYS
+    repaired, truncated = repair_json(text)
+    if truncated:
+        # 修复结果中包含补齐括号后的半个元素，不能当作完整数据返回
+        return salvage_items(text, keys) or {key: [] for key in keys}, True
+    return json.loads(repaired), False
@@ -0,0 +1,179 @@
+"""
+增量流式JSON解析
+在模型仍在输出时，逐个提取指定数组（如 test_cases）中已经闭合的元素
+
+只跟踪括号深度、字符串和转义状态，不构建完整语法树：
+- 根JSON之前/之后的内容（```json 代码块标记、说明文字）会被忽略
+- 某个元素格式有缺陷时先尝试修复，仍失败则跳过该元素，不影响后续元素
+"""
+import json
+from typing import Any, Callable, Iterable, List, Optional, Set, Tuple
+
+from app.utils.json_repair import repair_json
+
+
+# 生成流程中需要增量提取的数组字段
+DEFAULT_STREAM_KEYS = ("requirement_points", "test_points", "test_cases", "optimized_cases")
+
+
+def _loads(raw: str) -> Any:
+    """解析单个元素，格式有缺陷时尝试修复"""
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        repaired, truncated = repair_json(raw)
+        if truncated:
+            raise
+        return json.loads(repaired)
+
+
+class _Frame:
+    """容器栈帧"""
+    __slots__ = ("kind", "key", "pending_key", "target", "item_index")
+
+    def __init__(self, kind: str, target: bool = False, key: Optional[str] = None):
+        self.kind = kind  # '{' 或 '['
+        self.key = key  # 数组对应的字段名
+        self.pending_key: Optional[str] = None  # 对象中最近读到的字段名
+        self.target = target  # 是否为需要提取元素的目标数组
+        self.item_index = 0  # 目标数组中下一个元素的序号
+
+
+class StreamingJSONArrayParser:
+    """增量解析器
+
+    Example:
+        >>> parser = StreamingJSONArrayParser()
+        >>> parser.feed('{"test_cases": [{"title": "a"}, {"ti')
+        [('test_cases', 0, {'title': 'a'})]
+        >>> parser.feed('tle": "b"}]}')
+        [('test_cases', 1, {'title': 'b'})]
+    """
+
+    def __init__(self, keys: Iterable[str] = DEFAULT_STREAM_KEYS):
+        self.keys = set(keys)
+        self._buffer: List[str] = []
+        self._text = ""
+        self._pos = 0  # 已扫描到的位置
+        self._stack: List[_Frame] = []
+        self._started = False
+        self._finished = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_string: Optional[str] = None
+        self._item_start = -1  # 当前目标元素在文本中的起始位置
+        self._item_depth = -1  # 当前目标元素所在数组的栈深度
+
+    @property
+    def text(self) -> str:
+        """已接收的完整文本"""
+        if self._buffer:
+            self._text += "".join(self._buffer)
+            self._buffer = []
+        return self._text
+
+    def feed(self, chunk: str) -> List[Tuple[str, int, Any]]:
+        """输入一段增量文本，返回本次新闭合的元素列表 [(字段名, 序号, 元素)]"""
+        if not chunk:
+            return []
+        self._buffer.append(chunk)
+        text = self.text
+        completed: List[Tuple[str, int, Any]] = []
+
+        i = self._pos
+        n = len(text)
+        while i < n and not self._finished:
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                i += 1
+                continue
+
+            if not self._started:
+                # 跳过根JSON之前的内容
+                if ch in "{[":
+                    self._started = True
+                else:
+                    i += 1
+                    continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ":":
+                if self._stack and self._stack[-1].kind == "{":
+                    self._stack[-1].pending_key = self._last_string
+            elif ch in "{[":
+                parent = self._stack[-1] if self._stack else None
+                if parent is not None and parent.target and self._item_start < 0:
+                    # 目标数组中的元素开始
+                    self._item_start = i
+                    self._item_depth = len(self._stack)
+                key = parent.pending_key if parent is not None and parent.kind == "{" else None
+                is_target = ch == "[" and key in self.keys and self._item_start < 0
+                self._stack.append(_Frame(ch, target=is_target, key=key))
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if self._item_start >= 0 and len(self._stack) == self._item_depth:
+                    owner = self._stack[-1]
+                    raw = text[self._item_start:i + 1]
+                    self._item_start = -1
+                    self._item_depth = -1
+                    try:
+                        completed.append((owner.key, owner.item_index, _loads(raw)))
+                    except json.JSONDecodeError:
+                        print(f"⚠️ [StreamingJSON] 跳过无法解析的 {owner.key}[{owner.item_index}]")
+                    owner.item_index += 1
+                if not self._stack:
+                    self._finished = True
+            elif ch == ",":
+                if self._stack and self._stack[-1].kind == "{":
+                    self._stack[-1].pending_key = None
+            i += 1
+
+        self._pos = i
+        return completed
+
+
+class StreamingItemSink:
+    """把流式增量文本转换为逐个元素的回调
+
+    每次AI调用尝试（含重试）通过 new_attempt() 获取新的增量回调；
+    同一 (字段名, 序号) 的元素只会回调一次，重试时不会重复投递。
+    """
+
+    def __init__(self, on_item: Callable[[str, int, Any], None], keys: Iterable[str] = DEFAULT_STREAM_KEYS):
+        self.on_item = on_item
+        self.keys = tuple(keys)
+        self._delivered: Set[Tuple[str, int]] = set()
+
+    @property
+    def delivered_count(self) -> int:
+        """已投递的元素数量"""
+        return len(self._delivered)
+
+    def new_attempt(self) -> Callable[[str], None]:
+        """开始一次新的调用尝试，返回传给 AIService 的 on_delta 回调"""
+        parser = StreamingJSONArrayParser(self.keys)
+
+        def on_delta(chunk: str) -> None:
+            for key, index, item in parser.feed(chunk):
+                if (key, index) in self._delivered:
+                    continue
+                self._delivered.add((key, index))
+                try:
+                    self.on_item(key, index, item)
+                except Exception as e:
+                    # 回调异常不能中断流式接收
+                    print(f"⚠️ [StreamingJSON] 处理 {key}[{index}] 失败: {e}")
+
+        return on_delta
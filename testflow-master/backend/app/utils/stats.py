@@ -0,0 +1,14 @@
+"""
+统计工具
+调用遥测、自适应并发控制和基准测试使用同一个分位数定义，同一批调用在各处统计出的延迟一致
+"""
+import math
+from typing import Iterable, Optional
+
+
+def percentile(values: Iterable[float], q: float) -> Optional[float]:
+    """最近秩分位数：排序后第 ceil(q*n) 个值，没有数据时返回None"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
@@ -0,0 +1,124 @@
+"""
+AI客户端连接池基准测试
+
+对比两种调用方式在本地模拟供应商上的单次调用开销：
+- before: 每次调用新建 httpx.AsyncClient（旧实现）
+- after:  通过 ai_client_manager 复用长连接（AIService.call_ai_stream）
+
+用法（在 backend 目录下执行）：
+    python -m benchmarks.bench_ai_client_pool --calls 200 --concurrency 8
+
+说明：本地模拟供应商使用明文HTTP，结果只体现 TCP 建连 + 客户端初始化的开销；
+真实供应商还需要 TLS 握手，复用连接带来的收益会更大。
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Awaitable, List
+
+import httpx
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.ai_client import ai_client_manager  # noqa: E402
+from app.services.ai_service import ai_service  # noqa: E402
+from app.utils.stats import percentile  # noqa: E402
+from benchmarks.mock_llm import MockLLMConfig, start_mock_server  # noqa: E402
+
+
+def start_mock_provider() -> str:
+    """在后台线程启动模拟供应商（不加延迟，只测客户端开销），返回 base_url"""
+    server = start_mock_server(MockLLMConfig(ttft=0, tokens_per_second=0, chunk_chars=16))
+    return server.base_url
+
+
+async def call_without_pool(base_url: str) -> str:
+    """旧实现：每次调用新建客户端"""
+    data = {"model": "mock", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+    collected = []
+    async with httpx.AsyncClient(timeout=300.0) as client:
+        async with client.stream("POST", f"{base_url}/chat/completions", json=data,
+                                 headers={"Authorization": "Bearer bench"}) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("data: ") and line[6:].strip() != "[DONE]":
+                    chunk = json.loads(line[6:])
+                    collected.append(chunk["choices"][0]["delta"].get("content", ""))
+    return "".join(collected)
+
+
+async def call_with_pool(base_url: str) -> str:
+    """新实现：AIService 使用连接池"""
+    return await ai_service.call_ai_stream(
+        model="mock",
+        messages=[{"role": "user", "content": "hi"}],
+        api_key="bench",
+        base_url=base_url
+    )
+
+
+async def run_case(call: Callable[[str], Awaitable[str]], base_url: str, calls: int, concurrency: int) -> dict:
+    """执行一组调用并统计每次调用耗时"""
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call(base_url)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(calls)])
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    return {
+        "calls": calls,
+        "concurrency": concurrency,
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "throughput_rps": round(calls / wall, 1),
+    }
+
+
+async def main(calls: int, concurrency: int) -> dict:
+    base_url = start_mock_provider()
+
+    # 预热：排除首次导入/JIT等一次性开销
+    await call_without_pool(base_url)
+    await call_with_pool(base_url)
+
+    results = {}
+    for name, call in (("before", call_without_pool), ("after", call_with_pool)):
+        results[name] = {
+            "sequential": await run_case(call, base_url, calls, 1),
+            "concurrent": await run_case(call, base_url, calls, concurrency),
+        }
+
+    await ai_client_manager.close_all()
+
+    for mode in ("sequential", "concurrent"):
+        before = results["before"][mode]["mean_ms"]
+        after = results["after"][mode]["mean_ms"]
+        results[f"{mode}_saved_ms_per_call"] = round(before - after, 3)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI客户端连接池基准测试")
+    parser.add_argument("--calls", type=int, default=200, help="每组调用次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发组的并发数")
+    args = parser.parse_args()
+
+    # AIService 的调试输出较多，基准测试期间屏蔽
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = asyncio.run(main(args.calls, args.concurrency))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
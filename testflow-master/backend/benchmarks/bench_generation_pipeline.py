@@ -0,0 +1,492 @@
+"""
+完整生成流水线基准测试
+
+在临时 SQLite 数据库中构造项目、模块和指定规模的需求文档，对本地模拟供应商（benchmarks/mock_llm.py）
+执行 AgentServiceReal.execute_full_generation_pipeline，统计：
+- 总耗时及各阶段耗时（需求分析 / 测试点生成 / 用例设计 / 用例优化）
+  逐阶段执行（barrier）时为各阶段方法的耗时；流式执行时阶段2-4相互重叠，取流水线各阶段从开始处理
+  第一项到处理完最后一项的时间，各阶段的忙碌时间等统计另见 pipeline_stages
+- AI调用次数、发送/输出的token数、注入的错误数、供应商侧的峰值并发
+- 数据库写入语句数和耗时、提交耗时
+- 进程峰值内存（RSS）
+
+按 --concurrency × --batch-size 的组合逐一运行（每次运行使用全新的数据库和独立的模型名，
+限流器、自适应并发和熔断器的状态互不影响），结果保存为JSON基线，可用 --compare 与历史基线对比。
+
+用法（在 backend 目录下执行）：
+    python -m benchmarks.bench_generation_pipeline --sections 20 --concurrency 2,4,8 --batch-size 5,10
+    python -m benchmarks.bench_generation_pipeline --ttft 1.2 --ttft-sigma 0.5 --tps 40 --error-rate 0.02
+    python -m benchmarks.bench_generation_pipeline --compare benchmark_results/baseline.json
+    python -m benchmarks.bench_generation_pipeline --pipeline-mode barrier
+
+说明：--concurrency 对应并发配置中的 max_concurrent_tasks（1-10，关闭自适应并发时即任务内的AI调用并发数）；
+加 --adaptive 时同时作为自适应并发窗口上限 adaptive_max_in_flight。
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app.core.ai_client import ai_client_manager  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.models import (  # noqa: E402
+    AIModel, Agent, Module, Project, RequirementFile, TestCase, TestPoint, RequirementPoint, User
+)
+from app.models.ai_config import AgentType  # noqa: E402
+from app.prompts import (  # noqa: E402
+    REQUIREMENT_SPLITTER_SYSTEM, TEST_CASE_DESIGNER_SYSTEM, TEST_CASE_OPTIMIZER_SYSTEM, TEST_POINT_GENERATOR_SYSTEM
+)
+from app.schemas.settings import ConcurrencyConfig, GenerationConfig  # noqa: E402
+from app.services.agent_service_real import AgentServiceReal  # noqa: E402
+from app.services.requirement_index import requirement_index  # noqa: E402
+from app.services.settings_service import SettingsService  # noqa: E402
+from benchmarks.mock_llm import MockLLMConfig, spawn_mock_server, start_mock_server  # noqa: E402
+
+
+STAGES = {
+    "requirement_analysis": "analyze_requirements",
+    "test_point_generation": "execute_test_point_generation",
+    "test_case_design": "execute_test_case_design_batch",
+    "test_case_optimization": "execute_test_case_optimization",
+}
+# 流式执行时阶段2-4对应的流水线阶段（stage_pipeline.Stage 名称）
+PIPELINE_STAGES = {
+    "test_point_generation": "test_point",
+    "test_case_design": "design",
+    "test_case_optimization": "optimize",
+}
+
+_RULES = [
+    "输入字段{n}长度为1-{m}个字符，超出时提示'长度超出限制'",
+    "仅{role}角色可以执行该操作，其他角色返回无权限提示",
+    "操作成功后记录审计日志，包含操作人、时间和变更内容",
+    "金额字段保留两位小数，取值范围0.01-{m}0000.00",
+    "连续失败{n}次后锁定{m}分钟，锁定期间拒绝操作",
+    "状态只能按 草稿→待审核→已发布 的顺序流转，已发布数据不可删除",
+    "列表默认按创建时间倒序，每页{m}条，支持按名称模糊搜索",
+    "导出文件不超过{m}000行，超出时分批导出并提示用户",
+]
+
+
+def build_requirement_document(sections: int, rules_per_section: int) -> str:
+    """生成指定规模的需求文档（编号章节 + 业务规则条目）"""
+    lines = ["# 业务系统需求规格说明书", ""]
+    for s in range(1, sections + 1):
+        lines.append(f"{s}. 功能模块{s}")
+        lines.append(f"功能模块{s}用于管理业务对象{s}的创建、查询、修改和删除，面向运营和审核人员。")
+        for r in range(rules_per_section):
+            rule = _RULES[(s + r) % len(_RULES)].format(n=r + 3, m=s + 5, role="管理员" if r % 2 else "审核员")
+            lines.append(f"- 规则{s}.{r + 1}：{rule}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+class DBMetrics:
+    """数据库写入统计（写语句执行耗时 + Session.commit 耗时）"""
+
+    def __init__(self):
+        self.write_statements = 0
+        self.write_seconds = 0.0
+        self.commits = 0
+        self.commit_seconds = 0.0
+
+    def attach(self, engine: Any) -> None:
+        @event.listens_for(engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info["bench_start"] = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+                self.write_statements += 1
+                self.write_seconds += time.perf_counter() - conn.info.pop("bench_start", time.perf_counter())
+
+    def session_class(self) -> type:
+        metrics = self
+
+        class TimedSession(Session):
+            def commit(self):
+                start = time.perf_counter()
+                try:
+                    super().commit()
+                finally:
+                    metrics.commits += 1
+                    metrics.commit_seconds += time.perf_counter() - start
+
+        return TimedSession
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "write_statements": self.write_statements,
+            "write_seconds": round(self.write_seconds, 3),
+            "commits": self.commits,
+            "commit_seconds": round(self.commit_seconds, 3),
+        }
+
+
+class RSSSampler:
+    """后台线程采样进程RSS，记录运行期间的峰值（非Linux平台退化为 ru_maxrss）"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RSSSampler":
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def seed_database(db: Session, base_url: str, model_id: str, document: str, max_output_tokens: int) -> Dict[str, Any]:
+    """构造用户、项目、模块、需求文件、模型和四个智能体"""
+    SettingsService.initialize_defaults(db)
+    user = User(username="bench", email="bench@example.com", password_hash="-")
+    db.add(user)
+    db.flush()
+    project = Project(name="基准测试项目", owner_id=user.id)
+    db.add(project)
+    db.flush()
+    module = Module(project_id=project.id, name="基准测试模块")
+    db.add(module)
+    db.flush()
+    req_file = RequirementFile(
+        project_id=project.id,
+        module_id=module.id,
+        filename="benchmark.txt",
+        file_path="benchmark.txt",
+        file_size=len(document.encode("utf-8")),
+        file_type="txt",
+        uploaded_by=user.id,
+        extracted_content=document,
+        is_extracted=True
+    )
+    db.add(req_file)
+    ai_model = AIModel(
+        name=model_id, provider="openai", model_id=model_id, api_key="bench",
+        base_url=base_url, max_tokens=max_output_tokens, created_by=user.id
+    )
+    db.add(ai_model)
+    db.flush()
+
+    agent_ids = {}
+    for key, agent_type, prompt in (
+        ("requirement", AgentType.REQUIREMENT_SPLITTER, REQUIREMENT_SPLITTER_SYSTEM),
+        ("test_point", AgentType.TEST_POINT_GENERATOR, TEST_POINT_GENERATOR_SYSTEM),
+        ("test_case", AgentType.TEST_CASE_DESIGNER, TEST_CASE_DESIGNER_SYSTEM),
+        ("optimizer", AgentType.TEST_CASE_OPTIMIZER, TEST_CASE_OPTIMIZER_SYSTEM),
+    ):
+        agent = Agent(
+            name=key, type=agent_type, ai_model_id=ai_model.id, system_prompt=prompt,
+            max_tokens=max_output_tokens, cache_enabled=False, is_active=True, created_by=user.id
+        )
+        db.add(agent)
+        db.flush()
+        agent_ids[key] = agent.id
+    db.commit()
+    # 与上传接口一致：文档入库时完成分段索引
+    requirement_index.index_file(db, req_file)
+    return {"user_id": user.id, "module_id": module.id, "file_id": req_file.id, "agent_ids": agent_ids}
+
+
+def _instrument_stages(service: AgentServiceReal, timings: Dict[str, float], stages: List[str]) -> None:
+    """记录各阶段方法的耗时"""
+    for stage in stages:
+        method_name = STAGES[stage]
+        method = getattr(service, method_name)
+
+        def wrap(method: Callable, stage: str) -> Callable:
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+            return timed
+
+        setattr(service, method_name, wrap(method, stage))
+
+
+async def run_once(
+    mock_url: str,
+    base_url: str,
+    document: str,
+    concurrency: int,
+    batch_size: int,
+    args: argparse.Namespace,
+    run_index: int
+) -> Dict[str, Any]:
+    """使用全新数据库执行一次完整流水线"""
+    model_id = f"mock-c{concurrency}-b{batch_size}-r{run_index}"
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        metrics = DBMetrics()
+        db = sessionmaker(bind=engine, autoflush=False, class_=metrics.session_class())()
+        try:
+            seeded = seed_database(db, base_url, model_id, document, args.max_output_tokens)
+            SettingsService.update_concurrency_config(db, ConcurrencyConfig(
+                max_concurrent_tasks=min(concurrency, 10),
+                retry_count=args.retry_count,
+                adaptive_concurrency=args.adaptive,
+                adaptive_max_in_flight=concurrency
+            ))
+            SettingsService.update_generation_config(db, GenerationConfig(
+                design_max_batch_size=batch_size,
+                optimize_max_batch_size=batch_size,
+                context_mode=args.context_mode,
+                pipeline_streaming=args.pipeline_mode == "streaming",
+                quality_gate_threshold=args.quality_gate_threshold
+            ))
+            async with httpx.AsyncClient() as client:
+                await client.post(f"{mock_url}/mock/reset")
+
+            metrics.attach(engine)
+            service = AgentServiceReal(db)
+            timings: Dict[str, float] = {}
+            streaming = args.pipeline_mode == "streaming"
+            # 流式执行时阶段2-4的方法不再被调用（或只处理单个批次），耗时改从流水线阶段统计中获取
+            _instrument_stages(service, timings, ["requirement_analysis"] if streaming else list(STAGES))
+
+            sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+            with RSSSampler() as rss, sink:
+                start = time.perf_counter()
+                result = await service.execute_full_generation_pipeline(
+                    requirement_content=document,
+                    file_id=seeded["file_id"],
+                    module_id=seeded["module_id"],
+                    user_id=seeded["user_id"],
+                    agent_ids=seeded["agent_ids"]
+                )
+                wall = time.perf_counter() - start
+
+            pipeline_stages = (result.get("data") or {}).get("pipeline_stages") or {}
+            for stage, name in PIPELINE_STAGES.items():
+                stats = pipeline_stages.get(name)
+                if streaming and stats and stats["first_started"] is not None:
+                    timings[stage] = stats["last_done"] - stats["first_started"]
+
+            async with httpx.AsyncClient() as client:
+                llm = (await client.get(f"{mock_url}/mock/stats")).json()
+            counts = {
+                "requirement_points": db.query(RequirementPoint).count(),
+                "test_points": db.query(TestPoint).count(),
+                "test_cases": db.query(TestCase).count(),
+                "optimized": (result.get("data") or {}).get("optimized_count", 0),
+            }
+        finally:
+            db.close()
+            engine.dispose()
+
+    return {
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "run": run_index,
+        "success": bool(result.get("success")),
+        "error": result.get("error"),
+        "wall_seconds": round(wall, 3),
+        "stages": {stage: round(timings.get(stage, 0.0), 3) for stage in STAGES},
+        "pipeline_stages": pipeline_stages,
+        "llm": {
+            "calls": llm["requests"],
+            "completed": llm["completed"],
+            "prompt_tokens": llm["prompt_tokens"],
+            "output_tokens": llm["output_tokens"],
+            "server_errors": llm["server_errors"],
+            "rate_limited": llm["rate_limited"],
+            "truncated": llm["truncated"],
+            "max_in_flight": llm["max_in_flight"],
+            "by_kind": llm["by_kind"],
+        },
+        "db": metrics.to_dict(),
+        "peak_rss_mb": round(rss.peak / 1024 / 1024, 1),
+        "counts": counts,
+        "quality_gate": (result.get("data") or {}).get("quality_gate"),
+    }
+
+
+def summarize(runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按 (并发, 批次) 汇总多次运行的中位数"""
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for run in runs:
+        groups.setdefault((run["concurrency"], run["batch_size"]), []).append(run)
+    summary = []
+    for (concurrency, batch_size), items in sorted(groups.items()):
+        ok = [r for r in items if r["success"]] or items
+        summary.append({
+            "concurrency": concurrency,
+            "batch_size": batch_size,
+            "runs": len(items),
+            "failures": sum(1 for r in items if not r["success"]),
+            "wall_seconds": round(statistics.median(r["wall_seconds"] for r in ok), 3),
+            "stages": {s: round(statistics.median(r["stages"][s] for r in ok), 3) for s in STAGES},
+            "llm_calls": statistics.median(r["llm"]["calls"] for r in ok),
+            "prompt_tokens": statistics.median(r["llm"]["prompt_tokens"] for r in ok),
+            "db_write_seconds": round(statistics.median(r["db"]["write_seconds"] for r in ok), 3),
+            "peak_rss_mb": max(r["peak_rss_mb"] for r in ok),
+            "test_cases": statistics.median(r["counts"]["test_cases"] for r in ok),
+        })
+    return summary
+
+
+def compare(current: List[Dict[str, Any]], baseline_path: str) -> List[Dict[str, Any]]:
+    """与历史基线对比（按 (并发, 批次) 匹配）"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(s["concurrency"], s["batch_size"]): s for s in json.load(f).get("summary", [])}
+    rows = []
+    for item in current:
+        old = baseline.get((item["concurrency"], item["batch_size"]))
+        if not old:
+            continue
+        rows.append({
+            "concurrency": item["concurrency"],
+            "batch_size": item["batch_size"],
+            "wall_seconds": [old["wall_seconds"], item["wall_seconds"]],
+            "wall_change": round((item["wall_seconds"] - old["wall_seconds"]) / old["wall_seconds"], 3) if old["wall_seconds"] else None,
+            "llm_calls": [old["llm_calls"], item["llm_calls"]],
+            "prompt_tokens": [old["prompt_tokens"], item["prompt_tokens"]],
+            "peak_rss_mb": [old["peak_rss_mb"], item["peak_rss_mb"]],
+        })
+    return rows
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    settings.llm_cache_enabled = False
+    settings.llm_record_path = None
+    document = build_requirement_document(args.sections, args.rules_per_section)
+
+    mock_args = [
+        "--ttft", str(args.ttft), "--ttft-sigma", str(args.ttft_sigma), "--tps", str(args.tps),
+        "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+    ]
+    if args.seed is not None:
+        mock_args += ["--seed", str(args.seed)]
+    if args.replay:
+        mock_args += ["--replay", args.replay]
+
+    process = server = None
+    if args.in_process:
+        server = start_mock_server(MockLLMConfig(
+            ttft=args.ttft, ttft_sigma=args.ttft_sigma, tokens_per_second=args.tps,
+            error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed, replay_path=args.replay
+        ))
+        base_url = server.base_url
+    else:
+        # 默认以独立进程运行模拟供应商，避免其内存和CPU计入被测进程
+        process, base_url = spawn_mock_server(mock_args)
+    mock_url = base_url[:-len("/v1")]
+
+    runs = []
+    try:
+        for concurrency in _int_list(args.concurrency):
+            for batch_size in _int_list(args.batch_size):
+                for run_index in range(args.repeat):
+                    run = await run_once(mock_url, base_url, document, concurrency, batch_size, args, run_index)
+                    runs.append(run)
+                    print(f"⏱️  并发={concurrency} 批次={batch_size} #{run_index + 1}: "
+                          f"{run['wall_seconds']}s, {run['llm']['calls']} 次调用, "
+                          f"{run['counts']['test_cases']} 个用例{'' if run['success'] else ' ❌ ' + str(run['error'])}",
+                          file=sys.stderr)
+    finally:
+        await ai_client_manager.close_all()
+        if server:
+            server.stop()
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+
+    summary = summarize(runs)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "document_chars": len(document),
+            "args": vars(args),
+        },
+        "summary": summary,
+        "runs": runs,
+    }
+    if args.compare:
+        report["comparison"] = compare(summary, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="完整生成流水线基准测试")
+    parser.add_argument("--sections", type=int, default=10, help="需求文档章节数")
+    parser.add_argument("--rules-per-section", type=int, default=4, help="每个章节的业务规则条数")
+    parser.add_argument("--concurrency", default="2,4,8", help="并发数列表（逗号分隔）")
+    parser.add_argument("--batch-size", default="5,10", help="用例设计/优化每批最大数量列表（逗号分隔）")
+    parser.add_argument("--repeat", type=int, default=1, help="每个组合的运行次数")
+    parser.add_argument("--adaptive", action="store_true", help="启用自适应并发（AIMD）")
+    parser.add_argument("--retry-count", type=int, default=3, help="失败重试次数")
+    parser.add_argument("--context-mode", default="excerpt", choices=["full", "prefix", "excerpt", "summary"])
+    parser.add_argument("--pipeline-mode", default="streaming", choices=["streaming", "barrier"],
+                        help="阶段2-4流式重叠执行，或逐阶段等待（barrier）")
+    parser.add_argument("--quality-gate-threshold", type=int, default=80,
+                        help="用例质量分低于该值才送去优化，101表示全部优化")
+    parser.add_argument("--max-output-tokens", type=int, default=8000, help="模型单次输出token上限")
+    parser.add_argument("--ttft", type=float, default=0.3, help="模拟首token延迟中位数（秒）")
+    parser.add_argument("--ttft-sigma", type=float, default=0.3, help="首token延迟对数正态分布sigma")
+    parser.add_argument("--tps", type=float, default=200.0, help="模拟输出速度（tokens/s）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--seed", type=int, default=42, help="模拟供应商随机种子")
+    parser.add_argument("--replay", default=None, help="回放录制的真实响应（llm_record_path 生成的JSONL）")
+    parser.add_argument("--in-process", action="store_true", help="在当前进程的后台线程运行模拟供应商")
+    parser.add_argument("--verbose", action="store_true", help="保留流水线的日志输出")
+    parser.add_argument("--output", default=None, help="结果JSON路径（默认 benchmark_results/pipeline-<时间>.json）")
+    parser.add_argument("--compare", default=None, help="对比的历史基线JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    output = args.output or os.path.join(
+        "benchmark_results", f"pipeline-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps({"summary": report["summary"], "comparison": report.get("comparison")}, ensure_ascii=False, indent=2))
+    print(f"📁 结果已保存: {output}", file=sys.stderr)
@@ -0,0 +1,560 @@
+"""
+本地模拟 LLM 供应商（OpenAI 兼容）
+
+用于在不调用真实供应商的情况下测量、回归生成流水线的吞吐：
+- /v1/chat/completions：SSE 流式输出，可配置首token延迟（TTFT，对数正态分布）和输出速度（tokens/s）
+- 故障注入：按比例返回 5xx、429（带 Retry-After），可按模型单独配置（用于测试故障转移）
+- 固定输出：按提示词识别智能体类型（需求分析 / 测试点生成 / 用例设计 / 用例优化 / 文档摘要），
+  返回符合各自JSON结构的内容，数量与输入对应（如每个测试点一个用例）
+- 回放：加载 llm_record_path 录制的真实调用，按请求消息确定性地回放响应
+- 超过请求的 max_tokens 时截断输出并返回 finish_reason=length
+- 请求带 stream_options.include_usage 时，最后一个分片返回 usage
+- /mock/config：运行时查看、修改配置；/mock/stats：请求数、注入的错误、峰值并发等统计
+
+用法：
+    # 作为 ASGI 应用挂载 / 在后台线程启动
+    from benchmarks.mock_llm import MockLLMConfig, create_mock_app, start_mock_server
+    server = start_mock_server(MockLLMConfig(ttft=0.8, tokens_per_second=40))
+    ...  # 把模型的 base_url 配置为 server.base_url
+    server.stop()
+
+    # 作为独立进程运行（在 backend 目录下执行）
+    python -m benchmarks.mock_llm --port 8900 --ttft 0.8 --tps 40 --error-rate 0.02
+    python -m benchmarks.mock_llm --port 8900 --replay ./llm_recordings.jsonl --replay-timing
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.batch_planner import estimate_tokens  # noqa: E402
+from app.services.llm_recorder import load_recordings, request_key  # noqa: E402
+
+
+@dataclass
+class MockLLMConfig:
+    """模拟供应商配置（model_overrides 中可按模型覆盖除自身外的任意字段）"""
+    ttft: float = 0.5  # 首token延迟中位数（秒）
+    ttft_sigma: float = 0.0  # 首token延迟的对数正态分布sigma，0 表示固定延迟
+    tokens_per_second: float = 50.0  # 输出速度，0 表示不限速
+    chunk_chars: int = 8  # 每个SSE分片的字符数
+    error_rate: float = 0.0  # 返回 500 的比例
+    rate_limit_rate: float = 0.0  # 返回 429 的比例
+    retry_after: float = 1.0  # 429 响应的 Retry-After（秒）
+    seed: Optional[int] = None  # 随机种子（延迟和故障注入可复现）
+    replay_path: Optional[str] = None  # 录制文件（JSONL），为空时只返回固定输出
+    replay_strict: bool = False  # 回放未命中时返回404（否则退回固定输出）
+    replay_timing: bool = False  # 使用录制时的首token延迟和输出耗时
+    model_overrides: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def for_model(self, model: str) -> "MockLLMConfig":
+        overrides = self.model_overrides.get(model)
+        if not overrides:
+            return self
+        values = {**asdict(self), **overrides, "model_overrides": {}}
+        return MockLLMConfig(**values)
+
+    def update(self, values: Dict[str, Any]) -> None:
+        names = {f.name for f in fields(self)}
+        for key, value in values.items():
+            if key not in names:
+                raise ValueError(f"未知配置项: {key}")
+            setattr(self, key, value)
+
+
+# ==================== 固定输出 ====================
+
+_DESIGN_METHODS = ["equivalence_partitioning", "boundary_value", "scenario", "error_guessing"]
+_PRIORITIES = ["high", "medium", "low"]
+_REQUIREMENT_LINE_RE = re.compile(r"^\s*(#{1,6}\s+|\d+(\.\d+)*[\.、\s]|[-*]\s+)\S")
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    texts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text")
+    return "\n".join(texts)
+
+
+def _extract_json_array(text: str, marker: str) -> List[Any]:
+    """取 marker 之后的第一个JSON数组"""
+    start = text.find(marker)
+    if start < 0:
+        return []
+    start = text.find("[", start)
+    if start < 0:
+        return []
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text[start:])
+    except json.JSONDecodeError:
+        return []
+    return value if isinstance(value, list) else []
+
+
+def _steps(subject: str, count: int = 4) -> List[Dict[str, Any]]:
+    return [
+        {"step": i + 1, "action": f"针对「{subject}」执行第{i + 1}步操作", "expected": f"第{i + 1}步结果符合需求描述"}
+        for i in range(count)
+    ]
+
+
+def _requirement_analysis(text: str, seed: int) -> Dict[str, Any]:
+    lines = [l.strip() for l in text.splitlines() if _REQUIREMENT_LINE_RE.match(l)]
+    count = max(3, min(20, len(lines) // 3 or 3))
+    points = []
+    for i in range(count):
+        subject = lines[i * len(lines) // count][:40] if lines else f"需求{i + 1}"
+        points.append({
+            "content": f"系统应支持{subject}，并对非法输入给出明确提示",
+            "module": "默认模块",
+            "priority": _PRIORITIES[(seed + i) % 3],
+            "order_index": i + 1
+        })
+    return {"requirement_points": points}
+
+
+def _test_points(text: str, seed: int) -> Dict[str, Any]:
+    count = 3 + seed % 3
+    return {"test_points": [
+        {
+            "content": f"验证需求点的第{i + 1}个场景：输入合法、边界和非法数据时系统行为正确",
+            "test_type": "functional",
+            "design_method": _DESIGN_METHODS[(seed + i) % len(_DESIGN_METHODS)],
+            "priority": _PRIORITIES[(seed + i) % 3]
+        }
+        for i in range(count)
+    ]}
+
+
+def _test_cases(text: str, seed: int) -> Dict[str, Any]:
+    points = _extract_json_array(text, "【测试点列表】") or [{}]
+    cases = []
+    for i, tp in enumerate(points):
+        subject = str(tp.get("content", f"测试点{i + 1}"))[:30]
+        cases.append({
+            "test_point_id": tp.get("id"),
+            "title": f"{subject}-用例",
+            "description": f"验证{subject}",
+            "preconditions": "测试环境已部署，测试账号已创建",
+            "test_steps": _steps(subject, 4 + (seed + i) % 3),
+            "expected_result": "系统行为与需求描述一致",
+            "design_method": tp.get("design_method") or _DESIGN_METHODS[i % len(_DESIGN_METHODS)],
+            "test_type": tp.get("test_type") or "functional",
+            "priority": tp.get("priority") or "medium"
+        })
+    return {"test_cases": cases}
+
+
+def _optimized_cases(text: str, seed: int) -> Dict[str, Any]:
+    cases = _extract_json_array(text, "以下是需要优化的测试用例列表")
+    optimized = []
+    for tc in cases:
+        title = str(tc.get("title") or "测试用例")
+        optimized.append({
+            "id": tc.get("id"),
+            "title": title,
+            "description": tc.get("description") or f"验证{title}",
+            "preconditions": tc.get("preconditions") or "测试环境已部署",
+            "test_steps": _steps(title[:30], 5),
+            "expected_result": tc.get("expected_result") or "系统行为与需求描述一致"
+        })
+    return {"optimized_cases": optimized}
+
+
+def _digest(text: str, seed: int) -> Dict[str, Any]:
+    lines = [l.strip() for l in text.splitlines() if _REQUIREMENT_LINE_RE.match(l)]
+    return {"digest": "\n".join(lines[:60]) or "需求文档摘要"}
+
+
+def classify_prompt(text: str) -> str:
+    """按提示词内容识别智能体类型"""
+    if '{"digest"' in text:
+        return "digest"
+    if "以下是需要优化的测试用例列表" in text:
+        return "test_case_optimization"
+    if "【测试点列表】" in text:
+        return "test_case_design"
+    if "【需求点内容】" in text:
+        return "test_point_generation"
+    return "requirement_analysis"
+
+
+_GENERATORS = {
+    "requirement_analysis": _requirement_analysis,
+    "test_point_generation": _test_points,
+    "test_case_design": _test_cases,
+    "test_case_optimization": _optimized_cases,
+    "digest": _digest,
+}
+
+
+def _continuation_prefix(messages: List[Dict[str, Any]]) -> Optional[str]:
+    """续写请求中已输出的内容；不是续写请求时返回 None"""
+    if len(messages) >= 2 and messages[-2].get("role") == "assistant" and messages[-1].get("role") == "user":
+        content = messages[-2].get("content")
+        return content if isinstance(content, str) else None
+    return None
+
+
+def canned_response(messages: List[Dict[str, Any]]) -> Tuple[str, str]:
+    """生成符合智能体输出结构的固定响应，返回 (智能体类型, JSON文本)
+
+    同一请求的输出固定（随请求内容哈希变化，而非随机）；
+    续写请求（倒数第二条为已输出的 assistant 内容）返回剩余部分
+    """
+    partial = _continuation_prefix(messages)
+    if partial is not None:
+        kind, content = canned_response(messages[:-2])
+        return kind, content[len(partial):] if content.startswith(partial) else content
+    text = _prompt_text(messages)
+    kind = classify_prompt(text)
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    result = _GENERATORS[kind](text, seed)
+    return kind, "```json\n" + json.dumps(result, ensure_ascii=False, indent=2) + "\n```"
+
+
+# ==================== 回放 ====================
+
+class ReplayStore:
+    """按请求键索引的录制响应；同一请求录制了多次时按顺序循环回放"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        for entry in load_recordings(path):
+            self._entries.setdefault(entry["key"], []).append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._entries.values())
+
+    def lookup(self, messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        key = request_key(messages)
+        entries = self._entries.get(key)
+        if not entries:
+            return None
+        index = self._cursor.get(key, 0)
+        self._cursor[key] = index + 1
+        return entries[index % len(entries)]
+
+
+# ==================== 服务 ====================
+
+class MockLLMProvider:
+    """模拟供应商状态（配置、随机源、统计）"""
+
+    def __init__(self, config: Optional[MockLLMConfig] = None):
+        self.config = config or MockLLMConfig()
+        self.reset()
+
+    def reset(self) -> None:
+        self._random = random.Random(self.config.seed)
+        self._replay: Optional[ReplayStore] = None
+        if self.config.replay_path:
+            self._replay = ReplayStore(self.config.replay_path)
+            print(f"📼 [MockLLM] 已加载 {len(self._replay)} 条录制响应: {self.config.replay_path}")
+        self.in_flight = 0
+        self.stats: Dict[str, Any] = {
+            "requests": 0, "completed": 0, "server_errors": 0, "rate_limited": 0, "truncated": 0, "continuations": 0,
+            "replay_hits": 0, "replay_misses": 0, "prompt_tokens": 0, "output_tokens": 0,
+            "max_in_flight": 0, "by_kind": {}, "by_model": {}
+        }
+
+    def _ttft(self, config: MockLLMConfig) -> float:
+        if config.ttft <= 0:
+            return 0.0
+        if config.ttft_sigma <= 0:
+            return config.ttft
+        return self._random.lognormvariate(math.log(config.ttft), config.ttft_sigma)
+
+    def _inject_error(self, config: MockLLMConfig) -> Optional[JSONResponse]:
+        roll = self._random.random()
+        if roll < config.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit_error", "code": "rate_limited"}},
+                status_code=429,
+                headers={"Retry-After": f"{config.retry_after:g}"}
+            )
+        if roll < config.rate_limit_rate + config.error_rate:
+            self.stats["server_errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "Internal server error (mock)", "type": "server_error", "code": "internal_error"}},
+                status_code=500
+            )
+        return None
+
+    async def chat_completions(self, body: Dict[str, Any]):
+        model = body.get("model", "mock")
+        messages = body.get("messages") or []
+        max_tokens = body.get("max_tokens") or 0
+        config = self.config.for_model(model)
+
+        self.stats["requests"] += 1
+        self.stats["by_model"][model] = self.stats["by_model"].get(model, 0) + 1
+        self.stats["prompt_tokens"] += sum(estimate_tokens(m.get("content")) for m in messages)
+
+        error = self._inject_error(config)
+        if error is not None:
+            return error
+
+        ttft = self._ttft(config)
+        tokens_per_second = config.tokens_per_second
+        finish_reason = "stop"
+        entry = self._replay.lookup(messages) if self._replay else None
+        if entry is not None:
+            self.stats["replay_hits"] += 1
+            kind, content = "replay", entry["content"]
+            finish_reason = entry.get("finish_reason") or "stop"
+            if config.replay_timing:
+                ttft = entry.get("ttft") or 0.0
+                stream_seconds = max(0.0, (entry.get("elapsed") or 0.0) - ttft)
+                tokens = estimate_tokens(content)
+                tokens_per_second = tokens / stream_seconds if stream_seconds > 0 else 0
+        else:
+            if self._replay is not None:
+                self.stats["replay_misses"] += 1
+                if config.replay_strict:
+                    return JSONResponse(
+                        {"error": {"message": "No recorded response for this request (mock replay)", "type": "invalid_request_error"}},
+                        status_code=404
+                    )
+            if _continuation_prefix(messages) is not None:
+                self.stats["continuations"] += 1
+            kind, content = canned_response(messages)
+
+        if max_tokens and estimate_tokens(content) > max_tokens:
+            # 按比例截断到 max_tokens
+            content = content[:max(1, len(content) * max_tokens // estimate_tokens(content))]
+            finish_reason = "length"
+            self.stats["truncated"] += 1
+
+        self.stats["by_kind"][kind] = self.stats["by_kind"].get(kind, 0) + 1
+        usage = None
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {"prompt_tokens": sum(estimate_tokens(m.get("content")) for m in messages)}
+        return StreamingResponse(
+            self._stream(model, content, finish_reason, ttft, tokens_per_second, config.chunk_chars, usage),
+            media_type="text/event-stream"
+        )
+
+    async def _stream(
+        self,
+        model: str,
+        content: str,
+        finish_reason: str,
+        ttft: float,
+        tokens_per_second: float,
+        chunk_chars: int,
+        usage: Optional[Dict[str, int]] = None
+    ) -> AsyncIterator[bytes]:
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        completion_id = f"chatcmpl-mock-{self.stats['requests']}"
+        try:
+            if ttft > 0:
+                await asyncio.sleep(ttft)
+            start = time.perf_counter()
+            sent_tokens = 0
+            chunk_chars = max(1, chunk_chars)
+            for i in range(0, len(content), chunk_chars):
+                piece = content[i:i + chunk_chars]
+                if tokens_per_second > 0 and sent_tokens:
+                    # 按累计输出量计算应到达的时间，避免逐片 sleep 的误差累积
+                    delay = start + sent_tokens / tokens_per_second - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                sent_tokens += estimate_tokens(piece)
+                yield _sse({"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                            "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+            yield _sse({"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+            if usage is not None:
+                # stream_options.include_usage：最后一个分片只包含 usage
+                usage = {**usage, "completion_tokens": sent_tokens,
+                         "total_tokens": usage["prompt_tokens"] + sent_tokens}
+                yield _sse({"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                            "choices": [], "usage": usage})
+            yield b"data: [DONE]\n\n"
+            self.stats["completed"] += 1
+            self.stats["output_tokens"] += sent_tokens
+        finally:
+            self.in_flight -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "in_flight": self.in_flight}
+
+
+def _sse(payload: Dict[str, Any]) -> bytes:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def create_mock_app(config: Optional[MockLLMConfig] = None) -> FastAPI:
+    """创建模拟供应商 ASGI 应用（可直接 uvicorn 运行，或 mount 到其他应用下）"""
+    provider = MockLLMProvider(config)
+    app = FastAPI(title="Mock LLM Provider")
+    app.state.provider = provider
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        return await provider.chat_completions(await request.json())
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/mock/config")
+    async def get_config():
+        return asdict(provider.config)
+
+    @app.post("/mock/config")
+    async def update_config(request: Request):
+        try:
+            provider.config.update(await request.json())
+        except ValueError as e:
+            return JSONResponse({"detail": str(e)}, status_code=400)
+        provider.reset()
+        return asdict(provider.config)
+
+    @app.get("/mock/stats")
+    async def get_stats():
+        return provider.get_stats()
+
+    @app.post("/mock/reset")
+    async def reset():
+        provider.reset()
+        return provider.get_stats()
+
+    return app
+
+
+# ==================== 启动方式 ====================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class MockLLMServer:
+    """在后台线程运行的模拟供应商"""
+
+    def __init__(self, config: Optional[MockLLMConfig] = None, port: Optional[int] = None):
+        import uvicorn
+
+        self.port = port or _free_port()
+        self.app = create_mock_app(config)
+        self._server = uvicorn.Server(uvicorn.Config(
+            self.app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off"
+        ))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    @property
+    def provider(self) -> MockLLMProvider:
+        return self.app.state.provider
+
+    def start(self, timeout: float = 10.0) -> "MockLLMServer":
+        self._thread.start()
+        deadline = time.time() + timeout
+        while not self._server.started and time.time() < deadline:
+            time.sleep(0.05)
+        if not self._server.started:
+            raise Exception(f"模拟供应商启动超时（端口 {self.port}）")
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def start_mock_server(config: Optional[MockLLMConfig] = None, port: Optional[int] = None) -> MockLLMServer:
+    """在后台线程启动模拟供应商"""
+    return MockLLMServer(config, port).start()
+
+
+def spawn_mock_server(args: Optional[List[str]] = None, port: Optional[int] = None, timeout: float = 15.0):
+    """以子进程启动模拟供应商，返回 (进程, base_url)；args 为命令行参数，如 ["--ttft", "0.8"]"""
+    import httpx
+
+    port = port or _free_port()
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_llm", "--port", str(port), *(args or [])],
+        cwd=backend_dir
+    )
+    base_url = f"http://127.0.0.1:{port}/v1"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"模拟供应商进程已退出: {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/mock/stats", timeout=1.0)
+            return process, base_url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise Exception(f"模拟供应商启动超时（端口 {port}）")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地模拟 LLM 供应商（OpenAI 兼容）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft", type=float, default=0.5, help="首token延迟中位数（秒）")
+    parser.add_argument("--ttft-sigma", type=float, default=0.0, help="首token延迟对数正态分布sigma")
+    parser.add_argument("--tps", type=float, default=50.0, help="输出速度（tokens/s），0表示不限速")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="每个SSE分片的字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429响应的Retry-After（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--replay", default=None, help="录制文件（llm_record_path 生成的JSONL）")
+    parser.add_argument("--replay-strict", action="store_true", help="回放未命中时返回404")
+    parser.add_argument("--replay-timing", action="store_true", help="使用录制时的延迟和输出耗时")
+    parser.add_argument("--model-overrides", default=None, help='按模型覆盖配置的JSON，如 {"slow": {"ttft": 5}}')
+    args = parser.parse_args()
+
+    mock_config = MockLLMConfig(
+        ttft=args.ttft,
+        ttft_sigma=args.ttft_sigma,
+        tokens_per_second=args.tps,
+        chunk_chars=args.chunk_chars,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        replay_path=args.replay,
+        replay_strict=args.replay_strict,
+        replay_timing=args.replay_timing,
+        model_overrides=json.loads(args.model_overrides) if args.model_overrides else {}
+    )
+    print(f"🧪 [MockLLM] http://{args.host}:{args.port}/v1 ttft={args.ttft}s tps={args.tps}")
+    uvicorn.run(create_mock_app(mock_config), host=args.host, port=args.port, log_level="warning")
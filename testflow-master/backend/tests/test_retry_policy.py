@@ -0,0 +1,46 @@
+"""
+重试预算测试
+"""
+import time
+
+from app.services.retry_policy import RetryAttempt, RetryBudget
+
+
+def _failure(elapsed: float, retried: bool = True) -> RetryAttempt:
+    return RetryAttempt(
+        label="AI调用", model="mock", attempt=1, error_class="timeout",
+        error="AI调用超时", elapsed=elapsed, delay=1.0, retried=retried
+    )
+
+
+def test_single_timeout_does_not_exhaust_budget():
+    """一次耗时与任务超时相同的调用超时后仍可以重试"""
+    budget = RetryBudget(max_retries=30, max_seconds=300.0)
+    assert budget.can_retry(1.0)
+    budget.record(_failure(300.2))
+    assert budget.can_retry(1.0)
+
+
+def test_parallel_failures_are_not_summed():
+    """并行调用的失败耗时不会累加"""
+    budget = RetryBudget(max_retries=30, max_seconds=300.0)
+    for _ in range(10):
+        budget.record(_failure(30.0))
+    assert budget.can_retry(1.0)
+
+
+def test_sustained_failure_exhausts_budget_until_success():
+    """连续失败超过时长上限后不再重试，调用成功后重新计时"""
+    budget = RetryBudget(max_retries=30, max_seconds=300.0)
+    budget.record(_failure(300.2))
+    budget.failing_since = time.monotonic() - 299.5
+    assert not budget.can_retry(1.0)
+    budget.record_success()
+    assert budget.can_retry(1.0)
+
+
+def test_retry_count_limit():
+    budget = RetryBudget(max_retries=2, max_seconds=300.0)
+    budget.record(_failure(1.0))
+    budget.record(_failure(1.0))
+    assert not budget.can_retry(0.0)